@@ -0,0 +1,420 @@
+"""Benchmarks for the spam pipeline.
+
+Run with `python -m ml_spam.benchmark` from the directory one-up from the repo. By default it compares the preprocessing
+pipelines on the SpamAssassin data, so run `load_data.check_and_download()` (or `main`) first.
+
+With --pipeline it instead times every stage of the pipeline, from reading the archives to predicting, on synthetic
+corpora shaped like the SpamAssassin data (see make_synthetic_archives), at several corpus and vocabulary sizes. The
+results can be saved as a baseline (--save-baseline) and later runs compared against it (--baseline); the comparison
+lists the stages that got slower, and the exit status is 1 if there are any.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tarfile
+import tempfile
+import time
+
+import numpy as np
+
+from . import corpus, features, load_data, main, preprocess
+
+
+def sequential_tokens(email):
+    """The original normalization pipeline: one full pass over the email per step.
+
+    Args:
+        email (unicode): the email to convert
+
+    Returns:
+        list[unicode]: list of words, unstemmed
+    """
+    return [w for w in preprocess.to_list(preprocess.clean(preprocess.normalize(preprocess.lower(
+        preprocess.strip_header(email))))) if w]
+
+
+def sequential_word_list(email):
+    """The original make_word_list pipeline.
+
+    Args:
+        email (unicode): the email to convert
+
+    Returns:
+        list[unicode]: list of words
+    """
+    return preprocess.stem(sequential_tokens(email))
+
+
+def single_pass_tokens(email):
+    """preprocess.tokenize as a list, to compare against sequential_tokens."""
+    return list(preprocess.tokenize(email))
+
+
+def docs_per_second(func, emails, repeat=3):
+    """Time func over all the emails, returning the best throughput out of `repeat` runs.
+
+    Args:
+        func ((unicode) -> object): function to run on each email
+        emails (list[unicode]): the emails
+        repeat (int): number of runs
+
+    Returns:
+        float: emails per second
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.time()
+        for email in emails:
+            func(email)
+        best = min(best, time.time() - t)
+    return len(emails) / best
+
+
+def bench_preprocess(emails, repeat=3, stem=True):
+    """Compare the sequential and single-pass preprocessing pipelines.
+
+    Args:
+        emails (list[unicode]): the emails to preprocess
+        repeat (int): number of runs for each pipeline
+        stem (bool): include stemming; if False only the normalization/tokenization is timed
+
+    Returns:
+        dict[str, float]: docs/s for each pipeline, plus the fraction of emails on which they agree
+    """
+    if stem:
+        sequential, single_pass = sequential_word_list, preprocess.make_word_list
+    else:
+        sequential, single_pass = sequential_tokens, single_pass_tokens
+    agree = sum(1 for email in emails if sequential(email) == single_pass(email))
+    return {
+        'sequential': docs_per_second(sequential, emails, repeat),
+        'single pass': docs_per_second(single_pass, emails, repeat),
+        'agreement': agree / len(emails),
+    }
+
+
+def load_sample(max_emails):
+    """Load up to max_emails from each of the SpamAssassin archives.
+
+    Args:
+        max_emails (int): number of emails per archive
+
+    Returns:
+        list[str]: the emails
+    """
+    emails = []
+    for path, filenames in [(load_data.spam_path, load_data.spamassassin_spams),
+                            (load_data.ham_path, load_data.spamassassin_hams)]:
+        for filename in filenames:
+            emails.extend(load_data.load_spamassassin_tbz(os.path.join(path, filename), max_emails=max_emails))
+    return emails
+
+
+_letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+
+def make_vocabulary(size, rng):
+    """Make up distinct lower-case words.
+
+    Args:
+        size (int): number of words
+        rng (np.random.RandomState): random number generator
+
+    Returns:
+        list[str]: the words
+    """
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(_letters, rng.randint(3, 11))))
+    return sorted(words)
+
+
+def synthetic_email(rng, vocab, weights, n_words=200):
+    """Make up an email shaped like the SpamAssassin ones: headers, then a body of words with the odd number, dollar
+    amount, url, email address and html tag.
+
+    Args:
+        rng (np.random.RandomState): random number generator
+        vocab (list[str]): the words to draw from
+        weights (np.ndarray): probability of each word
+        n_words (int): mean number of words in the body
+
+    Returns:
+        bytes: the email
+    """
+    sender = '{}@{}.com'.format(*rng.choice(vocab[:1000], 2))
+    headers = ['From {} Mon Jan  1 00:00:00 2018'.format(sender),
+               'Received: from {0}.com (localhost [127.0.0.1]) by {0}.com'.format(rng.choice(vocab[:1000])),
+               'From: {}'.format(sender),
+               'To: {}@example.com'.format(rng.choice(vocab[:1000])),
+               'Subject: {}'.format(' '.join(rng.choice(vocab, 5, p=weights))),
+               'Message-Id: <{}@example.com>'.format(rng.randint(1 << 30))]
+    words = list(rng.choice(vocab, rng.poisson(n_words) + 1, p=weights))
+    for kind in rng.randint(6, size=max(1, len(words) // 20)):
+        i = rng.randint(len(words))
+        words[i] = [str(rng.randint(10000)), '$' + str(rng.randint(1000)),
+                    'http://www.{}.com/{}'.format(words[i], rng.randint(100)), words[i] + '@example.com',
+                    '<a href="http://{}.com">'.format(words[i]), '<br>'][kind]
+    return ('\n'.join(headers) + '\n\n' + ' '.join(words) + '\n').encode('utf-8')
+
+
+def make_synthetic_archives(directory, n_emails=1000, vocab_size=20000, spam_fraction=0.3, seed=0):
+    """Write a spam and a ham archive in the SpamAssassin format, with made-up emails.
+
+    Word frequencies follow Zipf's law; spam and ham rank the words a bit differently, so there's something to learn.
+    The same arguments always give the same archives, and archives that already exist aren't rewritten.
+
+    Args:
+        directory (str): where to write the archives
+        n_emails (int): total number of emails
+        vocab_size (int): number of distinct words
+        spam_fraction (float): fraction of the emails that are spam
+        seed (int): random seed
+
+    Returns:
+        list[(int, str)]: label and path of each archive, spam first, as load_data.spamassassin_archives
+    """
+    name = 'synthetic_{}_{}_{}_{}'.format(n_emails, vocab_size, spam_fraction, seed)
+    archives = [(load_data.SPAM, os.path.join(directory, name + '_spam.tar.bz2')),
+                (load_data.HAM, os.path.join(directory, name + '_ham.tar.bz2'))]
+    if all(os.path.exists(path) for _, path in archives):
+        return archives
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    rng = np.random.RandomState(seed)
+    vocab = make_vocabulary(vocab_size, rng)
+    weights = 1 / np.arange(1, vocab_size + 1)
+    weights /= weights.sum()
+    n_spam = int(round(n_emails * spam_fraction))
+    for (label, path), n in zip(archives, [n_spam, n_emails - n_spam]):
+        # mostly a shared ranking of the words, plus a fifth from a ranking of the class's own
+        class_weights = 0.8 * weights + 0.2 * weights[rng.permutation(vocab_size)]
+        with tarfile.open(path + '.tmp', 'w:bz2') as f:
+            for i in range(n):
+                email = synthetic_email(rng, vocab, class_weights)
+                info = tarfile.TarInfo('{}/{:05d}'.format('spam' if label == load_data.SPAM else 'ham', i))
+                info.size = len(email)
+                f.addfile(info, io.BytesIO(email))
+        os.rename(path + '.tmp', path)
+    return archives
+
+
+# the stages bench_pipeline times, in order, and the extra ones it times with steps=True
+pipeline_stages = ['load', 'preprocess', 'count_words', 'featurize', 'make_arrays', 'fit', 'predict']
+step_stages = ['strip_header', 'normalize', 'clean', 'stem']
+
+
+def bench_pipeline(archives, classifier='linear-svc', mode='symmetric difference', threshold=10, sparse=True,
+                   seed=0, steps=False):
+    """Time each stage of the pipeline, one after the other, on some archives.
+
+    The stages go through the same code as main.prep_data: load (read the archives), preprocess
+    (preprocess.make_word_lists into a corpus.Corpus per class, with a cold stem cache), count_words
+    (Corpus.count_words), featurize (picking the feature words and Corpus.featurize), make_arrays (stacking the rows
+    and splitting the sets), fit and predict.
+
+    With steps, preprocessing is also timed step by step through the original functions, as strip_header, normalize
+    (lower-casing and the replacements), clean (removing punctuation and splitting into words) and stem, to see where
+    its time goes. Those steps are extra stages; they don't feed the later ones.
+
+    Args:
+        archives (list[(int, str)]): label and path of each archive
+        classifier (str): the backend, see main.classifiers
+        mode (str): how to pick the feature words, see features.make_feature_dict
+        threshold (int): minimum count of a feature word, see features.get_top_words
+        sparse (bool): build sparse feature matrices
+        seed (int): seed for splitting the sets
+        steps (bool): also time the preprocessing steps, see above
+
+    Returns:
+        dict: 'emails': number of emails, 'seconds' and 'emails_per_second': dicts of stage -> value,
+            'peak_rss_mb': peak resident memory of this process, 'error_rate': on the test set
+    """
+    seconds = {}
+
+    def timed(stage, func, *args):
+        t = time.time()
+        result = func(*args)
+        seconds[stage] = time.time() - t
+        return result
+
+    records = timed('load', lambda: [r for label, path in archives
+                                     for r in load_data.iter_spamassassin_tbz(path, label)])
+    labels = np.array([r.label for r in records])
+    emails = [r.email for r in records]
+    records = None  # let the stages' inputs go as we go
+    if steps:
+        stripped = timed('strip_header', lambda: [preprocess.strip_header(e) for e in emails])
+        stripped = timed('normalize', lambda: [preprocess.normalize(preprocess.lower(e)) for e in stripped])
+        word_lists = timed('clean', lambda: [[w for w in preprocess.to_list(preprocess.clean(e)) if w]
+                                             for e in stripped])
+        stripped = None
+        preprocess.stem_cache.clear()
+        timed('stem', lambda: [preprocess.stem(wl) for wl in word_lists])
+        word_lists = None
+    preprocess.stem_cache.clear()
+
+    def make_corpora():
+        word_lists = preprocess.make_word_lists(emails)
+        return [corpus.Corpus.from_word_lists([wl for wl, label in zip(word_lists, labels) if label == wanted])
+                for wanted in (load_data.SPAM, load_data.HAM)]
+
+    spam_corpus, ham_corpus = timed('preprocess', make_corpora)
+    emails = None
+    spam_counts, ham_counts = timed('count_words', lambda: (spam_corpus.count_words(), ham_corpus.count_words()))
+
+    def featurize():
+        feature_dict = features.make_feature_dict(features.get_top_words(spam_counts, threshold),
+                                                  features.get_top_words(ham_counts, threshold), mode=mode)
+        return [c.featurize(feature_dict, sparse=sparse) for c in (spam_corpus, ham_corpus)]
+
+    spam_data, ham_data = timed('featurize', featurize)
+
+    def make_arrays():
+        x, y = features.make_arrays(spam_data, ham_data)
+        train, _, test = load_data.split_indices(y, seed=seed)
+        return x[train], y[train], x[test], y[test]
+
+    x_train, y_train, x_test, y_test = timed('make_arrays', make_arrays)
+    clf = timed('fit', main.make_classifier(classifier).fit, x_train, y_train)
+    predictions = timed('predict', clf.predict, x_test)
+    n = len(labels)
+    return {
+        'emails': n,
+        'seconds': seconds,
+        'emails_per_second': dict((stage, n / s if s else float('inf')) for stage, s in seconds.items()),
+        'peak_rss_mb': peak_rss_mb(),
+        'error_rate': float(np.abs(predictions - y_test).mean()),
+    }
+
+
+def peak_rss_mb():
+    """Get the peak resident memory of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def bench_scaling(directory, sizes=(1000, 2000, 4000), vocab_sizes=(20000,), repeat=1, **kwargs):
+    """Run bench_pipeline on synthetic corpora of several sizes.
+
+    Each run is in a fresh process, so that the peak memory is that of the run alone; with repeat > 1, the best time of
+    each stage is kept.
+
+    Args:
+        directory (str): where to put the synthetic archives, see make_synthetic_archives
+        sizes (iterable[int]): numbers of emails
+        vocab_sizes (iterable[int]): numbers of distinct words
+        repeat (int): number of runs of each corpus
+        **kwargs: passed on to bench_pipeline
+
+    Returns:
+        list[dict]: the results of bench_pipeline for each corpus, with its 'vocab_size'
+    """
+    results = []
+    for vocab_size in vocab_sizes:
+        for n_emails in sizes:
+            archives = make_synthetic_archives(directory, n_emails, vocab_size)
+            runs = []
+            for _ in range(repeat):
+                pool = multiprocessing.Pool(1)
+                try:
+                    runs.append(pool.apply(bench_pipeline, (archives,), kwargs))
+                finally:
+                    pool.close()
+                    pool.join()
+            result = runs[0]
+            result['seconds'] = dict((stage, min(r['seconds'][stage] for r in runs)) for stage in result['seconds'])
+            result['emails_per_second'] = dict((stage, n_emails / s if s else float('inf'))
+                                               for stage, s in result['seconds'].items())
+            result['peak_rss_mb'] = min(r['peak_rss_mb'] for r in runs)
+            result['vocab_size'] = vocab_size
+            results.append(result)
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_seconds=0.01):
+    """Find the stages that got slower, or runs that used more memory, than in a baseline.
+
+    Runs are matched by number of emails and vocabulary size; runs without a match are skipped.
+
+    Args:
+        results (list[dict]): from bench_scaling
+        baseline (list[dict]): earlier results from bench_scaling
+        tolerance (float): allowed slowdown, as a fraction of the baseline
+        min_seconds (float): ignore stages that took less than this in both, since they're mostly noise
+
+    Returns:
+        list[str]: a description of each regression; empty if there are none
+    """
+    baseline = dict(((r['emails'], r['vocab_size']), r) for r in baseline)
+    regressions = []
+    for result in results:
+        base = baseline.get((result['emails'], result['vocab_size']))
+        if base is None:
+            continue
+        name = '{} emails, {} words'.format(result['emails'], result['vocab_size'])
+        for stage, s in sorted(result['seconds'].items()):
+            b = base['seconds'].get(stage)
+            if b is not None and max(s, b) >= min_seconds and s > b * (1 + tolerance):
+                regressions.append('{}: {} took {:.3f} s, baseline {:.3f} s ({:+.0%})'.format(
+                    name, stage, s, b, s / b - 1))
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append('{}: peak RSS {:.0f} MB, baseline {:.0f} MB'.format(
+                name, result['peak_rss_mb'], base['peak_rss_mb']))
+    return regressions
+
+
+def print_pipeline_results(results):
+    """Print a table of throughput by stage for each run of bench_scaling."""
+    stages = pipeline_stages + [s for s in step_stages if all(s in r['seconds'] for r in results)]
+    print('{:>7} {:>7} '.format('emails', 'words') + ' '.join('{:>12}'.format(s) for s in stages) +
+          ' {:>9} {:>7}'.format('RSS (MB)', 'error'))
+    for r in results:
+        print('{:>7} {:>7} '.format(r['emails'], r['vocab_size']) +
+              ' '.join('{:>12.1f}'.format(r['emails_per_second'][s]) for s in stages) +
+              ' {:>9.1f} {:>7.2%}'.format(r['peak_rss_mb'], r['error_rate']))
+    print('(emails/s for each stage)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=200, help='emails to load from each archive')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per pipeline; the best is reported')
+    parser.add_argument('--pipeline', action='store_true', help='time the whole pipeline on synthetic corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000], help='corpus sizes, in emails')
+    parser.add_argument('--vocab-sizes', type=int, nargs='+', default=[20000], help='vocabulary sizes, in words')
+    parser.add_argument('--classifier', default='linear-svc', choices=list(main.classifiers))
+    parser.add_argument('--steps', action='store_true',
+                        help='with --pipeline, also time the preprocessing step by step (strip_header, normalize, ...)')
+    parser.add_argument('--data-dir', help='where to keep the synthetic archives; a temporary directory by default')
+    parser.add_argument('--save-baseline', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown relative to the baseline')
+    args = parser.parse_args()
+    if not args.pipeline:
+        sample = load_sample(args.emails)
+        for stem in (False, True):
+            results = bench_preprocess(sample, repeat=args.repeat, stem=stem)
+            print('with stemming' if stem else 'tokenization only')
+            print('  sequential:  {:8.1f} docs/s'.format(results['sequential']))
+            print('  single pass: {:8.1f} docs/s'.format(results['single pass']))
+            print('  agreement:   {:8.2%}'.format(results['agreement']))
+        sys.exit()
+    results = bench_scaling(args.data_dir or tempfile.mkdtemp(prefix='ml_spam_bench'), args.sizes, args.vocab_sizes,
+                            repeat=args.repeat, classifier=args.classifier, steps=args.steps)
+    print_pipeline_results(results)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        sys.exit(1 if regressions else 0)
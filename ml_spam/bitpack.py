@@ -0,0 +1,262 @@
+"""Bit-packed binary feature matrices.
+
+The feature vectors are all 0s and 1s, so a row only needs one bit per feature: 1/64th of a float64 array, or 1/8th
+of a uint8 one. A BitMatrix keeps its rows packed as with np.packbits (8 features per byte, the first in the high bit)
+and works on the packed bytes: a popcount of the AND of two rows is the number of features they share, of the XOR
+the number they differ in, which is all that dot products, Jaccard similarity and Hamming distance between rows need.
+Comparing a few rows with many is done that way; comparing many with many goes through BLAS on unpacked blocks.
+It's only unpacked into the dense or CSR matrices sklearn wants by `toarray` and `tocsr`, e.g. right before a fit.
+"""
+from __future__ import absolute_import, division
+import array
+
+import numpy as np
+from scipy import sparse
+
+# number of set bits in each byte value, and in each 16-bit value; looking up pairs of bytes takes half the time
+_popcounts8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_popcounts16 = (_popcounts8[:, np.newaxis] + _popcounts8[np.newaxis, :]).ravel()
+
+# max number of bytes of the temporaries made at a time when working on blocks of rows
+block_bytes = 2 ** 24
+
+# BitMatrix.dot of two matrices with at least this many rows each unpacks blocks of them into float32 and multiplies
+# those with BLAS, which beats popcounts once each row is compared with many others
+blas_rows = 64
+
+
+def popcount(bits):
+    """Count the set bits along the last axis of packed bits.
+
+    Args:
+        bits (np.ndarray): uint8 packed bits
+
+    Returns:
+        np.ndarray: int64 counts, with the shape of bits without the last axis
+    """
+    if bits.shape[-1] % 2 == 0 and bits.flags.c_contiguous:
+        return _popcounts16[bits.view(np.uint16)].sum(axis=-1, dtype=np.int64)
+    return _popcounts8[bits].sum(axis=-1, dtype=np.int64)
+
+
+class BitMatrix(object):
+    """m x n_features matrix of 0s and 1s, stored as m rows of packed bits."""
+
+    def __init__(self, bits, n_features):
+        """
+        Args:
+            bits (np.ndarray): m x ceil(n_features / 8) uint8 array, rows as from np.packbits(x, axis=1); may be a
+                memory map. The padding bits past n_features must be 0.
+            n_features (int): number of columns
+        """
+        self.bits = bits
+        self.n_features = n_features
+
+    @classmethod
+    def from_dense(cls, x):
+        """Pack a dense matrix; every nonzero entry becomes a 1.
+
+        Args:
+            x (np.ndarray): m x n matrix
+
+        Returns:
+            BitMatrix: the packed matrix
+        """
+        x = np.asarray(x)
+        return cls(np.packbits(x != 0, axis=1), x.shape[1])
+
+    @classmethod
+    def from_csr(cls, x):
+        """Pack a sparse matrix without densifying it; every stored nonzero becomes a 1.
+
+        Args:
+            x (scipy.sparse.spmatrix): m x n matrix
+
+        Returns:
+            BitMatrix: the packed matrix
+        """
+        x = sparse.csr_matrix(x)
+        rows = np.repeat(np.arange(x.shape[0], dtype=np.int64), np.diff(x.indptr))
+        nonzero = x.data != 0
+        return cls._from_coordinates(rows[nonzero], x.indices[nonzero], x.shape)
+
+    @classmethod
+    def from_indices(cls, rows, n_features):
+        """Pack the feature indices of each row, e.g. from features.feature_indices or features.hashed_indices.
+
+        Args:
+            rows (iterable[list[int]]): feature indices of each row
+            n_features (int): number of columns
+
+        Returns:
+            BitMatrix: the packed matrix
+        """
+        indices = array.array('i')
+        lengths = array.array('i')
+        for row in rows:
+            indices.extend(row)
+            lengths.append(len(row))
+        lengths = np.frombuffer(lengths, dtype=np.int32) if lengths else np.zeros(0, dtype=np.int32)
+        row_ids = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        columns = np.frombuffer(indices, dtype=np.int32) if indices else np.zeros(0, dtype=np.int32)
+        return cls._from_coordinates(row_ids, columns, (len(lengths), n_features))
+
+    @classmethod
+    def from_packbits(cls, bits, n_features):
+        """Wrap rows already packed with np.packbits(x, axis=1), e.g. a memory map from the feature store.
+
+        Args:
+            bits (np.ndarray): the packed rows; not copied
+            n_features (int): number of columns
+
+        Returns:
+            BitMatrix: the matrix
+        """
+        if bits.ndim != 2 or bits.shape[1] != -(-n_features // 8):
+            raise ValueError('Packed bits of shape {} are not rows of {} features'.format(bits.shape, n_features))
+        return cls(bits, n_features)
+
+    @classmethod
+    def _from_coordinates(cls, rows, columns, shape):
+        n_bytes = -(-shape[1] // 8)
+        # distinct (row, column) bits, sorted, each set with the weight of its bit within its byte; the sum of each run
+        # in the same byte is their OR. Only the uint8 result is as big as the matrix, the temporaries are per bit set
+        flat = np.unique(rows * (n_bytes * 8) + np.asarray(columns, dtype=np.int64))
+        bits = np.zeros(shape[0] * n_bytes, dtype=np.uint8)
+        if len(flat):
+            byte = flat >> 3
+            starts = np.flatnonzero(np.concatenate([[True], byte[1:] != byte[:-1]]))
+            bits[byte[starts]] = np.add.reduceat(np.right_shift(128, flat & 7).astype(np.uint8), starts)
+        return cls(bits.reshape(shape[0], n_bytes), shape[1])
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.n_features
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def __len__(self):
+        return self.bits.shape[0]
+
+    def __getitem__(self, rows):
+        """Select rows, with an int, slice, index array or boolean mask; always gives a BitMatrix."""
+        bits = self.bits[rows]
+        return BitMatrix(bits.reshape(1, -1) if bits.ndim == 1 else bits, self.n_features)
+
+    def row_counts(self):
+        """Get the number of 1s in each row.
+
+        Returns:
+            np.ndarray: m int64 counts
+        """
+        return np.concatenate([popcount(self.bits[i:i + n]) for i, n in self._blocks(1)] or [np.zeros(0, np.int64)])
+
+    def toarray(self, dtype=np.float64):
+        """Unpack into a dense matrix.
+
+        Args:
+            dtype (np.dtype): dtype of the matrix; sklearn works in float64
+
+        Returns:
+            np.ndarray: m x n_features matrix
+        """
+        return self._unpack(0, len(self), dtype)
+
+    def tocsr(self, dtype=np.float64):
+        """Unpack into a sparse matrix, a block of rows at a time.
+
+        Args:
+            dtype (np.dtype): dtype of the data
+
+        Returns:
+            scipy.sparse.csr_matrix: m x n_features matrix
+        """
+        indices, lengths = [], []
+        for i, n in self._blocks(8):
+            rows, columns = np.nonzero(np.unpackbits(self.bits[i:i + n], axis=1))
+            indices.append(columns.astype(np.int32))
+            lengths.append(np.bincount(rows, minlength=n))
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+        indptr = np.concatenate([[0]] + lengths).cumsum().astype(np.int32)
+        return sparse.csr_matrix((np.ones(len(indices), dtype=dtype), indices, indptr), shape=self.shape)
+
+    def dot(self, other):
+        """Multiply by another BitMatrix's transpose, or by weights.
+
+        Args:
+            other (BitMatrix or np.ndarray): a k x n_features BitMatrix, or n_features or n_features x k weights (e.g.
+                a linear classifier's coef)
+
+        Returns:
+            np.ndarray: m x k int64 numbers of shared 1s with each row of a BitMatrix, popcount(a & b); or the float
+                m or m x k products with the weights
+        """
+        if isinstance(other, BitMatrix):
+            if other.n_features != self.n_features:
+                raise ValueError('Cannot compare {} features with {}'.format(self.n_features, other.n_features))
+            if min(len(self), len(other)) >= blas_rows:
+                return self._dot_unpacked(other)
+            return self._dot_popcount(other)
+        other = np.asarray(other)
+        if other.shape[0] != self.n_features:
+            raise ValueError('Weights of shape {} do not match {} features'.format(other.shape, self.n_features))
+        # a packed byte unpacks into 8 uint8s
+        return np.concatenate([self._unpack(i, n, np.uint8).dot(other) for i, n in self._blocks(8)] or
+                              [np.zeros((0,) + other.shape[1:])])
+
+    def jaccard(self, other=None):
+        """Get the Jaccard similarity |a & b| / |a | b| of each row with each row of other; 1 for two empty rows.
+
+        Args:
+            other (BitMatrix): k x n_features matrix; self if None
+
+        Returns:
+            np.ndarray: m x k similarities
+        """
+        other = self if other is None else other
+        shared = self.dot(other)
+        union = self.row_counts()[:, np.newaxis] + other.row_counts()[np.newaxis, :] - shared
+        return np.where(union == 0, 1.0, shared / np.maximum(union, 1))
+
+    def hamming(self, other=None):
+        """Get the Hamming distance, the number of features present in just one of the two, between each row and each
+        row of other.
+
+        Args:
+            other (BitMatrix): k x n_features matrix; self if None
+
+        Returns:
+            np.ndarray: m x k int64 distances
+        """
+        other = self if other is None else other
+        # |a ^ b| = |a| + |b| - 2 |a & b|
+        return self.row_counts()[:, np.newaxis] + other.row_counts()[np.newaxis, :] - 2 * self.dot(other)
+
+    def _dot_popcount(self, other):
+        result = np.zeros((len(self), len(other)), dtype=np.int64)
+        n_bytes = self.bits.shape[1]
+        for i, n in self._blocks(len(other)):
+            # an even number of bytes per row, for popcount's 16-bit lookups; the padding stays 0
+            shared = np.zeros((n, len(other), n_bytes + n_bytes % 2), dtype=np.uint8)
+            np.bitwise_and(self.bits[i:i + n, np.newaxis, :], other.bits[np.newaxis, :, :], out=shared[..., :n_bytes])
+            result[i:i + n] = popcount(shared)
+        return result
+
+    def _dot_unpacked(self, other):
+        # float32 counts are exact up to 2 ** 24 features; a packed byte unpacks into 8 float32s
+        result = np.zeros((len(self), len(other)), dtype=np.int64)
+        for j, k in other._blocks(32):
+            b = other._unpack(j, k, np.float32).T
+            for i, n in self._blocks(32):
+                result[i:i + n, j:j + k] = self._unpack(i, n, np.float32).dot(b)
+        return result
+
+    def _unpack(self, i, n, dtype):
+        return np.unpackbits(self.bits[i:i + n], axis=1)[:, :self.n_features].astype(dtype)
+
+    def _blocks(self, scale):
+        """Split the rows into blocks whose temporaries, of scale bytes per packed byte, stay under block_bytes."""
+        n = max(1, block_bytes // max(1, scale * self.bits.shape[1]))
+        return [(i, min(n, len(self) - i)) for i in range(0, len(self), n)]
@@ -0,0 +1,71 @@
+"""Score whole mailboxes with a saved model (see model.py).
+
+The mailboxes are streamed (see load_data.iter_mailbox), preprocessed on a pool of processes as they're read (see
+preprocess.iter_word_lists), and featurized and classified in fixed-size batches, whose results are written out before
+the next batch is read. Memory use depends on the batch size and number of workers, not on the size of the mailboxes.
+
+Run with `python -m ml_spam.bulk <bundle> <mailbox> [<mailbox> ...]` from the directory one-up from the repo; the
+results are written as tab-separated lines of mailbox, message (see load_data.iter_mailbox), prediction and score.
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import itertools
+import logging
+import sys
+import time
+
+from . import load_data, model, preprocess
+
+
+def score_mailboxes(scoring_model, paths, out, batch_size=1000, workers=1):
+    """Score all the emails in some mailboxes, writing the results as they come.
+
+    Args:
+        scoring_model (model.Model): the model
+        paths (list[str]): mbox files and/or Maildir directories
+        out (file): where to write the results, one tab-separated line per email: mailbox, message, 1 for spam or 0 for
+            ham, and the score (empty if the classifier doesn't give one); there's a header line first
+        batch_size (int): number of emails to featurize and classify at a time
+        workers (int): number of processes for preprocessing, 0 for one per CPU
+
+    Returns:
+        dict[str, int]: number of emails scored and number predicted spam
+    """
+    records, originals = itertools.tee(r for path in paths for r in load_data.iter_mailbox(path))
+    word_lists = preprocess.iter_word_lists((r.email for r in records), workers=workers,
+                                            chunksize=max(1, min(100, batch_size // 2)), headers=scoring_model.headers)
+    out.write('mailbox\tmessage\tspam\tscore\n')
+    n_emails = n_spam = 0
+    t = time.time()
+    while True:
+        batch = list(itertools.islice(word_lists, batch_size))
+        if not batch:
+            break
+        predictions, scores = scoring_model.classify(scoring_model.featurize_word_lists(batch))
+        for i, prediction in enumerate(predictions):
+            record = next(originals)
+            score = '' if scores is None else repr(float(scores[i]))
+            out.write('{}\t{}\t{}\t{}\n'.format(record.source_archive, record.member_name, int(prediction), score))
+        out.flush()
+        n_emails += len(batch)
+        n_spam += int((predictions == 1).sum())
+        logging.info('%d emails scored, %.1f emails/s', n_emails, n_emails / (time.time() - t))
+    return {'emails': n_emails, 'spam': n_spam}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('bundle', help='model bundle directory')
+    parser.add_argument('mailboxes', nargs='+', help='mbox files or Maildir directories')
+    parser.add_argument('--out', help='file to write the results to; stdout by default')
+    parser.add_argument('--batch-size', type=int, default=1000, help='emails classified at a time')
+    parser.add_argument('--workers', type=int, default=0, help='preprocessing processes; 0 for one per CPU')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        counts = score_mailboxes(model.Model.load(args.bundle), args.mailboxes, out, args.batch_size, args.workers)
+    finally:
+        if args.out:
+            out.close()
+    logging.info('%d emails, %d spam', counts['emails'], counts['spam'])
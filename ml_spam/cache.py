@@ -0,0 +1,110 @@
+"""On-disk cache of preprocessed emails.
+
+Each archive's word lists are stored under `cache_dir` as a saved corpus.Corpus, i.e. three files sharing a prefix:
+    <archive>.<key>.tokens.npy: int32 word ids of all the emails, one after another
+    <archive>.<key>.offsets.npy: int64 start of each email in tokens, plus the end of the last one
+    <archive>.<key>.vocab.txt: the words, utf-8, one per line, in id order
+The key combines a hash of the archive's contents and preprocess.fingerprint(), so changing either the corpus or the
+preprocessing configuration makes a new entry, and the old entries for that archive are removed when it's written.
+Word lists with header tokens (see preprocess.make_word_list) are entries of their own, <archive>.headers.<key>.*, which
+don't replace the ones without.
+"""
+from __future__ import absolute_import
+import glob
+import hashlib
+import itertools
+import os
+
+from . import corpus, instrument, load_data, preprocess
+
+cache_dir = os.path.join(load_data.data_dir, 'cache')
+
+
+def archive_hash(path):
+    """Hash the contents of an archive.
+
+    Args:
+        path (str): the file
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def entry_prefix(path, headers=False):
+    """Get the path of the cache entry for an archive, for the current preprocessing configuration.
+
+    Args:
+        path (str): the archive
+        headers (bool): for word lists with header tokens
+
+    Returns:
+        str: path of the entry, without the .tokens.npy etc. suffixes
+    """
+    key = archive_hash(path)[:16] + preprocess.fingerprint(headers)[:16]
+    return os.path.join(cache_dir, _entry_name(path, headers) + '.' + key)
+
+
+def _entry_name(path, headers):
+    return os.path.basename(path) + ('.headers' if headers else '')
+
+
+def load(archives, workers=1, headers=False):
+    """Get the word lists of each archive, preprocessing and caching the ones that aren't in the cache.
+
+    Missing archives are preprocessed together with preprocess_archives.
+
+    Args:
+        archives (list[(int, str)]): label and path of each archive, e.g. from load_data.spamassassin_archives()
+        workers (int): number of processes to use when preprocessing, 0 for one per CPU
+        headers (bool): word lists with header tokens, see preprocess.make_word_list
+
+    Returns:
+        list[corpus.Corpus]: the word lists of each archive, in the same order, with memory-mapped arrays
+    """
+    prefixes = [entry_prefix(path, headers) for _, path in archives]
+    missing = [i for i, prefix in enumerate(prefixes) if not os.path.exists(prefix + '.vocab.txt')]
+    instrument.count('cache_hits', len(archives) - len(missing))
+    instrument.count('cache_misses', len(missing))
+    if missing:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        corpora = preprocess_archives([archives[i] for i in missing], workers, headers)
+        for i, c in zip(missing, corpora):
+            name = _entry_name(archives[i][1], headers)
+            for stale in glob.glob(os.path.join(cache_dir, name + '.*')):
+                # with and without header tokens are kept side by side
+                if not stale.startswith(prefixes[i] + '.') and (headers or '.headers.' not in stale):
+                    os.remove(stale)
+            c.save(prefixes[i])
+    return [corpus.Corpus.load(prefix) for prefix in prefixes]
+
+
+def preprocess_archives(archives, workers=1, headers=False):
+    """Preprocess all the emails in some archives.
+
+    With more than one worker, the archives are decompressed in parallel and the emails are preprocessed on a pool as
+    they come out (see load_data.iter_archive_batches and preprocess.iter_word_lists).
+
+    Args:
+        archives (list[(int, str)]): label and path of each archive
+        workers (int): number of processes to use, 0 for one per CPU
+        headers (bool): also add header tokens, see preprocess.make_word_list
+
+    Returns:
+        list[corpus.Corpus]: the word lists of each archive, in the same order
+    """
+    builders = dict((os.path.basename(path), corpus.CorpusBuilder()) for _, path in archives)
+    if workers == 1:
+        records = (r for label, path in archives for r in load_data.iter_spamassassin_tbz(path, label))
+    else:
+        records = (r for batch in load_data.iter_archive_batches(archives, workers=workers) for r in batch)
+    records, originals = itertools.tee(records)
+    for word_list in preprocess.iter_word_lists((r.email for r in records), workers=workers, headers=headers):
+        builders[next(originals).source_archive].add(word_list)
+    return [builders[os.path.basename(path)].build() for _, path in archives]
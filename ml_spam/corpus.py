@@ -0,0 +1,243 @@
+"""Compact storage for a corpus of word lists.
+
+Each word is interned into a vocabulary table and the word lists are stored back to back as integer ids in one flat
+int32 array, with an array of offsets marking where each one starts. This takes a fraction of the memory of lists of
+strings, and counting and featurizing can work on the id arrays with numpy instead of looping over strings.
+"""
+from __future__ import absolute_import
+import array
+import collections
+import os
+
+import numpy as np
+from scipy import sparse
+
+from . import features, instrument
+
+
+class Corpus(object):
+    """Read-only sequence of word lists, stored as word ids.
+
+    Word list i is [vocab[t] for t in tokens[offsets[i]:offsets[i+1]]].
+    """
+
+    def __init__(self, vocab, tokens, offsets):
+        """
+        Args:
+            vocab (list[unicode]): the words, by id
+            tokens (np.ndarray): int32 word ids of all the word lists, concatenated
+            offsets (np.ndarray): int64 start of each word list in tokens, plus the end of the last one
+        """
+        self.vocab = vocab
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('corpus index out of range')
+        vocab = self.vocab
+        return [vocab[t] for t in self.ids(i).tolist()]
+
+    def __iter__(self):
+        vocab, tokens, offsets = self.vocab, self.tokens, self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield [vocab[t] for t in tokens[start:end].tolist()]
+
+    def ids(self, i):
+        """Get word list i as word ids.
+
+        Args:
+            i (int): index of the word list
+
+        Returns:
+            np.ndarray: the word ids
+        """
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def doc_ids(self):
+        """Get the index of the word list each token belongs to.
+
+        Returns:
+            np.ndarray: int64 array the same length as tokens
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    @classmethod
+    def from_word_lists(cls, word_lists):
+        """Build a corpus out of word lists.
+
+        Args:
+            word_lists (iterable[list[unicode]]): the word lists
+
+        Returns:
+            Corpus: the corpus
+        """
+        builder = CorpusBuilder()
+        for word_list in word_lists:
+            builder.add(word_list)
+        return builder.build()
+
+    @classmethod
+    def concatenate(cls, corpora):
+        """Join corpora one after another, merging their vocabularies.
+
+        Args:
+            corpora (list[Corpus]): the corpora
+
+        Returns:
+            Corpus: a corpus with all the word lists, in order
+        """
+        ids = {}
+        tokens, offsets = [], [np.zeros(1, dtype=np.int64)]
+        for corpus in corpora:
+            remap = np.array([ids.setdefault(w, len(ids)) for w in corpus.vocab], dtype=np.int32)
+            tokens.append(remap[corpus.tokens])
+            offsets.append(np.asarray(corpus.offsets[1:], dtype=np.int64) + offsets[-1][-1])
+        vocab = sorted(ids, key=ids.get)
+        return cls(vocab, np.concatenate(tokens) if tokens else np.zeros(0, dtype=np.int32), np.concatenate(offsets))
+
+    def subset(self, indices):
+        """Take some of the word lists; the vocabulary is shared.
+
+        Args:
+            indices (iterable[int]): indices of the word lists to take, in order
+
+        Returns:
+            Corpus: the selected word lists
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts, ends = self.offsets[:-1][indices], self.offsets[1:][indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        # position in the new tokens -> position in the old ones
+        positions = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1] - starts, ends - starts)
+        return Corpus(self.vocab, self.tokens[positions], offsets)
+
+    def count_words(self, deduplicate=True):
+        """Count words, as features.count_words, but with np.bincount on the word ids.
+
+        Args:
+            deduplicate (bool): count only the occurrence of a word in a word list, not the number of times it appears
+
+        Returns:
+            collections.Counter: word counts
+        """
+        counts = features.count_ids(self.tokens, self.offsets, len(self.vocab), deduplicate)
+        vocab = self.vocab
+        return collections.Counter(dict((vocab[i], c) for i, c in enumerate(counts.tolist()) if c))
+
+    def featurize(self, feature_dict, sparse=True, dtype=np.float64):
+        """Build the feature matrix of all the word lists, as features.featurize_sparse, without looping over words.
+
+        Args:
+            feature_dict (dict[unicode, int]): maps feature -> index
+            sparse (bool): return a sparse matrix; if False, a dense array
+            dtype (np.dtype): dtype of the data, see features.indices_to_csr
+
+        Returns:
+            scipy.sparse.csr_matrix or np.ndarray: m x n feature matrix
+        """
+        columns = np.array([feature_dict.get(w, -1) for w in self.vocab], dtype=np.int64)
+        x = self._to_csr(columns, len(feature_dict), dtype)
+        return x if sparse else x.toarray()
+
+    def featurize_hashed(self, n_features=features.hash_features, dtype=np.float64):
+        """Build the feature matrix with the hashing trick, as features.featurize_hashed with single words.
+
+        Args:
+            n_features (int): number of buckets, i.e. columns
+            dtype (np.dtype): dtype of the data, see features.indices_to_csr
+
+        Returns:
+            scipy.sparse.csr_matrix: m x n_features feature matrix
+        """
+        columns = np.array([features.hashed_indices([w], n_features)[0] for w in self.vocab], dtype=np.int64)
+        return self._to_csr(columns, n_features, dtype)
+
+    def _to_csr(self, columns, n_features, dtype):
+        """Build a binary matrix with a 1 at (i, columns[t]) for each word id t in word list i; -1 columns are skipped.
+        """
+        if len(self.vocab):
+            token_columns = columns[self.tokens]
+        else:
+            token_columns = np.zeros(0, dtype=np.int64)
+        keep = token_columns >= 0
+        # unique (row, column) pairs, sorted by row then column
+        cells = np.unique(self.doc_ids()[keep] * n_features + token_columns[keep])
+        rows, cols = np.divmod(cells, n_features)
+        indptr = np.zeros(len(self) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows, minlength=len(self)), out=indptr[1:])
+        data = np.ones(len(cells), dtype=dtype)
+        instrument.count('feature_rows', len(self))
+        instrument.count('feature_nonzeros', len(cells))
+        return sparse.csr_matrix((data, cols.astype(np.int32), indptr), shape=(len(self), n_features))
+
+    def save(self, prefix):
+        """Save the corpus as prefix.tokens.npy, prefix.offsets.npy and prefix.vocab.txt (utf-8, one word per line).
+
+        Each file is written under a temporary name and moved into place; the vocab goes last, so a corpus whose vocab
+        file exists is complete.
+
+        Args:
+            prefix (str): path to save to, without the suffixes
+        """
+        for suffix, save in [('.tokens.npy', lambda f: np.save(f, np.asarray(self.tokens, dtype=np.int32))),
+                             ('.offsets.npy', lambda f: np.save(f, np.asarray(self.offsets, dtype=np.int64))),
+                             ('.vocab.txt', lambda f: features.write_words(f, self.vocab))]:
+            with open(prefix + suffix + '.tmp', 'wb') as f:
+                save(f)
+            os.rename(prefix + suffix + '.tmp', prefix + suffix)
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        """Load a corpus saved with `save`.
+
+        Args:
+            prefix (str): path it was saved to, without the suffixes
+            mmap (bool): memory-map the arrays rather than reading them in
+
+        Returns:
+            Corpus: the corpus
+        """
+        vocab = features.read_words(prefix + '.vocab.txt')
+        mmap_mode = 'r' if mmap else None
+        tokens = np.load(prefix + '.tokens.npy', mmap_mode=mmap_mode)
+        offsets = np.load(prefix + '.offsets.npy', mmap_mode=mmap_mode)
+        return cls(vocab, tokens, offsets)
+
+
+class CorpusBuilder(object):
+    """Interns the words of word lists as they are added, to build a Corpus."""
+
+    def __init__(self):
+        self.ids = {}
+        self.tokens = array.array('i')
+        self.offsets = [0]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, word_list):
+        """Add a word list.
+
+        Args:
+            word_list (list[unicode]): the words
+        """
+        ids = self.ids
+        self.tokens.extend(ids.setdefault(word, len(ids)) for word in word_list)
+        self.offsets.append(len(self.tokens))
+
+    def build(self):
+        """Get the corpus of the word lists added so far.
+
+        Returns:
+            Corpus: the corpus
+        """
+        vocab = sorted(self.ids, key=self.ids.get)
+        tokens = np.array(np.frombuffer(self.tokens, dtype=np.int32)) if self.tokens else np.zeros(0, dtype=np.int32)
+        return Corpus(vocab, tokens, np.array(self.offsets, dtype=np.int64))
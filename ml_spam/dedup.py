@@ -0,0 +1,287 @@
+"""Find near-duplicate emails with MinHash and locality-sensitive hashing.
+
+Each word list is turned into its set of shingles (runs of `shingle` consecutive words), and its MinHash signature is
+the minimum of each of num_perm random hash functions over those shingles. The fraction of places where two emails'
+signatures agree estimates the Jaccard similarity of their shingle sets. The signatures are cut into bands of rows, and
+emails whose signatures are the same in any band land in the same bucket; only those candidates are compared, rather
+than every pair, and the ones whose signatures agree in at least `threshold` of their places are put in one group.
+
+Signatures are computed with numpy a batch of word lists at a time, and only the signatures are kept, so corpora can
+be streamed through a Deduplicator.
+"""
+from __future__ import absolute_import, division
+import itertools
+import zlib
+
+import numpy as np
+
+# default minimum estimated Jaccard similarity of near-duplicates
+default_threshold = 0.8
+
+# shingle hashes are mapped to 32 bits by (a x + b) mod _prime; a and b are < 2 ** 31, so nothing overflows 64 bits
+_prime = np.uint64(4294967311)
+_mask32 = np.uint64(0xffffffff)
+_empty = np.uint32(0xffffffff)
+
+# max number of bytes of the hash values computed at a time
+block_bytes = 2 ** 24
+
+# max number of word hashes a MinHasher keeps; it starts over when it has this many, so memory stays bounded however
+# large the vocabulary of a stream gets
+max_cached_words = 200000
+
+
+def lsh_bands(num_perm, threshold):
+    """Pick how to cut signatures into bands.
+
+    Emails with a Jaccard similarity s share a band with probability 1 - (1 - s ** rows) ** bands, which rises most
+    steeply around (1 / bands) ** (1 / rows). This picks the band size that puts that point closest below the
+    threshold, to miss few near-duplicates; the candidates are checked against the threshold afterwards anyway.
+
+    Args:
+        num_perm (int): length of the signatures
+        threshold (float): minimum Jaccard similarity of near-duplicates
+
+    Returns:
+        (int, int): number of bands, rows per band
+    """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(bands, rows) for bands, rows in options if (1 / bands) ** (1 / rows) <= threshold]
+    return max(below or options[:1], key=lambda option: (1 / option[0]) ** (1 / option[1]))
+
+
+class MinHasher(object):
+    """Computes MinHash signatures of word lists."""
+
+    def __init__(self, num_perm=128, shingle=3, seed=1):
+        """
+        Args:
+            num_perm (int): number of hash functions, i.e. length of the signatures
+            shingle (int): number of consecutive words per shingle; word lists shorter than that are one shingle
+            seed (int): seed for the hash functions; signatures are only comparable with the same seed
+        """
+        self.num_perm = num_perm
+        self.shingle = shingle
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2 ** 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 2 ** 31, size=num_perm).astype(np.uint64)
+        self._mix = rng.randint(1, 2 ** 31, size=shingle).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self._word_hashes = {}
+
+    def signatures(self, word_lists):
+        """Get the MinHash signatures of word lists.
+
+        Args:
+            word_lists (iterable[list[unicode]]): the word lists, e.g. from preprocess.make_word_list, or a
+                corpus.Corpus
+
+        Returns:
+            np.ndarray: m x num_perm uint32 signatures; an empty word list gets all 0xffffffff
+        """
+        word_lists = list(word_lists)
+        signatures = np.empty((len(word_lists), self.num_perm), dtype=np.uint32)
+        # as many word lists at a time as keep the num_perm hash values of each shingle under block_bytes
+        per_block = max(1, block_bytes // (8 * self.num_perm))
+        start = 0
+        while start < len(word_lists):
+            end, n_words = start, 0
+            while end < len(word_lists) and (end == start or n_words + len(word_lists[end]) <= per_block):
+                n_words += len(word_lists[end])
+                end += 1
+            signatures[start:end] = self._signatures(word_lists[start:end])
+            start = end
+        return signatures
+
+    def _signatures(self, word_lists):
+        hashes = self._hash_words(word_lists)
+        lengths = np.array([len(wl) for wl in word_lists], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        # combine the hashes of each run of up to `shingle` words that doesn't cross into the next word list
+        position = np.arange(len(hashes), dtype=np.int64)
+        end_of = np.repeat(ends, lengths)
+        combined = np.zeros(len(hashes), dtype=np.uint64)
+        for j in range(self.shingle):
+            inside = position + j < end_of
+            combined[inside] += hashes[position[inside] + j] * self._mix[j]
+        # a shingle starts at each position with `shingle` words left in its word list, or at the start of a shorter one
+        keep = (position + self.shingle <= end_of) | np.in1d(position, starts)
+        shingles = (combined[keep] >> np.uint64(32)) ^ (combined[keep] & _mask32)
+        signatures = np.empty((len(word_lists), self.num_perm), dtype=np.uint32)
+        signatures[lengths == 0] = _empty
+        if len(shingles):
+            values = (shingles[:, np.newaxis] * self._a + self._b) % _prime & _mask32
+            first = np.searchsorted(np.flatnonzero(keep), starts[lengths > 0])
+            signatures[lengths > 0] = np.minimum.reduceat(values, first, axis=0)
+        return signatures
+
+    def _hash_words(self, word_lists):
+        word_hashes = self._word_hashes
+        hashes = []
+        if len(word_hashes) >= max_cached_words:
+            word_hashes.clear()
+        for word in itertools.chain.from_iterable(word_lists):
+            h = word_hashes.get(word)
+            if h is None:
+                h = zlib.crc32(word if isinstance(word, bytes) else word.encode('utf-8')) & 0xffffffff
+                word_hashes[word] = h
+            hashes.append(h)
+        return np.array(hashes, dtype=np.uint64)
+
+
+class Deduplicator(object):
+    """Groups streamed word lists with their near-duplicates, keeping just the signatures of what it's seen."""
+
+    def __init__(self, threshold=default_threshold, num_perm=128, shingle=3, seed=1):
+        """
+        Args:
+            threshold (float): minimum estimated Jaccard similarity of the shingle sets of near-duplicates
+            num_perm (int): length of the signatures; longer ones estimate the similarity more precisely
+            shingle (int): number of consecutive words per shingle
+            seed (int): seed for the hash functions
+        """
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle, seed)
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self._band_mix = np.random.RandomState(seed).randint(1, 2 ** 31, size=self.rows).astype(np.uint64)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self._parents = []
+
+    def __len__(self):
+        return len(self._parents)
+
+    def add(self, word_lists):
+        """Add a batch of word lists.
+
+        Args:
+            word_lists (iterable[list[unicode]]): the word lists
+
+        Returns:
+            np.ndarray: the group of each new word list so far, see `groups`
+        """
+        return self.add_signatures(self.hasher.signatures(word_lists))
+
+    def add_signatures(self, signatures):
+        """Add a batch of word lists by their signatures, e.g. computed with a MinHasher while streaming them.
+
+        Args:
+            signatures (np.ndarray): m x num_perm signatures from a MinHasher with this one's num_perm, shingle and
+                seed
+
+        Returns:
+            np.ndarray: the group of each new word list so far, see `groups`
+        """
+        # one hash per band of each signature, as its bucket
+        keys = (signatures.reshape(len(signatures), self.bands, self.rows) * self._band_mix).sum(axis=2)
+        first = len(self)
+        for signature, row_keys in zip(signatures, keys.tolist()):
+            i = len(self._parents)
+            self._parents.append(i)
+            self._signatures.append(signature)
+            for bucket, key in zip(self._buckets, row_keys):
+                # a member of each group that has landed in the bucket; compare with all of them, as near-duplicates
+                # can share a bucket with something that's like neither of them
+                members = bucket.setdefault(key, [])
+                joined = False
+                for j in members:
+                    if self._find(j) == self._find(i):
+                        joined = True
+                    elif self.similarity(i, j) >= self.threshold:
+                        self._union(i, j)
+                        joined = True
+                if not joined:
+                    members.append(i)
+        return np.array([self._find(i) for i in range(first, len(self))], dtype=np.int64)
+
+    def similarity(self, i, j):
+        """Estimate the Jaccard similarity of two of the word lists from their signatures.
+
+        Args:
+            i (int): index of one, in the order they were added
+            j (int): index of the other
+
+        Returns:
+            float: the fraction of places their signatures agree in
+        """
+        return np.count_nonzero(self._signatures[i] == self._signatures[j]) / self.hasher.num_perm
+
+    def groups(self):
+        """Get the group of each word list added so far, as the index of its first member.
+
+        Adding more word lists can merge groups, so this can change.
+
+        Returns:
+            np.ndarray: index of the first word list of each word list's group; i for word list i if it has no earlier
+                near-duplicate
+        """
+        return np.array([self._find(i) for i in range(len(self))], dtype=np.int64)
+
+    def _find(self, i):
+        parents = self._parents
+        root = i
+        while parents[root] != root:
+            root = parents[root]
+        while parents[i] != root:
+            parents[i], i = root, parents[i]
+        return root
+
+    def _union(self, i, j):
+        i, j = self._find(i), self._find(j)
+        self._parents[max(i, j)] = min(i, j)
+
+
+def find_duplicates(word_lists, labels=None, threshold=default_threshold, batch_size=1000, **kwargs):
+    """Group a stream of word lists with their near-duplicates.
+
+    Args:
+        word_lists (iterable[list[unicode]]): the word lists, e.g. a generator of preprocess.make_word_list output
+        labels (iterable[int]): label of each word list, to only group word lists with the same label; None to group
+            across all of them
+        threshold (float): minimum estimated Jaccard similarity of near-duplicates
+        batch_size (int): number of word lists to hash at a time
+        **kwargs: num_perm, shingle and seed for the Deduplicator
+
+    Returns:
+        np.ndarray: for each word list, the index of the first word list of its group
+    """
+    hasher = MinHasher(**kwargs)
+    word_lists = iter(word_lists)
+    batches = iter(lambda: list(itertools.islice(word_lists, batch_size)), [])
+    signatures = [hasher.signatures(batch) for batch in batches] or [np.zeros((0, hasher.num_perm), np.uint32)]
+    return group_signatures(np.concatenate(signatures), labels, threshold, **kwargs)
+
+
+def group_signatures(signatures, labels=None, threshold=default_threshold, **kwargs):
+    """Group word lists with their near-duplicates by their signatures.
+
+    Args:
+        signatures (np.ndarray): m x num_perm signatures, from a MinHasher with the same num_perm, shingle and seed
+        labels (iterable[int]): label of each word list, to only group word lists with the same label; None to group
+            across all of them
+        threshold (float): minimum estimated Jaccard similarity of near-duplicates
+        **kwargs: num_perm, shingle and seed for the Deduplicator
+
+    Returns:
+        np.ndarray: for each word list, the index of the first word list of its group
+    """
+    labels = np.zeros(len(signatures)) if labels is None else np.asarray(list(labels))
+    groups = np.arange(len(signatures), dtype=np.int64)
+    for label in np.unique(labels):
+        indices = np.flatnonzero(labels == label)
+        deduplicator = Deduplicator(threshold, **kwargs)
+        deduplicator.add_signatures(signatures[indices])
+        groups[indices] = indices[deduplicator.groups()]
+    return groups
+
+
+def first_of_groups(groups):
+    """Get which items to keep to collapse each group to its first member.
+
+    Args:
+        groups (np.ndarray): group of each item, from find_duplicates
+
+    Returns:
+        np.ndarray: boolean mask of the first member of each group
+    """
+    return groups == np.arange(len(groups))
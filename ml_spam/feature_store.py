@@ -0,0 +1,136 @@
+"""On-disk store of featurized train/cv/test sets, opened back as memory maps.
+
+A store is a directory (by default under load_data.data_dir/features) holding the six arrays that main.prep_data
+returns, plus the feature dict:
+    manifest.json: format version, and the kind, shape and dtype of each set's X
+    x_<set>.data.npy, x_<set>.indices.npy, x_<set>.indptr.npy: the CSR components of a sparse X
+    x_<set>.bits.npy: a dense 0/1 X, bit-packed along the rows with np.packbits (so 1/64th the size of float64), see
+        bitpack.py
+    y_<set>.npy: the labels
+    features.txt: the feature words, utf-8, one per line, in index order (not there in hashing mode)
+for each <set> in train, cv and test. Loading memory-maps the arrays read-only, so several processes (e.g.
+hyperparameter jobs on one machine) share the same pages of the OS's page cache rather than each holding a copy. That
+holds for sparse X, which sklearn uses as it is; a bit-packed dense X is unpacked into a private copy in each process
+(unless it's loaded with unpack=False), so only its packed bits are shared.
+"""
+from __future__ import absolute_import
+import io
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from . import bitpack, features, load_data
+
+# bump this when changing the layout of a store
+format_version = 1
+store_dir = os.path.join(load_data.data_dir, 'features')
+set_names = ['train', 'cv', 'test']
+
+
+def default_path(name):
+    """Get the path of a store under store_dir.
+
+    Args:
+        name (str): name of the store
+
+    Returns:
+        str: the directory
+    """
+    return os.path.join(store_dir, name)
+
+
+def exists(path):
+    """Check whether a complete store is at path.
+
+    Args:
+        path (str): the store directory
+
+    Returns:
+        bool: whether it's there
+    """
+    return os.path.exists(os.path.join(path, 'manifest.json'))
+
+
+def save(path, sets, feature_dict=None):
+    """Save featurized sets.
+
+    Each file is written under a temporary name and moved into place; the manifest goes last, so a store whose
+    manifest exists is complete.
+
+    Args:
+        path (str): directory to save to; created if needed
+        sets (tuple): x_train, y_train, x_cv, y_cv, x_test, y_test, as returned by main.prep_data. Each X is a
+            scipy.sparse matrix, or a dense array of 0s and 1s.
+        feature_dict (dict[unicode, int]): the feature dict the sets were made with, None in hashing mode
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    files, manifest = [], {'format_version': format_version, 'sets': {}}
+    for name, x, y in zip(set_names, sets[0::2], sets[1::2]):
+        if sparse.issparse(x):
+            x = x.tocsr()
+            manifest['sets'][name] = {'kind': 'csr', 'shape': list(x.shape), 'dtype': x.dtype.str}
+            for part in ['data', 'indices', 'indptr']:
+                files.append(('x_{}.{}.npy'.format(name, part), getattr(x, part)))
+        else:
+            manifest['sets'][name] = {'kind': 'bits', 'shape': list(x.shape), 'dtype': np.dtype(x.dtype).str}
+            files.append(('x_{}.bits.npy'.format(name), np.packbits(np.asarray(x) != 0, axis=1)))
+        files.append(('y_{}.npy'.format(name), np.asarray(y)))
+    for filename, a in files:
+        _write(path, filename, lambda f, a=a: np.save(f, a))
+    if feature_dict is not None:
+        words = sorted(feature_dict, key=feature_dict.get)
+        _write(path, 'features.txt', lambda f: features.write_words(f, words))
+    manifest['has_feature_dict'] = feature_dict is not None
+    _write(path, 'manifest.json', lambda f: f.write(json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')))
+
+
+def load(path, mmap=True, unpack=True):
+    """Open a store saved with `save`.
+
+    Args:
+        path (str): the store directory
+        mmap (bool): memory-map the arrays rather than reading them in
+        unpack (bool): unpack bit-packed X into arrays of their original dtype. That makes a private copy; with
+            False, they're bitpack.BitMatrix over the packed (memory-mapped) bits instead.
+
+    Returns:
+        tuple: x_train, y_train, x_cv, y_cv, x_test, y_test, feature_dict, like main.prep_data with
+            return_feature_dict; feature_dict is None if none was saved
+
+    Raises:
+        ValueError: the store has a different format version
+    """
+    with io.open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['format_version'] != format_version:
+        raise ValueError('Feature store {} has format version {}, expected {}'.format(
+            path, manifest['format_version'], format_version))
+    mmap_mode = 'r' if mmap else None
+    result = []
+    for name in set_names:
+        info = manifest['sets'][name]
+        shape = tuple(info['shape'])
+        if info['kind'] == 'csr':
+            data, indices, indptr = [np.load(os.path.join(path, 'x_{}.{}.npy'.format(name, part)), mmap_mode=mmap_mode)
+                                     for part in ['data', 'indices', 'indptr']]
+            x = sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+        else:
+            x = np.load(os.path.join(path, 'x_{}.bits.npy'.format(name)), mmap_mode=mmap_mode)
+            x = bitpack.BitMatrix.from_packbits(x, shape[1])
+            if unpack:
+                x = x.toarray(np.dtype(info['dtype']))
+        result.extend([x, np.load(os.path.join(path, 'y_{}.npy'.format(name)), mmap_mode=mmap_mode)])
+    feature_dict = None
+    if manifest['has_feature_dict']:
+        feature_dict = dict((w, i) for i, w in enumerate(features.read_words(os.path.join(path, 'features.txt'))))
+    return tuple(result) + (feature_dict,)
+
+
+def _write(path, filename, save):
+    filename = os.path.join(path, filename)
+    with open(filename + '.tmp', 'wb') as f:
+        save(f)
+    os.rename(filename + '.tmp', filename)
@@ -1,47 +1,120 @@
 """Make features and featurize the entries."""
 from __future__ import absolute_import
+import array
+import collections
+import heapq
+import itertools
 import operator
+import zlib
 
 import numpy as np
+from scipy import sparse
 
+from . import bitpack, instrument
 
-def count_words(word_lists, deduplicate=True):
+
+def count_words(word_lists, deduplicate=True, counts=None):
     """Count words from a list of word lists.
 
     Args:
-        word_lists (list[list[unicode]]): list of converted emails.
+        word_lists (iterable[list[unicode]] or corpus.Corpus): list of converted emails. A Corpus is counted with
+            np.bincount on its word ids.
         deduplicate (bool): optionally deduplicate each word list; i.e. count only the occurrence of a word in an email,
             not the number of times it appears
+        counts (dict[unicode, int]): optional existing counts to add to, e.g. when counting a stream of emails
+
+    Returns:
+        collections.Counter: word counts; `counts` itself if given
+    """
+    from .corpus import Corpus  # not at the top since corpus imports this module
+    if isinstance(word_lists, Corpus):
+        d = word_lists.count_words(deduplicate)
+        return d if counts is None else merge_counts([d], counts)
+    if deduplicate:
+        word_lists = (set(wl) for wl in word_lists)
+    # a defaultdict is the fastest way to count one at a time; Counter.update is slower on Python 2
+    d = collections.defaultdict(int)
+    for word in itertools.chain.from_iterable(word_lists):
+        d[word] += 1
+    if counts is None:
+        return collections.Counter(d)
+    return merge_counts([d], counts)
+
+
+def count_ids(tokens, offsets, n_words, deduplicate=True):
+    """Count words stored as integer ids with np.bincount.
+
+    The word lists are stored back to back in `tokens`; word list i is tokens[offsets[i]:offsets[i+1]].
+
+    Args:
+        tokens (np.ndarray): integer word ids of all the word lists, concatenated
+        offsets (np.ndarray): start of each word list in tokens, plus the end of the last one
+        n_words (int): number of distinct ids, i.e. the vocabulary size
+        deduplicate (bool): count each word at most once per word list, as in count_words
+
+    Returns:
+        np.ndarray: count of each word id, of length n_words
+    """
+    tokens = np.asarray(tokens, dtype=np.int64)
+    if deduplicate and len(tokens):
+        # a word repeated within a word list gives a repeated (word list, word) pair; keep only the first of each
+        docs = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+        tokens = np.unique(docs * n_words + tokens) % n_words
+    return np.bincount(tokens, minlength=n_words)
+
+
+def merge_counts(partial_counts, counts=None):
+    """Add up partial word counts, e.g. from different workers or archives.
+
+    Args:
+        partial_counts (iterable[dict[unicode, int]]): word counts to add up
+        counts (dict[unicode, int]): optional existing counts to add to
+
+    Returns:
+        collections.Counter: the total word counts; `counts` itself if given
+    """
+    total = collections.Counter() if counts is None else counts
+    for partial in partial_counts:
+        if not total:
+            total.update(partial)
+            continue
+        for word, count in partial.items():
+            total[word] = total.get(word, 0) + count
+    return total
+
+
+def prune_counts(counts, min_count):
+    """Drop the rare words from word counts; on a large corpus most of the vocabulary is seen only once or twice.
+
+    Args:
+        counts (dict[unicode, int]): word counts
+        min_count (int): minimum count to keep a word
 
     Returns:
-        dict[unicode, int]: word counts
+        collections.Counter: the counts of the words with a count >= min_count
     """
-    d = {}
-    for wl in word_lists:
-        if deduplicate:
-            wl = set(wl)
-        for word in wl:
-            d[word] = d.get(word, 0) + 1
-    return d
+    return collections.Counter(dict((word, count) for word, count in counts.items() if count >= min_count))
 
 
 def get_top_words(counts, threshold=100, maximum=0):
     """Get the top words from the given word counts.
 
+    With a maximum, only the top `maximum` words are selected with a heap instead of sorting the whole vocabulary.
+
     Args:
         counts (dict[unicode, int]): word->count mapping
-        threshold (int): take all words with a count >= threshold
+        threshold (int): take all words with a count > threshold
         maximum (int): max number of words to take, 0 for unlimited.
 
     Returns:
         list[unicode]: final word list. will be sorted by count, descending
     """
-    l = []
-    counts = sorted(counts.items(), key=operator.itemgetter(1), reverse=True)
-    for word, count in counts:
-        if count > threshold and (not maximum or len(l) < maximum):
-            l.append(word)
-    return l
+    counts = [(word, count) for word, count in counts.items() if count > threshold]
+    if maximum:
+        counts = heapq.nlargest(maximum, counts, key=operator.itemgetter(1))
+    else:
+        counts.sort(key=operator.itemgetter(1), reverse=True)
+    return [word for word, _ in counts]
 
 
 def make_feature_dict(spam_words, ham_words=None, mode='spam only'):
@@ -86,6 +159,122 @@ def featurize(word_list, feature_dict):
     return v
 
 
+def feature_indices(word_list, feature_dict):
+    """Get the indices of the features present in a word list, i.e. the nonzero entries of its feature vector.
+
+    Args:
+        word_list (list[unicode]): list of words
+        feature_dict (dict[unicode, int]): maps feature -> index
+
+    Returns:
+        list[int]: sorted feature indices
+    """
+    return sorted(set(feature_dict[w] for w in word_list if w in feature_dict))
+
+
+def indices_to_csr(rows, n_features, dtype=np.float64):
+    """Build a sparse matrix out of the feature indices of each row, with a 1 at each of them.
+
+    Args:
+        rows (iterable[list[int]]): sorted feature indices of each row, e.g. from feature_indices
+        n_features (int): number of columns
+        dtype (np.dtype): dtype of the data; sklearn works in float64, but e.g. np.uint8 is 8x smaller
+
+    Returns:
+        scipy.sparse.csr_matrix: m x n_features matrix
+    """
+    indices = array.array('i')
+    indptr = array.array('i', [0])
+    for row in rows:
+        indices.extend(row)
+        indptr.append(len(indices))
+    indices = np.frombuffer(indices, dtype=np.int32) if indices else np.zeros(0, dtype=np.int32)
+    indptr = np.frombuffer(indptr, dtype=np.int32)
+    data = np.ones(len(indices), dtype=dtype)
+    instrument.count('feature_rows', len(indptr) - 1)
+    instrument.count('feature_nonzeros', len(indices))
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, n_features))
+
+
+def featurize_sparse(word_lists, feature_dict, dtype=np.float64):
+    """Convert word lists straight into a sparse feature matrix, without building dense feature vectors.
+
+    Row i is the same as featurize(word_lists[i], feature_dict).
+
+    Args:
+        word_lists (iterable[list[unicode]] or corpus.Corpus): the word lists
+        feature_dict (dict[unicode, int]): maps feature -> index
+        dtype (np.dtype): dtype of the data, see indices_to_csr
+
+    Returns:
+        scipy.sparse.csr_matrix: m x n feature matrix
+    """
+    from .corpus import Corpus
+    if isinstance(word_lists, Corpus):
+        return word_lists.featurize(feature_dict, dtype=dtype)
+    return indices_to_csr((feature_indices(wl, feature_dict) for wl in word_lists), len(feature_dict), dtype)
+
+
+# default number of buckets for the hashing featurizer
+hash_features = 2 ** 18
+
+
+def hashed_indices(word_list, n_features=hash_features, ngrams=1):
+    """Get the feature indices of a word list with the hashing trick: each word (or n-gram) goes to a hashed bucket.
+
+    The hash (crc32 of the utf-8 bytes) is stable across runs and machines, so no vocabulary is needed and any email
+    can be featurized on its own. Distinct words can share a bucket, which gets rarer as n_features grows.
+
+    Args:
+        word_list (list[unicode]): list of words
+        n_features (int): number of buckets
+        ngrams (int): also hash runs of up to this many consecutive words, joined by spaces
+
+    Returns:
+        list[int]: sorted feature indices
+    """
+    words = [w if isinstance(w, bytes) else w.encode('utf-8') for w in word_list]
+    buckets = set((zlib.crc32(w) & 0xffffffff) % n_features for w in words)
+    for n in range(2, ngrams + 1):
+        buckets.update((zlib.crc32(b' '.join(words[i:i + n])) & 0xffffffff) % n_features
+                       for i in range(len(words) - n + 1))
+    return sorted(buckets)
+
+
+def featurize_hashed(word_lists, n_features=hash_features, ngrams=1, dtype=np.float64):
+    """Convert word lists into a sparse feature matrix with the hashing trick, in a single pass.
+
+    Args:
+        word_lists (iterable[list[unicode]] or corpus.Corpus): the word lists
+        n_features (int): number of buckets, i.e. columns
+        ngrams (int): also hash runs of up to this many consecutive words; see hashed_indices
+        dtype (np.dtype): dtype of the data, see indices_to_csr
+
+    Returns:
+        scipy.sparse.csr_matrix: m x n_features feature matrix
+    """
+    from .corpus import Corpus
+    if isinstance(word_lists, Corpus) and ngrams == 1:
+        return word_lists.featurize_hashed(n_features, dtype)
+    return indices_to_csr((hashed_indices(wl, n_features, ngrams) for wl in word_lists), n_features, dtype)
+
+
+def featurize_packed(word_lists, feature_dict=None, n_features=hash_features):
+    """Convert word lists into a bit-packed feature matrix, 1 bit per feature rather than the 64 of featurize.
+
+    Args:
+        word_lists (iterable[list[unicode]]): the word lists
+        feature_dict (dict[unicode, int]): maps feature -> index; None to use the hashing trick, see hashed_indices
+        n_features (int): number of buckets when feature_dict is None
+
+    Returns:
+        bitpack.BitMatrix: m x n feature matrix
+    """
+    if feature_dict is None:
+        return bitpack.BitMatrix.from_indices((hashed_indices(wl, n_features) for wl in word_lists), n_features)
+    return bitpack.BitMatrix.from_indices((feature_indices(wl, feature_dict) for wl in word_lists), len(feature_dict))
+
+
 def make_arrays(spams, hams):
     """Stack together all the feature vectors into an m x n matrix (m = # samples, n = # features); also get y array.
 
@@ -93,12 +282,19 @@ def make_arrays(spams, hams):
     Current implementation puts all the spams first, then the hams.
 
     Args:
-        spams (iterable[np.ndarray]): list of spam feature vectors
-        hams (iterable(np.ndarray]): list of ham feature vectors
+        spams (iterable[np.ndarray] or np.ndarray or scipy.sparse.spmatrix): list of spam feature vectors, or a matrix
+            of them
+        hams (iterable(np.ndarray] or np.ndarray or scipy.sparse.spmatrix): list of ham feature vectors, or a matrix of
+            them
 
     Returns:
-        np.ndarray, np.ndarray: X matrix (m x n), y array (m)
+        np.ndarray or scipy.sparse.csr_matrix, np.ndarray: X matrix (m x n), y array (m); X is sparse if the inputs are
     """
+    if sparse.issparse(spams) or isinstance(spams, np.ndarray):
+        y = np.hstack((np.ones(spams.shape[0]), np.zeros(hams.shape[0])))
+        if sparse.issparse(spams):
+            return sparse.vstack((spams, hams), format='csr'), y
+        return np.vstack((spams, hams)), y
     m = len(spams) + len(hams)  # number of samples
     n = len(spams[0])           # number of features
     arr = np.zeros((m, n))
@@ -106,3 +302,30 @@ def make_arrays(spams, hams):
         arr[i, :] = v
     y = np.hstack((np.ones(len(spams)), np.zeros(len(hams))))
     return arr, y
+
+
+def write_words(f, words):
+    """Write words to a file as utf-8, one per line, e.g. a vocabulary or the feature words in index order.
+
+    Args:
+        f (file): file open for writing bytes
+        words (list[unicode]): the words; none may contain '\n'
+    """
+    f.write(u'\n'.join(words).encode('utf-8'))
+
+
+def read_words(filename):
+    """Read words written with write_words.
+
+    Only '\n' separates the words: the file is read as bytes, not as text with universal newlines, so any other line
+    break (e.g. a '\r') stays part of its word and the words keep their indices. An empty file is no words.
+
+    Args:
+        filename (str): the file
+
+    Returns:
+        list[unicode]: the words
+    """
+    with open(filename, 'rb') as f:
+        text = f.read().decode('utf-8')
+    return text.split(u'\n') if text else []
@@ -0,0 +1,132 @@
+"""Features from the header block of an email.
+
+The body tokenizer (preprocess.tokenize) skips everything before the first blank line. This module scans just that
+block, line by line, without the email package: only the headers it uses get their folded lines joined, and everything
+else is skipped past. It turns them into a few tokens that share the feature space of the body words, prefixed with
+'h:' so they can't clash with them (body words never contain a ':'):
+    h:received:<n>          number of Received headers, i.e. relays; 8 for 8 or more
+    h:from-domain:<domain>  domain of the From address
+    h:reply-to:differs      the Reply-To address isn't the From address
+    h:mailer:<name>         first word of X-Mailer or User-Agent, e.g. 'microsoft'
+    h:content-type:<type>   e.g. 'text/html', 'multipart/alternative'
+    h:precedence:<value>    e.g. 'bulk', 'list'
+    h:no-<header>           no To, Date or Message-ID header
+"""
+from __future__ import absolute_import
+import re
+
+# bump this when changing the tokens; it's part of preprocess.fingerprint(headers=True)
+version = 1
+
+# the headers header_words looks at: name -> whether it needs the value
+used_headers = {
+    'received': False,
+    'from': True,
+    'reply-to': True,
+    'x-mailer': True,
+    'user-agent': True,
+    'content-type': True,
+    'precedence': True,
+    'to': False,
+    'date': False,
+    'message-id': False,
+}
+required_headers = ['to', 'date', 'message-id']
+max_received = 8
+
+_address = re.compile(r'[\w.+=-]+@([\w-]+(?:\.[\w-]+)+)')
+_first_word = re.compile(r'[a-z]+')
+_media_type = re.compile(r'[a-z]+/[a-z0-9.+-]+')
+
+
+def header_block(email):
+    """Get the header block, i.e. everything before the first blank line; the whole email if there's none.
+
+    Args:
+        email (unicode): the email
+
+    Returns:
+        unicode: the headers
+    """
+    end = email.find('\n\n')
+    return email if end < 0 else email[:end]
+
+
+def scan_headers(email, wanted=None):
+    """Scan the header block of an email for some headers.
+
+    Args:
+        email (unicode): the email, or just its header block
+        wanted (dict[str, bool]): lower-case names of the headers to yield, mapped to whether to also get their value
+            (joining folded lines); None for all of them, with values
+
+    Yields:
+        (str, unicode): lower-cased name and value of each wanted header, in order; the value is None if it wasn't
+            wanted, else it's stripped, with folded lines joined by spaces
+    """
+    block = header_block(email)
+    n = len(block)
+    pos = 0
+    name, parts = None, None
+    while pos < n:
+        end = block.find('\n', pos)
+        if end < 0:
+            end = n
+        if block[pos] in ' \t':
+            # a folded line, continuing the previous header
+            if parts is not None:
+                parts.append(block[pos:end].strip())
+        else:
+            if name is not None:
+                yield name, None if parts is None else ' '.join(parts)
+            name, parts = None, None
+            colon = block.find(':', pos, end)
+            if colon > pos:
+                key = block[pos:colon].rstrip().lower()
+                get_value = True if wanted is None else wanted.get(key)
+                if get_value is not None:
+                    name = key
+                    parts = [block[colon + 1:end].strip()] if get_value else None
+        pos = end + 1
+    if name is not None:
+        yield name, None if parts is None else ' '.join(parts)
+
+
+def header_words(email):
+    """Get the header tokens of an email, see the module docstring.
+
+    Args:
+        email (unicode): the email, with headers
+
+    Returns:
+        list[unicode]: the tokens
+    """
+    received = 0
+    seen = set()
+    values = {}
+    for name, value in scan_headers(email, used_headers):
+        if name == 'received':
+            received += 1
+        else:
+            seen.add(name)
+            # the first of each, like email.message.Message.get
+            if value is not None and name not in values:
+                values[name] = value.lower()
+    words = [u'h:received:{}'.format(min(received, max_received))]
+    from_match = _address.search(values.get('from', ''))
+    if from_match:
+        words.append(u'h:from-domain:' + from_match.group(1))
+    reply_to_match = _address.search(values.get('reply-to', ''))
+    if reply_to_match and (not from_match or reply_to_match.group() != from_match.group()):
+        words.append(u'h:reply-to:differs')
+    mailer = _first_word.search(values.get('x-mailer') or values.get('user-agent') or '')
+    if mailer:
+        words.append(u'h:mailer:' + mailer.group())
+    content_type = _media_type.match(values.get('content-type', ''))
+    if content_type:
+        words.append(u'h:content-type:' + content_type.group())
+    precedence = _first_word.search(values.get('precedence', ''))
+    if precedence:
+        words.append(u'h:precedence:' + precedence.group())
+    words.extend(u'h:no-' + name for name in required_headers if name not in seen)
+    return words
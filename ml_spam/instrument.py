@@ -0,0 +1,271 @@
+"""Named timers, counters and profiling hooks for the pipeline stages.
+
+Time a stage with `span`, which logs its duration and adds it to the stage's totals, and count things with `count`:
+
+    with instrument.span('featurize'):
+        x = ...
+    instrument.count('emails_preprocessed', len(emails))
+
+`gauge` registers a function whose value is read at export time, e.g. the stem cache's hit count. `profile` makes the
+spans of some stages run under cProfile or a sampling profiler. `to_json` and `to_prometheus` export everything.
+
+The numbers are per process: work done on a pool is counted by the parent when the results come back.
+"""
+from __future__ import absolute_import, division
+import collections
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+
+class Span(object):
+    """Context manager timing one run of a stage; see Registry.span."""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.elapsed = None
+        self._profiler = None
+
+    def __enter__(self):
+        self._profiler = self.registry._start_profiler(self.name)
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self._start
+        if self._profiler is not None:
+            self.registry._stop_profiler(self.name, self._profiler)
+        self.registry._add_time(self.name, self.elapsed)
+        logging.info('%s: %.4f s', self.name, self.elapsed)
+
+
+class Registry(object):
+    """Timers, counters and gauges of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        self._gauges = {}
+        self.profile_stages = {}
+        self.profile_directory = None
+
+    def reset(self):
+        """Zero the timers and counters."""
+        with self._lock:
+            self.timers = collections.defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'min': float('inf'),
+                                                           'max': 0.0})
+            self.counters = collections.defaultdict(int)
+
+    def span(self, name):
+        """Time a stage: `with registry.span('fit') as s: ...`; afterwards s.elapsed is the time in seconds.
+
+        Args:
+            name (str): the stage
+
+        Returns:
+            Span: the context manager
+        """
+        return Span(self, name)
+
+    def count(self, name, n=1):
+        """Add to a counter.
+
+        Args:
+            name (str): the counter, e.g. 'emails_loaded'
+            n (int): how much to add
+        """
+        with self._lock:
+            self.counters[name] += n
+
+    def gauge(self, name, func):
+        """Register a value to read at export time.
+
+        Args:
+            name (str): the gauge, e.g. 'stem_cache_hits'
+            func (() -> float): gets the current value
+        """
+        self._gauges[name] = func
+
+    def profile(self, stages, kind='cprofile', directory=None):
+        """Profile the spans of some stages from now on.
+
+        With cProfile, the stats of each span are written to <directory>/<stage>.prof, for pstats or snakeviz. The
+        sampling profiler looks at the stack of the span's thread every few ms, which costs much less than cProfile on
+        hot code, and writes <directory>/<stage>.folded, one "frame;frame;... count" line per stack, for flame graphs.
+        Without a directory, the top functions are logged instead.
+
+        Args:
+            stages (iterable[str]): names of the stages to profile, or ['*'] for all of them
+            kind (str): 'cprofile' or 'sampling'
+            directory (str): where to write the profiles
+        """
+        if kind not in ('cprofile', 'sampling'):
+            raise ValueError('Unknown profiler: {}'.format(kind))
+        for stage in stages:
+            self.profile_stages[stage] = kind
+        self.profile_directory = directory
+
+    def snapshot(self):
+        """Get the current timers, counters and gauges.
+
+        Returns:
+            dict: 'timers': stage -> {'count', 'seconds', 'min', 'max'}, 'counters': name -> value, 'gauges': name ->
+                value
+        """
+        with self._lock:
+            timers = dict((name, dict(t)) for name, t in self.timers.items())
+            counters = dict(self.counters)
+        return {'timers': timers, 'counters': counters,
+                'gauges': dict((name, func()) for name, func in self._gauges.items())}
+
+    def to_json(self):
+        """Export a snapshot as JSON."""
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='ml_spam'):
+        """Export a snapshot in the Prometheus text format.
+
+        Args:
+            prefix (str): prefix of the metric names
+
+        Returns:
+            str: the metrics
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for metric, key, kind in [('stage_seconds_total', 'seconds', 'counter'),
+                                  ('stage_calls_total', 'count', 'counter'),
+                                  ('stage_seconds_max', 'max', 'gauge')]:
+            lines.append('# TYPE {}_{} {}'.format(prefix, metric, kind))
+            for stage, t in sorted(snapshot['timers'].items()):
+                lines.append('{}_{}{{stage="{}"}} {!r}'.format(prefix, metric, _escape_label(stage), t[key]))
+        for section, suffix, kind in [('counters', '_total', 'counter'), ('gauges', '', 'gauge')]:
+            for name, value in sorted(snapshot[section].items()):
+                metric = '{}_{}{}'.format(prefix, _metric_name(name), suffix)
+                lines.append('# TYPE {} {}'.format(metric, kind))
+                lines.append('{} {!r}'.format(metric, value))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename):
+        """Write a snapshot to a file: Prometheus text if it ends in .prom, else JSON.
+
+        Args:
+            filename (str): the file
+        """
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            f.write(type(u'')(self.to_prometheus() if filename.endswith('.prom') else self.to_json()))
+
+    def _add_time(self, name, elapsed):
+        with self._lock:
+            t = self.timers[name]
+            t['count'] += 1
+            t['seconds'] += elapsed
+            t['min'] = min(t['min'], elapsed)
+            t['max'] = max(t['max'], elapsed)
+
+    def _start_profiler(self, name):
+        kind = self.profile_stages.get(name, self.profile_stages.get('*'))
+        if kind is None:
+            return None
+        profiler = cProfile.Profile() if kind == 'cprofile' else SamplingProfiler()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, name, profiler):
+        profiler.disable()
+        directory = self.profile_directory
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        filename = re.sub(r'[^\w.-]', '_', name)
+        if isinstance(profiler, SamplingProfiler):
+            if directory:
+                profiler.save(os.path.join(directory, filename + '.folded'))
+            else:
+                logging.info('Profile of %s, most sampled functions:\n%s', name, profiler.summary())
+        elif directory:
+            profiler.dump_stats(os.path.join(directory, filename + '.prof'))
+        else:
+            out = io.BytesIO() if sys.version_info[0] == 2 else io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+            logging.info('Profile of %s:\n%s', name, out.getvalue())
+
+
+class SamplingProfiler(object):
+    """Samples the stack of the thread that enabled it, from a background thread."""
+
+    def __init__(self, interval=0.005):
+        """
+        Args:
+            interval (float): time between samples, in seconds
+        """
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        """Start sampling the calling thread."""
+        target = threading.current_thread().ident
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, args=(target,), name='sampling profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def disable(self):
+        """Stop sampling."""
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self, target):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def summary(self, n=20):
+        """Get the functions that were most often on top of the stack, as text."""
+        tops = collections.Counter()
+        for stack, count in self.stacks.items():
+            tops[stack.rsplit(';', 1)[-1]] += count
+        total = sum(tops.values()) or 1
+        return '\n'.join('{:6.1%} {}'.format(count / total, func) for func, count in tops.most_common(n))
+
+    def save(self, filename):
+        """Write the sampled stacks in the folded format, one "frame;frame;... count" line per stack."""
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(u'{} {}\n'.format(stack, count))
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# the registry of this process, and shortcuts to it
+registry = Registry()
+span = registry.span
+count = registry.count
+gauge = registry.gauge
+profile = registry.profile
+snapshot = registry.snapshot
+to_json = registry.to_json
+to_prometheus = registry.to_prometheus
+save = registry.save
+reset = registry.reset
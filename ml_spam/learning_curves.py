@@ -1,46 +1,114 @@
 """Functions for creating and plotting learning curves."""
 
 from __future__ import absolute_import
+import copy
+import multiprocessing
+
 import numpy as np
-from matplotlib import pyplot as plt
 
 
-def make_learning_curve(x_train, y_train, x_cv, y_cv, classifier, metric, n_points=10):
+def make_learning_curve(x_train, y_train, x_cv, y_cv, classifier, metric, n_points=10, n_repeats=1, workers=1,
+                        seed=None, warm_start=False):
     """Generate a learning curve for the given classifier using the given data.
 
     We run the classifier n_points times, each time using more of the training data, and evaluate the classifier's
-    performance as a function of training set size.
+    performance as a function of training set size. The training sets of one curve are the first 1/n_points,
+    2/n_points, ... of one shuffle of the training data; with n_repeats, the whole curve is repeated with different
+    shuffles, e.g. for error bars.
+
+    The fits are independent, so they can run on a pool of processes. With warm_start, classifiers that support it
+    (e.g. sklearn's SGDClassifier or LogisticRegression) start each fit of a curve from the previous, smaller one; the
+    points of one curve then run in order and only the repeats are spread over the pool.
 
     Args:
-        x_train (numpy.ndarray): the training data (2D array)
+        x_train (numpy.ndarray or scipy.sparse.csr_matrix): the training data (2D array)
         y_train (numpy.ndarray): the training labels (1D array)
-        x_cv (numpy.ndarray): the cross-validation data
+        x_cv (numpy.ndarray or scipy.sparse.csr_matrix): the cross-validation data
         y_cv (numpy.ndarray): the cross-validation labels
         classifier: the classifier to use; must have `fit` and `predict` methods, i.e. the ones from sklearn will work
-        metric ((numpy.ndarray, numpy.ndarray) -> float): metric evaluation function
+        metric ((numpy.ndarray, numpy.ndarray) -> float): metric evaluation function; must be picklable (e.g. a
+            module-level function) when using more than one worker
         n_points (int): number of times to run the classifier to get a curve
+        n_repeats (int): number of curves, each on a different shuffle
+        workers (int): number of processes; 1 runs everything in this process, 0 uses one per CPU
+        seed (int): seed for the shuffles, None for random ones
+        warm_start (bool): warm-start each fit of a curve from the previous one, if the classifier supports it
 
     Returns:
-        (np.ndarray, np.ndarray, np.ndarray): x-axis (size of training set), metric on training data, metric on CV data
+        (np.ndarray, np.ndarray, np.ndarray): x-axis (size of training set), metric on training data, metric on CV data.
+            With n_repeats > 1 the metric arrays are n_repeats x n_points.
     """
     m, n = x_train.shape  # number of samples, number of features
-    inds = np.arange(m)
-    ms, metric_train, metric_cv = np.zeros(n_points), np.zeros(n_points), np.zeros(n_points)
-    for i in range(n_points):
-        ms[i] = int(m * (float(i+1) / n_points))
-        np.random.shuffle(inds)
-        clf = classifier.fit(x_train[inds[:ms[i]], :], y_train[inds[:ms[i]]])
-        predict_train = clf.predict(x_train[inds[:ms[i]], :])
-        predict_cv = clf.predict(x_cv)
-        metric_train[i] = metric(y_train[inds[:ms[i]]], predict_train)
-        metric_cv[i] = metric(y_cv, predict_cv)
+    ms = np.array([int(m * (float(i + 1) / n_points)) for i in range(n_points)])
+    rng = np.random.RandomState(seed)
+    shuffles = [rng.permutation(m) for _ in range(n_repeats)]
+    if warm_start and 'warm_start' in getattr(classifier, 'get_params', dict)():
+        # on a copy, leaving the caller's classifier as it was
+        classifier = copy.deepcopy(classifier).set_params(warm_start=True)
+        tasks = [(r, shuffles[r], ms) for r in range(n_repeats)]
+    else:
+        tasks = [(r, shuffles[r], ms[i:i + 1]) for r in range(n_repeats) for i in range(n_points)]
+    data = (x_train, y_train, x_cv, y_cv, classifier, metric)
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    if workers == 1:
+        results = [_fit_points(data, task) for task in tasks]
+    else:
+        # the data go to each worker once, when it starts, rather than with every task
+        pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=_init_worker, initargs=data)
+        try:
+            results = pool.map(_fit_points_in_worker, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    metric_train, metric_cv = np.zeros((n_repeats, n_points)), np.zeros((n_repeats, n_points))
+    for (r, _, sizes), result in zip(tasks, results):
+        for size, (train_value, cv_value) in zip(sizes, result):
+            i = np.searchsorted(ms, size)
+            metric_train[r, i], metric_cv[r, i] = train_value, cv_value
+    if n_repeats == 1:
+        return ms, metric_train[0], metric_cv[0]
     return ms, metric_train, metric_cv
 
 
+def _fit_points(data, task):
+    """Fit the classifier on the first `size` samples of a shuffle, for each size; return the train and CV metrics."""
+    x_train, y_train, x_cv, y_cv, classifier, metric = data
+    _, shuffle, sizes = task
+    # a fresh copy per task, so a warm-started curve doesn't start from the end of another one
+    classifier = copy.deepcopy(classifier)
+    results = []
+    for size in sizes:
+        # take the training subset out once, for both fitting and predicting
+        rows = shuffle[:size]
+        x, y = x_train[rows], y_train[rows]
+        clf = classifier.fit(x, y)
+        results.append((metric(y, clf.predict(x)), metric(y_cv, clf.predict(x_cv))))
+    return results
+
+
+_worker_data = None
+
+
+def _init_worker(*data):
+    global _worker_data
+    _worker_data = data
+
+
+def _fit_points_in_worker(task):
+    return _fit_points(_worker_data, task)
+
+
 def plot_learning_curve(ms, metric_train, metric_cv, metric_name):
+    from matplotlib import pyplot as plt  # here rather than at the top since it's slow to import
     ax = plt.figure().add_subplot(111)
-    ax.plot(ms, metric_train, '-o', label='Training Data')
-    ax.plot(ms, metric_cv, '-o', label='CV Data')
+    if np.ndim(metric_train) == 2:
+        # repeated curves: plot the mean, with the standard deviation as error bars
+        ax.errorbar(ms, metric_train.mean(axis=0), metric_train.std(axis=0), fmt='-o', label='Training Data')
+        ax.errorbar(ms, metric_cv.mean(axis=0), metric_cv.std(axis=0), fmt='-o', label='CV Data')
+    else:
+        ax.plot(ms, metric_train, '-o', label='Training Data')
+        ax.plot(ms, metric_cv, '-o', label='CV Data')
     ax.set_xlabel('Size of Training Set')
     ax.set_ylabel(metric_name)
     ax.legend(numpoints=1, loc='best')
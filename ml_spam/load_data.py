@@ -1,10 +1,24 @@
 """Load the data for processing.
 
 """
+import bz2
+import collections
+import gzip
+import io
+import multiprocessing
 import os
-import random
+import re
 import tarfile
+import traceback
 import urllib
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy as np
+
+from . import instrument
 
 data_dir = os.path.join(os.path.dirname(os.path.split(os.path.realpath(__file__))[0]), 'data')
 spam_path = os.path.join(data_dir, 'spam')
@@ -14,6 +28,11 @@ spamassassin_hams = ['20021010_easy_ham.tar.bz2', '20021010_hard_ham.tar.bz2', '
                      '20030228_easy_ham_2.tar.bz2', '20030228_hard_ham.tar.bz2']
 spamassassin_url = 'http://spamassassin.apache.org/publiccorpus/'
 
+# labels, as used in the y arrays
+SPAM, HAM = 1, 0
+
+EmailRecord = collections.namedtuple('EmailRecord', ['label', 'source_archive', 'member_name', 'email'])
+
 
 def check_and_download():
     """Check for existence of SpamAssassin data and download it if missing."""
@@ -33,72 +52,336 @@ def check_and_download():
             urllib.urlretrieve(spamassassin_url + hamfile, path)
 
 
-def load_spamassassin_tbz(filename, max_emails=0):
-    """Load a list of emails from the SpamAssassin public corpus.
+def iter_spamassassin_tbz(filename, label=None, max_emails=0):
+    """Stream the emails out of a SpamAssassin public corpus archive, one at a time.
 
     Args:
         filename (str): the .tar.bz2 file. each email is its own file inside.
+        label (int): label to put in the records, SPAM or HAM
         max_emails (int): maximum number of emails to load, or 0 for all.
 
-    Returns:
-        list[unicode]: list of emails
+    Yields:
+        EmailRecord: label, archive file name, name of the email inside the archive, and the email itself
     """
-    emails = []
     num = 0
-    with tarfile.open(filename, 'r:bz2') as f:
+    source = os.path.basename(filename)
+    # streaming mode: members are read in order and not kept around
+    with tarfile.open(filename, 'r|bz2') as f:
         for info in f:
             if not info.isfile():
                 continue
             email = f.extractfile(info).read()
-            emails.append(email)
+            instrument.count('emails_loaded')
+            instrument.count('bytes_decompressed', len(email))
+            yield EmailRecord(label, source, info.name, email)
             num += 1
             if 0 < max_emails <= num:
                 break
-    return emails
 
 
-def load_all_spamassassin():
+def load_spamassassin_tbz(filename, max_emails=0):
+    """Load a list of emails from the SpamAssassin public corpus.
+
+    Args:
+        filename (str): the .tar.bz2 file. each email is its own file inside.
+        max_emails (int): maximum number of emails to load, or 0 for all.
+
+    Returns:
+        list[unicode]: list of emails
+    """
+    return [record.email for record in iter_spamassassin_tbz(filename, max_emails=max_emails)]
+
+
+def iter_mbox(filename, label=None, max_emails=0):
+    """Stream the emails out of an mbox file, one at a time, without reading the whole file.
+
+    Messages start at lines beginning with "From "; that line is dropped, and ">From " quoting (mboxrd) is undone.
+    Files ending in .gz or .bz2 are decompressed on the fly.
+
+    Args:
+        filename (str): the mbox file
+        label (int): label to put in the records, SPAM or HAM
+        max_emails (int): maximum number of emails to load, or 0 for all.
+
+    Yields:
+        EmailRecord: label, mbox file name, (decompressed) byte offset of the message's "From " line, and the email
+    """
+    num = 0
+    source = os.path.basename(filename)
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'rb')
+    elif filename.endswith('.bz2'):
+        f = bz2.BZ2File(filename, 'rb')
+    else:
+        f = io.open(filename, 'rb')
+    with f:
+        offset, start, lines = 0, None, []
+        for line in f:
+            if line.startswith(b'From '):
+                if start is not None:
+                    yield EmailRecord(label, source, str(start), _join_mbox_lines(lines))
+                    num += 1
+                    if 0 < max_emails <= num:
+                        return
+                start, lines = offset, []
+            elif start is not None:
+                lines.append(line[1:] if _quoted_from.match(line) else line)
+            offset += len(line)
+        if start is not None:
+            yield EmailRecord(label, source, str(start), _join_mbox_lines(lines))
+
+
+_quoted_from = re.compile(b'>+From ')
+
+
+def _join_mbox_lines(lines):
+    """Join the lines of an mbox message, dropping the blank line that separates it from the next one."""
+    if lines and lines[-1] in (b'\n', b'\r\n'):
+        lines.pop()
+    email = b''.join(lines)
+    instrument.count('emails_loaded')
+    instrument.count('bytes_read', len(email))
+    return email
+
+
+def iter_maildir(path, label=None, max_emails=0):
+    """Stream the emails out of a Maildir directory, one at a time: the files in cur/ and then new/, by name.
+
+    Args:
+        path (str): the Maildir, i.e. the directory containing cur/ and new/
+        label (int): label to put in the records, SPAM or HAM
+        max_emails (int): maximum number of emails to load, or 0 for all.
+
+    Yields:
+        EmailRecord: label, Maildir name, file name under the Maildir (e.g. 'cur/123.abc:2,S'), and the email itself
+    """
+    num = 0
+    source = os.path.basename(os.path.normpath(path))
+    for sub in ('cur', 'new'):
+        directory = os.path.join(path, sub)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            filename = os.path.join(directory, name)
+            if name.startswith('.') or not os.path.isfile(filename):
+                continue
+            with open(filename, 'rb') as f:
+                email = f.read()
+            instrument.count('emails_loaded')
+            instrument.count('bytes_read', len(email))
+            yield EmailRecord(label, source, sub + '/' + name, email)
+            num += 1
+            if 0 < max_emails <= num:
+                return
+
+
+def iter_mailbox(path, label=None, max_emails=0):
+    """Stream the emails out of an mbox file or a Maildir directory, see iter_mbox and iter_maildir.
+
+    Args:
+        path (str): the mbox file or Maildir directory
+        label (int): label to put in the records, SPAM or HAM
+        max_emails (int): maximum number of emails to load, or 0 for all.
+
+    Yields:
+        EmailRecord: the emails
+    """
+    if os.path.isdir(path):
+        return iter_maildir(path, label, max_emails)
+    return iter_mbox(path, label, max_emails)
+
+
+def spamassassin_archives():
+    """Get the SpamAssassin archives along with their labels.
+
+    Returns:
+        list[(int, str)]: label and path of each archive, spams first
+    """
+    return ([(SPAM, os.path.join(spam_path, f)) for f in spamassassin_spams] +
+            [(HAM, os.path.join(ham_path, f)) for f in spamassassin_hams])
+
+
+def iter_all_spamassassin(workers=1, batch_size=100):
+    """Stream all SpamAssassin emails.
+
+    With one worker, the archives are read one after another, spams first. With more, they are decompressed in
+    parallel (see iter_archive_batches) and the emails of different archives are interleaved in no particular order,
+    which changes from run to run. The emails of each archive still come in order, so a stable sort on source_archive
+    makes the order fixed again, for anything that depends on it like a seeded split.
+
+    Args:
+        workers (int): number of processes decompressing archives, 0 for one per CPU
+        batch_size (int): number of emails the workers send back at a time
+
+    Yields:
+        EmailRecord: see iter_spamassassin_tbz
+    """
+    if workers == 1:
+        for label, path in spamassassin_archives():
+            for record in iter_spamassassin_tbz(path, label):
+                yield record
+        return
+    for batch in iter_archive_batches(spamassassin_archives(), workers=workers, batch_size=batch_size):
+        for record in batch:
+            yield record
+
+
+# seconds iter_archive_batches waits for a batch before checking that the workers are still alive
+worker_poll_seconds = 5
+
+
+def iter_archive_batches(archives, workers=0, batch_size=100):
+    """Decompress archives in parallel, yielding batches of emails as soon as they are ready.
+
+    bz2 decompression is CPU-bound and each archive is independent, so each worker process takes whole archives off
+    a queue. Each batch comes from a single archive and the batches of one archive arrive in order, but batches of
+    different archives are interleaved. At most a couple of batches per worker are held waiting to be consumed, so the
+    consumer (e.g. preprocessing) runs at the same time as the decompression. A worker that dies without reporting
+    (e.g. killed for running out of memory) raises a RuntimeError rather than leaving the consumer waiting forever.
+
+    Args:
+        archives (list[(int, str)]): label and path of each archive, e.g. from spamassassin_archives()
+        workers (int): number of processes, 0 for one per CPU; never more than the number of archives
+        batch_size (int): number of emails per batch
+
+    Yields:
+        list[EmailRecord]: batches of emails
+    """
+    workers = min(workers or multiprocessing.cpu_count(), len(archives))
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue(maxsize=2 * workers)
+    for archive in archives:
+        tasks.put(archive)
+    for _ in range(workers):
+        tasks.put(None)
+    processes = [multiprocessing.Process(target=_decompress_archives, args=(tasks, results, batch_size))
+                 for _ in range(workers)]
+    for p in processes:
+        p.daemon = True
+        p.start()
+    try:
+        running = workers
+        while running:
+            try:
+                kind, payload = results.get(timeout=worker_poll_seconds)
+            except Empty:
+                # a worker that exits after 'done' exits with 0, and its 'done' is queued before it exits
+                dead = [p.exitcode for p in processes if p.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError('Archive decompression worker died with exit code {}'.format(dead[0]))
+                continue
+            if kind == 'batch':
+                # the workers' own counts stay in their processes
+                instrument.count('emails_loaded', len(payload))
+                instrument.count('bytes_decompressed', sum(len(r.email) for r in payload))
+                yield payload
+            elif kind == 'done':
+                running -= 1
+            else:
+                raise RuntimeError('Error decompressing archive:\n' + payload)
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+
+def _decompress_archives(tasks, results, batch_size):
+    """Worker for iter_archive_batches: decompress archives from tasks, putting batches of emails in results."""
+    try:
+        for label, path in iter(tasks.get, None):
+            batch = []
+            for record in iter_spamassassin_tbz(path, label):
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    results.put(('batch', batch))
+                    batch = []
+            if batch:
+                results.put(('batch', batch))
+        results.put(('done', None))
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+
+
+def load_all_spamassassin(workers=1):
     """Load all SpamAssassin emails.
 
+    Args:
+        workers (int): number of processes decompressing archives in parallel, 0 for one per CPU. The result is the
+            same regardless.
+
     Returns:
         (list[unicode], list[unicode]): list of spam emails, list of ham emails
     """
+    by_archive = collections.defaultdict(list)
+    for record in iter_all_spamassassin(workers=workers):
+        by_archive[record.source_archive].append(record.email)
     spams, hams = [], []
-    for spam_file in spamassassin_spams:
-        spams.extend(load_spamassassin_tbz(os.path.join(spam_path, spam_file)))
-    for ham_file in spamassassin_hams:
-        hams.extend(load_spamassassin_tbz(os.path.join(ham_path, ham_file)))
+    for label, path in spamassassin_archives():
+        (spams if label == SPAM else hams).extend(by_archive[os.path.basename(path)])
     return spams, hams
 
 
-def make_sets(spams, hams, train=0.6, cv=0.2):
+def split_indices(labels, train=0.6, cv=0.2, seed=None, stratify=True, groups=None):
+    """Randomly split sample indices into train, cross-validation, and test sets.
+
+    Each class is shuffled separately (with stratify) so that all three sets have the same fraction of spam. The same
+    seed always gives the same split. With groups, e.g. of near-duplicates, the groups are split rather than the
+    samples, so that each group ends up in a single set; the fractions are then of groups.
+
+    Args:
+        labels (np.ndarray or int): label of each sample, or just the number of samples
+        train (float): fraction of data to put into training set
+        cv (float): fraction of data to put into cross-validation set. remainder goes into test set.
+        seed (int or np.random.RandomState): seed for the shuffle, None for a random one
+        stratify (bool): split each class separately
+        groups (np.ndarray): group of each sample, as the index of its first member (see dedup.find_duplicates); the
+            group goes where the first member's label puts it
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): sorted indices of the train, cv, and test samples
+    """
+    rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+    if np.isscalar(labels):
+        labels = np.zeros(labels)
+    labels = np.asarray(labels)
+    if groups is not None:
+        firsts = np.unique(groups)
+        which = np.zeros(len(firsts), dtype=np.intp)
+        for i, s in enumerate(split_indices(labels[firsts], train, cv, rng, stratify)):
+            which[s] = i
+        which = which[np.searchsorted(firsts, groups)]
+        return tuple(np.flatnonzero(which == i) for i in range(3))
+    groups = [np.flatnonzero(labels == label) for label in np.unique(labels)] if stratify else [np.arange(len(labels))]
+    sets = [], [], []
+    for group in groups:
+        group = rng.permutation(group)
+        n_train, n_cv = int(round(train * len(group))), int(round((train + cv) * len(group)))
+        for s, part in zip(sets, np.split(group, [n_train, n_cv])):
+            s.append(part)
+    return tuple(np.sort(np.concatenate(s)) if s else np.zeros(0, dtype=int) for s in sets)
+
+
+def make_sets(spams, hams, train=0.6, cv=0.2, seed=None):
     """Divide up the spams and the hams into train, cross-validation, and test sets.
 
     Args:
-        spams (iterable): list of spam data
-        hams (iterable): list of ham data
+        spams (iterable): list of spam data, or a corpus.Corpus
+        hams (iterable): list of ham data, or a corpus.Corpus
         train (float): fraction of data to put into training set
         cv (float): fraction of data to put into cross-validation set. remainder goes into test set.
+        seed (int): seed for the shuffle, None for a random one; see split_indices
 
     Returns:
         (iterable, iterable, iterable, iterable, iterable, iterable):
-            spam_train, ham_train, spam_cv, ham_cv, spam_test, ham_test
+            spam_train, ham_train, spam_cv, ham_cv, spam_test, ham_test; Corpus subsets if given corpora
     """
-    spam_train, ham_train, spam_cv, ham_cv, spam_test, ham_test = [], [], [], [], [], []
-    for s in spams:
-        v = random.random()
-        if v <= train:
-            spam_train.append(s)
-        elif v <= train + cv:
-            spam_cv.append(s)
-        else:
-            spam_test.append(s)
-    for h in hams:
-        v = random.random()
-        if v <= train:
-            ham_train.append(h)
-        elif v <= train + cv:
-            ham_cv.append(h)
-        else:
-            ham_test.append(h)
-    return spam_train, ham_train, spam_cv, ham_cv, spam_test, ham_test
+    rng = np.random.RandomState(seed)
+    spam_sets, ham_sets = [], []
+    for data, sets in [(spams, spam_sets), (hams, ham_sets)]:
+        if not hasattr(data, '__getitem__'):
+            data = list(data)
+        for rows in split_indices(len(data), train=train, cv=cv, seed=rng):
+            # a Corpus takes the subset directly
+            sets.append(data.subset(rows) if hasattr(data, 'subset') else [data[i] for i in rows])
+    return spam_sets[0], ham_sets[0], spam_sets[1], ham_sets[1], spam_sets[2], ham_sets[2]
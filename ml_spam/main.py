@@ -1,93 +1,356 @@
-from __future__ import absolute_import
+from __future__ import absolute_import, division
 
+import argparse
+import collections
+import hashlib
+import itertools
 import logging
-import time
+import os
 
 import numpy as np
-from sklearn import svm
+import scipy.sparse
+from sklearn import linear_model, naive_bayes, svm
 
-from . import load_data, preprocess, features, learning_curves, metrics
+from . import (cache, corpus, dedup, feature_store, load_data, preprocess, features, instrument, learning_curves,
+               metrics, model)
 
 
-def prep_data(mode='symmetric difference', check_and_download=True):
+def prep_data(mode='symmetric difference', check_and_download=True, workers=1, stream=False, use_cache=True,
+              sparse=False, seed=None, return_feature_dict=False, use_store=False, duplicates=None,
+              headers=False):
     """Load the SpamAssassin data, preprocess it, generate features, and split into sets; return X and y data.
 
     The X data are (m x n) matrices of stacked feature vectors, the y data are m-long vectors with 1=spam, 0=ham.
-    m = # samples, n = # features
+    m = # samples, n = # features. With `sparse`, the X data are scipy.sparse.csr_matrix built straight from the word
+    lists, which is much smaller since most entries are 0.
+
+    With `stream`, the emails are streamed twice, once to count the words and once to featurize, instead of being
+    loaded all at once; only the feature vectors are kept in memory. In 'hashing' mode there are no words to count, so
+    the emails are only streamed once.
+
+    With `use_store` and a seed, the sets are saved to a feature store (see feature_store.py) the first time, and
+    later calls with the same data, preprocessing, mode, sparsity and seed memory-map them from there instead. Only
+    sparse sets (`sparse` or 'hashing' mode) are used straight from the memory maps, so that processes share them; a
+    dense X is stored bit-packed and each process unpacks its own float64 copy of it.
+
+    With `duplicates`, near-duplicate emails of the same class (see dedup.py) are found before splitting, so that
+    copies of an email don't end up in both the training and the test set.
 
     To see what's taking so long, turn on logging at the info level: `logging.getLogger().setLevel(logging.INFO)`.
 
     Args:
-        mode (str): method for generating feature words. See features.make_feature_dict.
+        mode (str): method for generating feature words. See features.make_feature_dict. Or 'hashing' to use
+            features.hashed_indices instead of feature words; the X data are then always sparse.
         check_and_download (bool): if True, run load_data.check_and_download()
+        workers (int): number of processes for decompression and preprocessing, 0 for one per CPU; see
+            load_data.iter_archive_batches and preprocess.iter_word_lists
+        stream (bool): if True, stream the emails rather than loading them into memory
+        use_cache (bool): if True, use the cache of preprocessed emails (see cache.py), filling it if needed
+        sparse (bool): if True, the X data are sparse matrices
+        seed (int): seed for splitting the data into sets, None for a random split; see load_data.split_indices
+        return_feature_dict (bool): if True, also return the feature dict (None in 'hashing' mode), e.g. for saving a
+            model.Model
+        use_store (bool): if True and there's a seed, load the sets from the feature store, or save them to it
+        duplicates (str): what to do with near-duplicate emails: None to leave them, 'collapse' to keep only the first
+            of each group, 'group' to keep them all but put each group in a single set
+        headers (bool): also make features of the headers, see header_features.py; the header tokens are counted and
+            picked as feature words like the body words
 
     Returns:
-        x_train, y_train, x_cv, y_cv, x_test, y_test
+        x_train, y_train, x_cv, y_cv, x_test, y_test[, feature_dict]
 
     """
+    if duplicates not in (None, 'collapse', 'group'):
+        raise ValueError('Unknown duplicates option: {}'.format(duplicates))
     if check_and_download:
         load_data.check_and_download()
-    t = time.time()
-    logging.info("Loading SpamAssassin data")
-    spams, hams = load_data.load_all_spamassassin()
-    t = _log_time(t)
-    logging.info("Preprocessing spam")
-    spam_word_lists = [preprocess.make_word_list(x) for x in spams]
-    t = _log_time(t)
-    logging.info("Preprocessing ham")
-    ham_word_lists = [preprocess.make_word_list(x) for x in hams]
-    t = _log_time(t)
-    logging.info("Counting words")
-    spam_counts = features.count_words(spam_word_lists)
-    ham_counts = features.count_words(ham_word_lists)
-    t = _log_time(t)
-    logging.info("Making feature lists")
-    spam_words = features.get_top_words(spam_counts)
-    ham_words = features.get_top_words(ham_counts)
-    feature_dict = features.make_feature_dict(spam_words, ham_words, mode=mode)
-    t = _log_time(t)
+    store_path = None
+    if use_store and seed is not None:
+        store_path = _feature_store_path(mode, sparse or mode == 'hashing', seed, duplicates, headers)
+        if feature_store.exists(store_path):
+            with instrument.span('load feature store'):
+                stored = feature_store.load(store_path)
+            return stored if return_feature_dict else stored[:6]
+    if not stream:
+        logging.info("Loading and preprocessing SpamAssassin data")
+        with instrument.span('load and preprocess'):
+            spam_corpus, ham_corpus = _load_corpora(workers, use_cache, headers)
+    if mode == 'hashing':
+        sparse = True
+        n_features = features.hash_features
+        featurize = lambda word_list, _: features.hashed_indices(word_list, n_features)
+        feature_dict = None
+    else:
+        logging.info("Counting words")
+        with instrument.span('count words'):
+            if stream:
+                spam_counts, ham_counts = collections.Counter(), collections.Counter()
+                for label, _, word_list in _labeled_word_lists(workers, use_cache, headers):
+                    features.count_words([word_list], counts=spam_counts if label == load_data.SPAM else ham_counts)
+            else:
+                spam_counts = features.count_words(spam_corpus)
+                ham_counts = features.count_words(ham_corpus)
+        logging.info("Making feature lists")
+        with instrument.span('make feature dict'):
+            spam_words = features.get_top_words(spam_counts)
+            ham_words = features.get_top_words(ham_counts)
+            feature_dict = features.make_feature_dict(spam_words, ham_words, mode=mode)
+        n_features = len(feature_dict)
+        featurize = features.feature_indices if sparse else features.featurize
     logging.info("Building data")
-    spam_data = [features.featurize(x, feature_dict) for x in spam_word_lists]
-    ham_data = [features.featurize(x, feature_dict) for x in ham_word_lists]
-    spam_train, ham_train, spam_cv, ham_cv, spam_test, ham_test = load_data.make_sets(spam_data, ham_data)
-    x_train, y_train = features.make_arrays(spam_train, ham_train)
-    x_cv, y_cv = features.make_arrays(spam_cv, ham_cv)
-    x_test, y_test = features.make_arrays(spam_test, ham_test)
-    _log_time(t)
-    return x_train, y_train, x_cv, y_cv, x_test, y_test
-
-
-def use_svm(x_train, y_train, x_cv, y_cv, x_test, y_test):
-    t = time.time()
-    logging.info("Training SVM classifier")
-    clf = svm.SVC()
-    clf.fit(x_train, y_train)
-    t = _log_time(t)
+    with instrument.span('featurize'):
+        if stream:
+            # the signatures for finding near-duplicates are made in the same pass, so they line up with the rows
+            hasher = dedup.MinHasher() if duplicates else None
+            spam_data, ham_data, signatures = _featurize_stream(featurize, feature_dict, hasher, workers, use_cache,
+                                                                headers)
+            if sparse:
+                spam_data = features.indices_to_csr(spam_data, n_features)
+                ham_data = features.indices_to_csr(ham_data, n_features)
+            else:
+                spam_data = np.array(spam_data).reshape(len(spam_data), n_features)
+                ham_data = np.array(ham_data).reshape(len(ham_data), n_features)
+        elif mode == 'hashing':
+            spam_data = spam_corpus.featurize_hashed(n_features)
+            ham_data = ham_corpus.featurize_hashed(n_features)
+        else:
+            spam_data = spam_corpus.featurize(feature_dict, sparse=sparse)
+            ham_data = ham_corpus.featurize(feature_dict, sparse=sparse)
+    with instrument.span('make arrays'):
+        x, y = features.make_arrays(spam_data, ham_data)
+        del spam_data, ham_data
+    groups = None
+    if duplicates:
+        logging.info("Finding near-duplicates")
+        with instrument.span('find duplicates'):
+            if stream:
+                groups = dedup.group_signatures(signatures, labels=y)
+            else:
+                groups = dedup.find_duplicates(itertools.chain(spam_corpus, ham_corpus), labels=y)
+            firsts = dedup.first_of_groups(groups)
+            instrument.count('near_duplicates', len(groups) - firsts.sum())
+            logging.info("%d of %d emails are near-duplicates", len(groups) - firsts.sum(), len(groups))
+            if duplicates == 'collapse':
+                x, y, groups = x[firsts], y[firsts], None
+    with instrument.span('split sets'):
+        # one copy of the rows of each set
+        train, cv, test = load_data.split_indices(y, seed=seed, groups=groups)
+    sets = x[train], y[train], x[cv], y[cv], x[test], y[test]
+    if store_path:
+        with instrument.span('save feature store'):
+            feature_store.save(store_path, sets, feature_dict)
+    return sets + (feature_dict,) if return_feature_dict else sets
+
+
+def _feature_store_path(mode, sparse, seed, duplicates, headers):
+    """Get the feature store for some prep_data settings, keyed by the archives' cache entries (i.e. their contents and
+    the preprocessing configuration) and the settings."""
+    key = [cache.entry_prefix(path, headers) for _, path in load_data.spamassassin_archives()]
+    key += [mode, str(sparse), str(seed)] + ([duplicates] if duplicates else [])
+    return feature_store.default_path('spamassassin.' + hashlib.sha1('\n'.join(key).encode('utf-8')).hexdigest()[:16])
+
+
+def _stream_word_lists(workers, headers):
+    """Stream (EmailRecord, word list) pairs for all the SpamAssassin emails.
+
+    With more than one worker, the archives are decompressed in parallel and the emails are preprocessed on a pool as
+    they come out, so decompression and preprocessing overlap.
+    """
+    records, originals = itertools.tee(load_data.iter_all_spamassassin(workers=workers))
+    for word_list in preprocess.iter_word_lists((r.email for r in records), workers=workers, headers=headers):
+        yield next(originals), word_list
+
+
+def _labeled_word_lists(workers, use_cache, headers):
+    """Stream (label, archive, word list) triples for all the SpamAssassin emails, from the cache or from the archives.
+
+    The archive is the index of the email's archive in load_data.spamassassin_archives(). The emails of each archive
+    come in order, but with several workers and no cache the archives are interleaved in no fixed order; a stable sort
+    on the archive index puts them back in the order of _load_corpora.
+    """
+    archives = load_data.spamassassin_archives()
+    if use_cache:
+        corpora = cache.load(archives, workers=workers, headers=headers)
+        for i, ((label, _), word_lists) in enumerate(zip(archives, corpora)):
+            for word_list in word_lists:
+                yield label, i, word_list
+    else:
+        index = {os.path.basename(path): i for i, (_, path) in enumerate(archives)}
+        for record, word_list in _stream_word_lists(workers, headers):
+            yield record.label, index[record.source_archive], word_list
+
+
+# number of streamed word lists _featurize_stream hashes at a time
+signature_batch_size = 1000
+
+
+def _featurize_stream(featurize, feature_dict, hasher, workers, use_cache, headers):
+    """Featurize the streamed emails, see _labeled_word_lists, in the order of _load_corpora.
+
+    Args:
+        featurize (callable): makes the row of a word list, given the word list and feature_dict
+        feature_dict (dict[unicode, int]): passed to featurize
+        hasher (dedup.MinHasher): to also get the MinHash signatures of the word lists, or None
+        workers (int): number of processes
+        use_cache (bool): stream from the cache of preprocessed emails
+        headers (bool): also make features of the headers
+
+    Returns:
+        (list, list, np.ndarray): rows of the spams, rows of the hams, and the signatures of the spams then the hams
+            if there's a hasher, else None
+    """
+    rows = {load_data.SPAM: [], load_data.HAM: []}
+    signatures = {load_data.SPAM: [], load_data.HAM: []}
+    pending = {load_data.SPAM: [], load_data.HAM: []}
+    for label, archive, word_list in _labeled_word_lists(workers, use_cache, headers):
+        rows[label].append((archive, featurize(word_list, feature_dict)))
+        if hasher is not None:
+            pending[label].append(word_list)
+            if len(pending[label]) >= signature_batch_size:
+                signatures[label].append(hasher.signatures(pending[label]))
+                pending[label] = []
+    data, ordered_signatures = [], []
+    for label in (load_data.SPAM, load_data.HAM):
+        # with several workers the archives come interleaved; a stable sort puts them back in order, so that a seed
+        # gives the same split every time
+        order = sorted(range(len(rows[label])), key=lambda i: rows[label][i][0])
+        data.append([rows[label][i][1] for i in order])
+        if hasher is not None:
+            signatures[label].append(hasher.signatures(pending[label]))
+            ordered_signatures.append(np.concatenate(signatures[label])[order])
+    return data[0], data[1], np.concatenate(ordered_signatures) if hasher is not None else None
+
+
+def _load_corpora(workers, use_cache, headers):
+    """Load and preprocess all the SpamAssassin emails, in archive order.
+
+    Returns:
+        (corpus.Corpus, corpus.Corpus): spam word lists, ham word lists
+    """
+    archives = load_data.spamassassin_archives()
+    if use_cache:
+        corpora = cache.load(archives, workers=workers, headers=headers)
+    else:
+        corpora = cache.preprocess_archives(archives, workers=workers, headers=headers)
+    return tuple(corpus.Corpus.concatenate([c for (label, _), c in zip(archives, corpora) if label == wanted])
+                 for wanted in (load_data.SPAM, load_data.HAM))
+
+
+# classifier backends, by name. The linear ones train in seconds on sparse data where SVC takes minutes.
+classifiers = collections.OrderedDict([
+    ('svc', lambda: svm.SVC(gamma='auto')),
+    ('linear-svc', lambda: svm.LinearSVC()),
+    ('logistic', lambda: linear_model.LogisticRegression(solver='liblinear')),
+    ('bernoulli-nb', lambda: naive_bayes.BernoulliNB()),
+])
+
+
+def make_classifier(name):
+    """Make a new classifier.
+
+    Args:
+        name (str): one of the keys of `classifiers`
+
+    Returns:
+        an unfitted sklearn classifier
+    """
+    try:
+        return classifiers[name]()
+    except KeyError:
+        raise ValueError('Unknown classifier: {}; choose from {}'.format(name, ', '.join(classifiers)))
+
+
+def train_and_evaluate(x_train, y_train, x_cv, y_cv, x_test, y_test, classifier='svc', model_path=None,
+                       feature_dict=None, headers=False):
+    """Train a classifier and print its error rates, timing the fit and the predictions.
+
+    Args:
+        classifier (str): the backend, see `classifiers`
+        model_path (str): directory to save the model to (see model.py), None to not save it
+        feature_dict (dict[unicode, int]): the feature dict the data were made with, None in 'hashing' mode; see
+            prep_data's return_feature_dict
+        headers (bool): whether the data have header features, see prep_data
+
+    Returns:
+        (classifier, dict[str, float]): the fitted classifier, and the time in seconds of 'fit', 'predict cv' and
+            'predict test'
+    """
+    timings = {}
+    logging.info("Training {} classifier".format(classifier))
+    with instrument.span('fit') as span:
+        clf = make_classifier(classifier)
+        clf.fit(x_train, y_train)
+    timings['fit'] = span.elapsed
     logging.info("Predicting CV set")
-    pred_cv = clf.predict(x_cv)
-    t = _log_time(t)
+    with instrument.span('predict cv') as span:
+        pred_cv = clf.predict(x_cv)
+    timings['predict cv'] = span.elapsed
     print "CV error rate: {:.2f}%".format(np.abs(pred_cv-y_cv).mean()*100)
     logging.info("Predicting test set")
-    pred_test = clf.predict(x_test)
-    _log_time(t)
+    with instrument.span('predict test') as span:
+        pred_test = clf.predict(x_test)
+    timings['predict test'] = span.elapsed
     print "Test error rate: {:.2f}%".format(np.abs(pred_test-y_test).mean()*100)
-    return clf
+    if model_path:
+        model.Model(clf, feature_dict, n_features=x_train.shape[1], sparse=scipy.sparse.issparse(x_train),
+                    headers=headers).save(model_path)
+    return clf, timings
 
 
-def svc_learning_curves(x_train, y_train, x_cv, y_cv):
-    svc = svm.SVC()
-    ms, f1_train, f1_cv = learning_curves.make_learning_curve(x_train, y_train, x_cv, y_cv, svc, metrics.f1,
-                                                              n_points=10)
-    learning_curves.plot_learning_curve(ms, f1_train, f1_cv, 'F1-score')
+def use_svm(x_train, y_train, x_cv, y_cv, x_test, y_test, model_path=None, feature_dict=None):
+    """Train an SVM and print its error rates; see train_and_evaluate."""
+    return train_and_evaluate(x_train, y_train, x_cv, y_cv, x_test, y_test, 'svc', model_path, feature_dict)[0]
 
 
-def _log_time(t):
-    logging.info("\t{:.4f} s".format(time.time() - t))
-    return time.time()
+def svc_learning_curves(x_train, y_train, x_cv, y_cv, workers=1, n_repeats=1, seed=None, classifier='svc'):
+    clf = make_classifier(classifier)
+    ms, f1_train, f1_cv = learning_curves.make_learning_curve(x_train, y_train, x_cv, y_cv, clf, metrics.f1,
+                                                              n_points=10, n_repeats=n_repeats, workers=workers,
+                                                              seed=seed)
+    learning_curves.plot_learning_curve(ms, f1_train, f1_cv, 'F1-score')
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and evaluate spam classifiers on the SpamAssassin data.')
+    parser.add_argument('--classifier', nargs='+', default=['svc'], choices=list(classifiers),
+                        help='classifier backend(s); with several, each is trained on the same data and timed')
+    parser.add_argument('--mode', default='symmetric difference', help='feature words, see prep_data')
+    parser.add_argument('--sparse', action='store_true', help='use sparse feature matrices')
+    parser.add_argument('--workers', type=int, default=1, help='processes for preprocessing, 0 for one per CPU')
+    parser.add_argument('--seed', type=int, help='seed for splitting the data')
+    parser.add_argument('--model-path', help='save the trained model to this directory; with several classifiers, '
+                                             'each to a subdirectory named after it')
+    parser.add_argument('--duplicates', choices=['collapse', 'group'],
+                        help='collapse near-duplicate emails into one, or keep each group of them in one set')
+    parser.add_argument('--headers', action='store_true', help='also use features of the headers')
+    parser.add_argument('--feature-store', action='store_true',
+                        help='with --seed, keep the featurized sets in (and reuse them from) a memory-mapped store')
+    parser.add_argument('--learning-curves', action='store_true', help='plot learning curves instead of evaluating')
+    parser.add_argument('--metrics-out', help='write the stage timings and counters to this file: Prometheus text if '
+                                              'it ends in .prom, else JSON')
+    parser.add_argument('--profile', nargs='+', default=[], metavar='STAGE',
+                        help="profile these stages, e.g. 'featurize' 'fit', or '*' for all; see instrument.profile")
+    parser.add_argument('--profiler', default='cprofile', choices=['cprofile', 'sampling'])
+    parser.add_argument('--profile-dir', help='write the profiles here; by default the top functions are logged')
+    args = parser.parse_args()
     logging.getLogger().setLevel(logging.INFO)
-    stuff = prep_data()
+    if args.profile:
+        instrument.profile(args.profile, args.profiler, args.profile_dir)
+    stuff = prep_data(mode=args.mode, workers=args.workers, sparse=args.sparse, seed=args.seed,
+                      return_feature_dict=True, use_store=args.feature_store, duplicates=args.duplicates,
+                      headers=args.headers)
     print
-    svc_learning_curves(*stuff[:4])
+    for name in args.classifier:
+        if args.learning_curves:
+            svc_learning_curves(*stuff[:4], workers=args.workers, seed=args.seed, classifier=name)
+            continue
+        print name
+        model_path = args.model_path
+        if model_path and len(args.classifier) > 1:
+            model_path = os.path.join(model_path, name)
+        _, timings = train_and_evaluate(*stuff[:6], classifier=name, model_path=model_path, feature_dict=stuff[6],
+                                        headers=args.headers)
+        print "fit: {fit:.3f} s, predict: {:.1f} emails/s".format(
+            (len(stuff[3]) + len(stuff[5])) / (timings['predict cv'] + timings['predict test']), **timings)
+    if args.metrics_out:
+        instrument.save(args.metrics_out)
@@ -1,10 +1,48 @@
 """Functions for computing metrics for evaluating the classifiers' performance.
+
+All the metrics come from the confusion matrix, which is counted in one pass over the labels and predictions; use
+`confusion_matrix` and the `*_from_confusion` functions to get several metrics without recounting, and
+`threshold_curve` to get them for every decision threshold on continuous scores.
 """
 from __future__ import absolute_import, division
 
 import numpy as np
 
 
+def confusion_matrix(labels, predictions):
+    """Count true/false negatives/positives.
+
+    Args:
+        labels (np.ndarray): true labels for the data; 1 = spam, 0 = ham; dtype should be bool or int
+        predictions (np.ndarray): predictions for the data, same form as labels
+
+    Returns:
+        np.ndarray: 2 x 2 int array of counts, indexed by [label, prediction], i.e. [[tn, fp], [fn, tp]]
+    """
+    labels, predictions = np.asarray(labels) == 1, np.asarray(predictions) == 1
+    return np.bincount(2 * labels + predictions, minlength=4).reshape(2, 2)
+
+
+def accuracy_from_confusion(cm):
+    """Accuracy from a confusion matrix, see `accuracy`."""
+    return (cm[0, 0] + cm[1, 1]) / cm.sum()
+
+
+def precision_from_confusion(cm):
+    """Precision from a confusion matrix, see `precision`."""
+    return cm[1, 1] / (cm[1, 1] + cm[0, 1])
+
+
+def recall_from_confusion(cm):
+    """Recall from a confusion matrix, see `recall`."""
+    return cm[1, 1] / (cm[1, 1] + cm[1, 0])
+
+
+def f1_from_confusion(cm):
+    """F1 score from a confusion matrix, see `f1`."""
+    return 2 * cm[1, 1] / (2 * cm[1, 1] + cm[0, 1] + cm[1, 0])
+
+
 def accuracy(labels, predictions):
     """Simple accuracy -- number of correct predictions.
 
@@ -15,7 +53,7 @@ def accuracy(labels, predictions):
     Returns:
         float: the accuracy
     """
-    return 1 - np.abs(labels - predictions).mean()
+    return accuracy_from_confusion(confusion_matrix(labels, predictions))
 
 
 def precision(labels, predictions):
@@ -32,9 +70,7 @@ def precision(labels, predictions):
     Returns:
         float: the precision
     """
-    tp = np.logical_and(predictions == 1, labels == 1).sum()
-    fp = np.logical_and(predictions == 1, labels == 0).sum()
-    return tp / (tp + fp)
+    return precision_from_confusion(confusion_matrix(labels, predictions))
 
 
 def recall(labels, predictions):
@@ -51,14 +87,14 @@ def recall(labels, predictions):
     Returns:
         float: the recall
     """
-    tp = np.logical_and(predictions == 1, labels == 1).sum()
-    fn = np.logical_and(predictions == 0, labels == 1).sum()
-    return tp / (tp + fn)
+    return recall_from_confusion(confusion_matrix(labels, predictions))
 
 
 def f1(labels, predictions):
     """The F1 score is the harmonic mean of precision and recall.
 
+    f1 = 2 * precision * recall / (precision + recall) = 2 tp / (2 tp + fp + fn)
+
     Args:
         labels (np.ndarray): true labels for the data; 1 = spam, 0 = ham; dtype should be bool or int
         predictions (np.ndarray): predictions for the data, same form as labels
@@ -66,5 +102,30 @@ def f1(labels, predictions):
     Returns:
         float: the F1 score
     """
-    p, r = precision(labels, predictions), recall(labels, predictions)
-    return 2 * p * r / (p + r)
+    return f1_from_confusion(confusion_matrix(labels, predictions))
+
+
+def threshold_curve(labels, scores):
+    """Precision, recall and F1 score for every decision threshold on some scores.
+
+    An email is predicted spam when its score is >= the threshold; each distinct score is a threshold. The scores are
+    sorted once, highest first, and the counts at every threshold are cumulative sums over the sorted labels.
+
+    Args:
+        labels (np.ndarray): true labels for the data; 1 = spam, 0 = ham; dtype should be bool or int
+        scores (np.ndarray): continuous scores, e.g. from a classifier's decision_function; higher = more spammy
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray, np.ndarray): thresholds, from highest to lowest, and the precision, recall
+            and F1 score at each one
+    """
+    labels, scores = np.asarray(labels) == 1, np.asarray(scores)
+    order = np.argsort(scores, kind='mergesort')[::-1]
+    scores, labels = scores[order], labels[order]
+    # the last email with each distinct score, i.e. where the prediction of everything up to there is spam
+    last = np.flatnonzero(np.r_[scores[1:] != scores[:-1], True])
+    tp = np.cumsum(labels)[last]
+    fp = last + 1 - tp
+    fn = labels.sum() - tp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return scores[last], tp / (tp + fp), tp / (tp + fn), 2 * tp / (2 * tp + fp + fn)
@@ -0,0 +1,264 @@
+"""Saving and loading trained models, to score emails without retraining.
+
+A model bundle is a directory holding everything needed to go from a raw email to a prediction:
+    manifest.json: format version, preprocess.fingerprint() at training time, featurizer settings (including whether
+        the emails' headers are featurized too) and classifier kind
+    features.txt: the feature words, utf-8, one per line, in index order (not there in hashing mode)
+    coef.npy, intercept.npy, classes.npy: the weights of a linear classifier, which can be memory-mapped
+    classifier.pkl: any other classifier, pickled
+Binary linear classifiers (sklearn's LinearSVC, LogisticRegression, SGDClassifier, SVC with a linear kernel etc.) are
+loaded back as a LinearClassifier, which only needs numpy, so loading doesn't import sklearn.
+"""
+from __future__ import absolute_import
+import io
+import json
+import os
+import pickle
+
+import numpy as np
+
+from . import bitpack, features, preprocess
+
+# bump this when changing the layout of a bundle
+format_version = 1
+
+# every file a bundle can have, see the module docstring
+bundle_files = ['manifest.json', 'features.txt', 'coef.npy', 'intercept.npy', 'classes.npy', 'classifier.pkl']
+
+
+class LinearClassifier(object):
+    """Binary linear classifier from saved weights: predicts classes[1] where x . coef + intercept > 0."""
+
+    def __init__(self, coef, intercept, classes):
+        """
+        Args:
+            coef (np.ndarray): n_features weights
+            intercept (float): the bias
+            classes (np.ndarray): the two class labels, negative first
+        """
+        self.coef = coef
+        self.intercept = intercept
+        self.classes = classes
+
+    def decision_function(self, x):
+        """Get the signed distance of each sample to the decision boundary.
+
+        Args:
+            x (np.ndarray or scipy.sparse.csr_matrix or bitpack.BitMatrix): m x n_features feature matrix
+
+        Returns:
+            np.ndarray: m scores, > 0 for classes[1]
+        """
+        return x.dot(self.coef) + self.intercept
+
+    def predict(self, x):
+        """Predict the class of each sample.
+
+        Args:
+            x (np.ndarray or scipy.sparse.csr_matrix): m x n_features feature matrix
+
+        Returns:
+            np.ndarray: m class labels
+        """
+        return self.classes[(self.decision_function(x) > 0).astype(np.intp)]
+
+
+class Model(object):
+    """A trained classifier together with the featurization it was trained on."""
+
+    def __init__(self, classifier, feature_dict=None, n_features=None, sparse=True, fingerprint=None, headers=False):
+        """
+        Args:
+            classifier: fitted classifier with `predict` and optionally `decision_function`, e.g. from sklearn
+            feature_dict (dict[unicode, int]): maps feature word -> index, from features.make_feature_dict; None to use
+                the hashing trick (see features.hashed_indices)
+            n_features (int): number of hash buckets when feature_dict is None; defaults to features.hash_features
+            sparse (bool): whether the classifier was trained on sparse matrices; if False it gets dense arrays
+            fingerprint (str): preprocess.fingerprint() of the preprocessing the classifier was trained with; defaults
+                to the current one
+            headers (bool): whether the word lists include header tokens, see preprocess.make_word_list
+        """
+        self.classifier = classifier
+        self.feature_dict = feature_dict
+        if feature_dict is not None:
+            n_features = len(feature_dict)
+        self.n_features = n_features or features.hash_features
+        self.sparse = sparse
+        self.headers = headers
+        self.fingerprint = fingerprint or preprocess.fingerprint(headers)
+
+    def featurize(self, emails, workers=1):
+        """Preprocess and featurize raw emails the way the training data were.
+
+        Args:
+            emails (iterable[unicode]): the emails, with headers
+            workers (int): number of processes for preprocessing, see preprocess.make_word_lists
+
+        Returns:
+            scipy.sparse.csr_matrix or np.ndarray: m x n_features feature matrix
+        """
+        return self.featurize_word_lists(preprocess.make_word_lists(emails, workers=workers, headers=self.headers))
+
+    def featurize_word_lists(self, word_lists):
+        """Featurize already preprocessed emails, see `featurize`.
+
+        Args:
+            word_lists (iterable[list[unicode]]): the word lists, from preprocess.make_word_list (with the model's
+                `headers`)
+
+        Returns:
+            scipy.sparse.csr_matrix or np.ndarray: m x n_features feature matrix
+        """
+        if self.feature_dict is None:
+            x = features.featurize_hashed(word_lists, self.n_features)
+        else:
+            x = features.featurize_sparse(word_lists, self.feature_dict)
+        return x if self.sparse else x.toarray()
+
+    def predict(self, emails, workers=1):
+        """Predict whether raw emails are spam.
+
+        Args:
+            emails (iterable[unicode]): the emails, with headers
+            workers (int): number of processes for preprocessing
+
+        Returns:
+            np.ndarray: predictions; 1 = spam, 0 = ham
+        """
+        return self.classifier.predict(self.featurize(emails, workers))
+
+    def score(self, emails, workers=1):
+        """Get continuous spam scores for raw emails, e.g. for metrics.threshold_curve.
+
+        Args:
+            emails (iterable[unicode]): the emails, with headers
+            workers (int): number of processes for preprocessing
+
+        Returns:
+            np.ndarray: the classifier's decision_function; higher = more spammy
+        """
+        return self.classifier.decision_function(self.featurize(emails, workers))
+
+    def classify(self, x):
+        """Predict and, if the classifier can, score featurized emails, with a single pass of the classifier.
+
+        Args:
+            x (scipy.sparse.csr_matrix or np.ndarray or bitpack.BitMatrix): m x n_features feature matrix, from
+                `featurize`. A LinearClassifier scores a BitMatrix as it is; for other classifiers it's unpacked into
+                the layout they were trained on.
+
+        Returns:
+            (np.ndarray, np.ndarray): predictions (1 = spam, 0 = ham) and scores; the scores are None if the classifier
+                has no decision_function
+        """
+        classifier = self.classifier
+        if isinstance(x, bitpack.BitMatrix) and not isinstance(classifier, LinearClassifier):
+            x = x.tocsr() if self.sparse else x.toarray()
+        if not hasattr(classifier, 'decision_function'):
+            return classifier.predict(x), None
+        scores = classifier.decision_function(x)
+        # how binary sklearn classifiers predict from their decision_function
+        classes = getattr(classifier, 'classes_', getattr(classifier, 'classes', None))
+        return classes[(scores > 0).astype(np.intp)], scores
+
+    def save(self, path):
+        """Save the model as a bundle directory (see the module docstring).
+
+        Each file is written under a temporary name and moved into place; the manifest goes last, so a bundle whose
+        manifest exists is complete. Files of an earlier bundle in the same directory that this one doesn't have (e.g.
+        its classifier.pkl, when this classifier is linear) are removed after that.
+
+        Args:
+            path (str): directory to save to; created if needed
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        files = []
+        if self.feature_dict is not None:
+            words = sorted(self.feature_dict, key=self.feature_dict.get)
+            files.append(('features.txt', lambda f: features.write_words(f, words)))
+        linear = _linear_weights(self.classifier)
+        if linear is None:
+            kind = 'pickle'
+            files.append(('classifier.pkl', lambda f: pickle.dump(self.classifier, f, pickle.HIGHEST_PROTOCOL)))
+        else:
+            kind = 'linear'
+            for name, a in zip(['coef', 'intercept', 'classes'], linear):
+                files.append((name + '.npy', lambda f, a=a: np.save(f, a)))
+        manifest = {
+            'format_version': format_version,
+            'preprocess_fingerprint': self.fingerprint,
+            'featurizer': {'kind': 'hashing' if self.feature_dict is None else 'words',
+                           'n_features': self.n_features, 'sparse': self.sparse, 'headers': self.headers},
+            'classifier': {'kind': kind, 'type': type(self.classifier).__name__},
+        }
+        manifest = json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+        files.append(('manifest.json', lambda f: f.write(manifest)))
+        for name, save in files:
+            filename = os.path.join(path, name)
+            with open(filename + '.tmp', 'wb') as f:
+                save(f)
+            os.rename(filename + '.tmp', filename)
+        written = set(name for name, _ in files)
+        for name in bundle_files:
+            filename = os.path.join(path, name)
+            if name not in written and os.path.exists(filename):
+                os.remove(filename)
+
+    @classmethod
+    def load(cls, path, mmap=True, check_fingerprint=True):
+        """Load a bundle saved with `save`.
+
+        Args:
+            path (str): the bundle directory
+            mmap (bool): memory-map the weights of a linear classifier rather than reading them in
+            check_fingerprint (bool): refuse a model trained with different preprocessing than the current one
+
+        Returns:
+            Model: the model
+
+        Raises:
+            ValueError: the bundle has a different format version, or was trained with different preprocessing
+        """
+        with io.open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['format_version'] != format_version:
+            raise ValueError('Model bundle {} has format version {}, expected {}'.format(
+                path, manifest['format_version'], format_version))
+        fingerprint = manifest['preprocess_fingerprint']
+        featurizer = manifest['featurizer']
+        headers = featurizer.get('headers', False)
+        if check_fingerprint and fingerprint != preprocess.fingerprint(headers):
+            raise ValueError('Model bundle {} was trained with different preprocessing (fingerprint {})'.format(
+                path, fingerprint[:16]))
+        feature_dict = None
+        if featurizer['kind'] == 'words':
+            words = features.read_words(os.path.join(path, 'features.txt'))
+            feature_dict = dict((w, i) for i, w in enumerate(words))
+        if manifest['classifier']['kind'] == 'linear':
+            mmap_mode = 'r' if mmap else None
+            coef, intercept, classes = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                                        for name in ['coef', 'intercept', 'classes']]
+            classifier = LinearClassifier(coef, float(intercept), np.asarray(classes))
+        else:
+            with open(os.path.join(path, 'classifier.pkl'), 'rb') as f:
+                classifier = pickle.load(f)
+        return cls(classifier, feature_dict, featurizer['n_features'], featurizer['sparse'], fingerprint, headers)
+
+
+def _linear_weights(classifier):
+    """Get (coef, intercept, classes) of a fitted binary linear classifier, or None if it isn't one."""
+    if isinstance(classifier, LinearClassifier):
+        return classifier.coef, np.float64(classifier.intercept), classifier.classes
+    # duck-typed, like sklearn's linear classifiers (and SVC with a linear kernel, whose coef_ only exists then); naive
+    # Bayes models have a coef_ too, but no decision_function, as they don't predict with it alone
+    if not all(hasattr(classifier, name) for name in ('coef_', 'intercept_', 'classes_', 'decision_function')):
+        return None
+    coef = classifier.coef_
+    if hasattr(coef, 'toarray'):
+        coef = coef.toarray()
+    coef = np.asarray(coef, dtype=np.float64)
+    if coef.shape[0] != 1:
+        return None
+    intercept = np.float64(np.ravel(classifier.intercept_)[0])
+    return coef[0], intercept, np.asarray(classifier.classes_)
@@ -0,0 +1,171 @@
+"""Incremental training of a linear classifier on a stream of labeled emails.
+
+Emails are featurized with the hashing trick (see features.hashed_indices), so there's no vocabulary to rebuild as new
+mail comes in, and fed in mini-batches to sklearn's SGDClassifier.partial_fit. The trainer checkpoints to a model bundle
+directory (see model.py), which can be scored from right away, e.g. by serve.py or bulk.py, and training can resume
+from it.
+
+Run with `python -m ml_spam.online <checkpoint dir> --spam <mailbox> ... --ham <mailbox> ...` from the directory one-up
+from the repo, or with --spamassassin to train on the SpamAssassin archives.
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import itertools
+import logging
+import os
+import pickle
+
+import numpy as np
+from sklearn import linear_model
+
+from . import features, load_data, model, preprocess
+
+
+class OnlineTrainer(object):
+    """Keeps an SGDClassifier up to date with mini-batches of labeled emails, checkpointing as it goes."""
+
+    def __init__(self, checkpoint_path=None, checkpoint_every=10000, n_features=features.hash_features, loss='hinge',
+                 alpha=1e-5, classifier=None, n_seen=0):
+        """
+        Args:
+            checkpoint_path (str): model bundle directory to checkpoint to, None to not checkpoint
+            checkpoint_every (int): checkpoint after this many emails since the last checkpoint
+            n_features (int): number of hash buckets
+            loss (str): SGDClassifier loss, e.g. 'hinge' (linear SVM) or 'log' (logistic regression)
+            alpha (float): SGDClassifier regularization strength
+            classifier (linear_model.SGDClassifier): classifier to continue training, instead of a new one
+            n_seen (int): number of emails the classifier has already been trained on
+        """
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.n_features = n_features
+        self.classifier = classifier or linear_model.SGDClassifier(loss=loss, alpha=alpha)
+        self.n_seen = n_seen
+        self._last_checkpoint = n_seen
+
+    def partial_fit(self, word_lists, labels):
+        """Train on a mini-batch of preprocessed emails, and checkpoint if it's time to.
+
+        Args:
+            word_lists (list[list[unicode]]): the word lists, from preprocess.make_word_list
+            labels (list[int]): their labels; 1 = spam, 0 = ham
+        """
+        x = features.featurize_hashed(word_lists, self.n_features)
+        self.classifier.partial_fit(x, np.asarray(labels), classes=np.array([load_data.HAM, load_data.SPAM]))
+        self.n_seen += len(labels)
+        if self.checkpoint_path and self.n_seen - self._last_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def train(self, records, batch_size=1000, workers=1):
+        """Train on a stream of labeled emails, in mini-batches.
+
+        The stream should mix spam and ham (see `interleave`); SGD does badly on long runs of one class.
+
+        Args:
+            records (iterable[load_data.EmailRecord]): the emails, with their labels
+            batch_size (int): number of emails per call to partial_fit
+            workers (int): number of processes for preprocessing, 0 for one per CPU; see preprocess.iter_word_lists
+
+        Returns:
+            int: number of emails trained on
+        """
+        records, originals = itertools.tee(records)
+        word_lists = preprocess.iter_word_lists((r.email for r in records), workers=workers,
+                                                chunksize=max(1, min(100, batch_size // 2)))
+        n = 0
+        while True:
+            batch = list(itertools.islice(word_lists, batch_size))
+            if not batch:
+                return n
+            self.partial_fit(batch, [next(originals).label for _ in batch])
+            n += len(batch)
+            logging.info('Trained on %d emails', self.n_seen)
+
+    def model(self):
+        """Get the current classifier as a model.Model, for scoring.
+
+        Returns:
+            model.Model: the model
+        """
+        return model.Model(self.classifier, n_features=self.n_features, sparse=True)
+
+    def checkpoint(self):
+        """Save the model bundle to checkpoint_path, along with the training state (see `resume`).
+
+        Raises:
+            ValueError: if the trainer has no checkpoint_path
+        """
+        if not self.checkpoint_path:
+            raise ValueError('Cannot checkpoint an OnlineTrainer without a checkpoint_path')
+        if not os.path.exists(self.checkpoint_path):
+            os.makedirs(self.checkpoint_path)
+        filename = os.path.join(self.checkpoint_path, 'online.pkl')
+        with open(filename + '.tmp', 'wb') as f:
+            pickle.dump({'classifier': self.classifier, 'n_seen': self.n_seen, 'n_features': self.n_features}, f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(filename + '.tmp', filename)
+        self.model().save(self.checkpoint_path)
+        self._last_checkpoint = self.n_seen
+        logging.info('Checkpointed after %d emails', self.n_seen)
+
+    @classmethod
+    def resume(cls, checkpoint_path, checkpoint_every=10000):
+        """Continue training from a checkpoint, or start a new trainer if there isn't one yet.
+
+        Args:
+            checkpoint_path (str): the checkpoint directory
+            checkpoint_every (int): checkpoint after this many emails since the last checkpoint
+
+        Returns:
+            OnlineTrainer: the trainer
+        """
+        filename = os.path.join(checkpoint_path, 'online.pkl')
+        if not os.path.exists(filename):
+            return cls(checkpoint_path, checkpoint_every)
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+        return cls(checkpoint_path, checkpoint_every, n_features=state['n_features'], classifier=state['classifier'],
+                   n_seen=state['n_seen'])
+
+
+def interleave(*iterables):
+    """Take one item from each iterable in turn, until they're all used up.
+
+    Args:
+        *iterables: e.g. streams of EmailRecords from different mailboxes
+
+    Yields:
+        the items
+    """
+    iterators = [iter(it) for it in iterables]
+    while iterators:
+        remaining = []
+        for it in iterators:
+            try:
+                yield next(it)
+            except StopIteration:
+                continue
+            remaining.append(it)
+        iterators = remaining
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help='model bundle directory to checkpoint to, and resume from if it exists')
+    parser.add_argument('--spam', nargs='*', default=[], help='mbox files or Maildir directories of spam')
+    parser.add_argument('--ham', nargs='*', default=[], help='mbox files or Maildir directories of ham')
+    parser.add_argument('--spamassassin', action='store_true', help='also train on the SpamAssassin archives')
+    parser.add_argument('--batch-size', type=int, default=1000, help='emails per partial_fit')
+    parser.add_argument('--checkpoint-every', type=int, default=10000, help='emails between checkpoints')
+    parser.add_argument('--workers', type=int, default=0, help='preprocessing processes; 0 for one per CPU')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    sources = ([load_data.iter_mailbox(path, load_data.SPAM) for path in args.spam] +
+               [load_data.iter_mailbox(path, load_data.HAM) for path in args.ham])
+    if args.spamassassin:
+        load_data.check_and_download()
+        sources.extend(load_data.iter_spamassassin_tbz(path, label)
+                       for label, path in load_data.spamassassin_archives())
+    trainer = OnlineTrainer.resume(args.checkpoint, args.checkpoint_every)
+    trainer.train(interleave(*sources), batch_size=args.batch_size, workers=args.workers)
+    trainer.checkpoint()
@@ -1,27 +1,74 @@
 """preprocess.py -- functions to pre-process an email.
 
 TODOs:
-* strip the header, or use it somehow
+* use more of the header (see header_features.py)
 * use real HTML recognition
 * use a real url finder
 
 """
 from __future__ import absolute_import
+import collections
+import functools
+import hashlib
+import itertools
+import multiprocessing
+import pickle
 import re
 
-from nltk.stem.snowball import EnglishStemmer
-stemmer = EnglishStemmer()
-
-# compile regexes on module import. I know Python caches "the most recent patterns" but I don't know how many that is.
-regexes = {
-    'email': re.compile(r'<?[^@\s]+?@[^@\s]+?\.[^@\s]+>?'),
-    'html': re.compile(r'<[^<]*?>'),
-    'url': re.compile(r'(http|https)://[^\s]*'),
-    'number': re.compile(r'\d+'),
-    'dollar': re.compile(r'\$+'),
-    'clean': re.compile(r'[^\w\s]+'),
-    'space': re.compile(r'[\s]+'),
-}
+from . import header_features, instrument
+
+
+class LazyStemmer(object):
+    """nltk's EnglishStemmer, built the first time a word is stemmed.
+
+    Importing nltk takes about a second, which processes that never stem (e.g. ones that load preprocessed emails from
+    the cache, or only import this module) shouldn't pay.
+    """
+
+    name = 'EnglishStemmer'
+
+    def __init__(self):
+        self._stemmer = None
+
+    def load(self):
+        """Build the stemmer now, e.g. before forking workers so they don't each import nltk."""
+        if self._stemmer is None:
+            from nltk.stem.snowball import EnglishStemmer
+            self._stemmer = EnglishStemmer()
+        return self._stemmer
+
+    def stem(self, word):
+        return (self._stemmer or self.load()).stem(word)
+
+
+class _RegexTable(dict):
+    """Maps name -> compiled regex, compiling each pattern the first time it's looked up."""
+
+    def __init__(self, patterns):
+        dict.__init__(self)
+        self.patterns = patterns
+
+    def __missing__(self, name):
+        regex = self[name] = re.compile(self.patterns[name])
+        return regex
+
+
+stemmer = LazyStemmer()
+
+# bump this when changing the preprocessing in a way that fingerprint() doesn't pick up
+version = 1
+
+# regexes are compiled the first time they're used. I know Python caches "the most recent patterns" but I don't know
+# how many that is.
+regexes = _RegexTable({
+    'email': r'<?[^@\s]+?@[^@\s]+?\.[^@\s]+>?',
+    'html': r'<[^<]*?>',
+    'url': r'(http|https)://[^\s]*',
+    'number': r'\d+',
+    'dollar': r'\$+',
+    'clean': r'[^\w\s]+',
+    'space': r'[\s]+',
+})
 replacements = {
     'email': ' emailaddr ',
     'html': ' ',
@@ -31,17 +78,293 @@ replacements = {
 }
 replace_order = ['email', 'url', 'html', 'number', 'dollar']
 
+# Single-pass tokenizer used by make_word_list. Instead of running each replacement over the whole email and then
+# cleaning and splitting, one alternation is tried at each position of the (lower-cased) body. The alternatives are in
+# the order normalize() ends up applying the replacements (url, html, dollar, email, number), followed by plain words;
+# anything that matches none of them is a separator, which takes care of clean() and the whitespace collapsing.
+# A few tweaks keep the output in line with the sequential version on ordinary mail: since URLs are replaced first,
+# nothing else may run into an "http://", and an html tag only ends at a '>' that was not eaten by a URL. Emails don't
+# contain '$' or '<' since those are usually gone by the email pass. Malformed markup can still come out differently,
+# see tokenize.
+_not_url = r'h(?!ttps?://)'
+_email_char = r'(?:[^@\s<$h]|{})'.format(_not_url)
+token_patterns = [
+    ('url', r'https?://\S*'),
+    ('html', r'<(?:[^<h]|{}|https?://\S*\s)*?>'.format(_not_url)),
+    ('dollar', r'\$+'),
+    ('email', r'<?{0}[^@\s<$h]*(?:{1}[^@\s<$h]*)*@{0}+?\.{0}+>?'.format(_email_char, _not_url)),
+    ('number', r'\d+'),
+    ('word', r'(?:[^\W\dh]|{0})[^\W\dh]*(?:{0}[^\W\dh]*)*'.format(_not_url)),
+]
+regexes.patterns['token'] = '|'.join('(?P<{}>{})'.format(name, pattern) for name, pattern in token_patterns)
+# what each kind of token becomes; None means the token is dropped.
+token_replacements = dict((word, replacements[word].strip() or None) for word in replacements)
+
+
+class StemCache(object):
+    """Bounded LRU cache of word -> stem in front of a stemmer.
+
+    Mail has a small vocabulary compared to its number of words, so most calls to the stemmer repeat earlier work.
+    Keeps hit/miss/eviction counts so the cache size can be tuned, and can be saved to disk so that later runs start
+    warm.
+    """
+
+    def __init__(self, stemmer, maxsize=200000):
+        """Create an empty cache.
+
+        Args:
+            stemmer: object with a `stem` method, e.g. nltk's EnglishStemmer
+            maxsize (int): maximum number of words to keep, 0 for unlimited
+        """
+        self.stemmer = stemmer
+        self.maxsize = maxsize
+        self._stems = collections.OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._stems)
+
+    def __contains__(self, word):
+        return word in self._stems
+
+    def stem(self, word):
+        """Stem a word, using the cached stem if we have one.
+
+        Args:
+            word (unicode): the word
+
+        Returns:
+            unicode: the stemmed word
+        """
+        stems = self._stems
+        try:
+            # pop and re-insert to move the word to the most recently used end
+            s = stems.pop(word)
+            self.hits += 1
+        except KeyError:
+            s = self.stemmer.stem(word)
+            self.misses += 1
+            if 0 < self.maxsize <= len(stems):
+                stems.popitem(last=False)
+                self.evictions += 1
+        stems[word] = s
+        return s
+
+    def stats(self):
+        """Get the cache counters.
+
+        Returns:
+            dict[str, int]: size, maxsize, hits, misses, evictions
+        """
+        return {'size': len(self._stems), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def clear(self):
+        """Drop all cached stems and reset the counters."""
+        self._stems.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def save(self, filename):
+        """Save the cached stems, least recently used first.
+
+        Args:
+            filename (str): file to write
+        """
+        with open(filename, 'wb') as f:
+            pickle.dump(list(self._stems.items()), f, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, filename):
+        """Load stems saved with `save` into the cache, as the most recently used entries.
+
+        Args:
+            filename (str): file to read
+        """
+        with open(filename, 'rb') as f:
+            items = pickle.load(f)
+        if self.maxsize:
+            items = items[-self.maxsize:]
+        for word, s in items:
+            self._stems.pop(word, None)
+            self._stems[word] = s
+        while 0 < self.maxsize < len(self._stems):
+            self._stems.popitem(last=False)
+
+
+# the cache shared by make_word_list, stem, and the batch functions
+stem_cache = StemCache(stemmer)
+instrument.gauge('stem_cache_hits', lambda: stem_cache.hits)
+instrument.gauge('stem_cache_misses', lambda: stem_cache.misses)
+instrument.gauge('stem_cache_evictions', lambda: stem_cache.evictions)
+instrument.gauge('stem_cache_size', lambda: len(stem_cache))
+
+
+_nltk_version = None
+
+
+def nltk_version():
+    """Get the installed nltk's version without importing nltk, which takes about a second; see LazyStemmer.
+
+    Returns:
+        str: the version
+    """
+    global _nltk_version
+    if _nltk_version is None:
+        import pkg_resources
+        _nltk_version = pkg_resources.get_distribution('nltk').version
+    return _nltk_version
+
+
+def fingerprint(headers=False):
+    """Get a hash of the preprocessing configuration, for keying caches of preprocessed emails.
 
-def make_word_list(email):
+    Covers the patterns and replacements, the stemmer, `version`, and with headers, header_features.version.
+
+    Args:
+        headers (bool): whether the word lists include header tokens, see make_word_list
+
+    Returns:
+        str: hex digest
+    """
+    parts = ['version {}'.format(version), 'nltk {} {}'.format(nltk_version(), stemmer.name)]
+    parts.extend('{} {}'.format(name, pattern) for name, pattern in token_patterns)
+    parts.extend('{} {!r}'.format(name, replacements[name]) for name in sorted(replacements))
+    if headers:
+        # without headers the fingerprint stays what it was before header tokens existed, so caches stay valid
+        parts.append('headers {}'.format(header_features.version))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def make_word_list(email, headers=False):
     """Convert an email into a word list, applying all the normalizations, etc.
 
     Args:
         email (unicode): the email to convert, as a string
+        headers (bool): also add the header tokens (see header_features.header_words) after the body words
 
     Returns:
         list[unicode]: list of words.
     """
-    return stem(to_list(clean(normalize(lower(strip_header(email))))))
+    words = stem(tokenize(email))
+    if headers:
+        words.extend(header_features.header_words(email))
+    return words
+
+
+def tokenize(email):
+    """Strip the header, lower-case, normalize, and clean the email in one scan, yielding the words.
+
+    On ordinary mail, HTML included, this gives the same words as
+    `to_list(clean(normalize(lower(strip_header(email)))))` minus the empty strings, but only scans the body once. It
+    isn't an exact match: normalize() rewrites the text until nothing matches any more, so it also finds matches that
+    only appear once something else was removed, which a single scan can't. The differences are all around malformed
+    markup:
+        * nested tags are removed from the inside out, taking the outer one with them: '<a href=<b>>x' gives just
+          ['x'] there, but ['a', 'href', 'x'] here
+        * an unclosed '<' is part of an email address there, with whatever precedes it: 'b a<x@y.com' gives ['b',
+          'emailaddr'] there, but ['b', 'a', 'emailaddr'] here
+
+    Args:
+        email (unicode): the email to convert, as a string
+
+    Yields:
+        unicode: the words of the email, unstemmed
+    """
+    start = email.find('\n\n')
+    if start < 0:
+        return
+    body = email[start + 2:].lower()
+    for match in regexes['token'].finditer(body):
+        kind = match.lastgroup
+        if kind == 'word':
+            yield match.group()
+        else:
+            token = token_replacements[kind]
+            if token is not None:
+                yield token
+
+
+def make_word_lists(emails, workers=1, chunksize=0, headers=False):
+    """Convert many emails into word lists, optionally on a pool of processes.
+
+    Emails are sent to the workers in chunks to amortize the pickling overhead; the output is in the same order as
+    the input regardless. Each worker stems through its own copy of stem_cache, starting from whatever the parent had.
+
+    Args:
+        emails (iterable[unicode]): the emails to convert
+        workers (int): number of processes to use; 1 runs in this process, 0 uses one per CPU
+        chunksize (int): number of emails to send to a worker at a time, 0 to pick one based on the number of emails
+        headers (bool): also add header tokens, see make_word_list
+
+    Returns:
+        list[list[unicode]]: the word lists, in the order of the emails
+    """
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    if workers == 1:
+        return _count_word_lists([make_word_list(email, headers) for email in emails])
+    emails = list(emails)
+    if not chunksize:
+        chunksize = max(1, len(emails) // (workers * 4))
+    stemmer.load()
+    pool = multiprocessing.Pool(workers)
+    try:
+        return _count_word_lists(pool.map(functools.partial(make_word_list, headers=headers), emails, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def iter_word_lists(emails, workers=1, chunksize=100, headers=False):
+    """Lazily convert a stream of emails into word lists, optionally on a pool of processes.
+
+    Unlike make_word_lists this never holds the whole input: at most two chunks per worker are in flight at a time.
+
+    Args:
+        emails (iterable[unicode]): the emails to convert
+        workers (int): number of processes to use; 1 runs in this process, 0 uses one per CPU
+        chunksize (int): number of emails to send to a worker at a time
+        headers (bool): also add header tokens, see make_word_list
+
+    Yields:
+        list[unicode]: the word lists, in the order of the emails
+    """
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    if workers == 1:
+        for email in emails:
+            word_list = make_word_list(email, headers)
+            instrument.count('emails_preprocessed')
+            instrument.count('tokens_emitted', len(word_list))
+            yield word_list
+        return
+    emails = iter(emails)
+    chunks = iter(lambda: list(itertools.islice(emails, chunksize)), [])
+    stemmer.load()
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_make_word_list_chunk, (chunk, headers)))
+            if len(pending) >= 2 * workers:
+                for word_list in _count_word_lists(pending.popleft().get()):
+                    yield word_list
+        while pending:
+            for word_list in _count_word_lists(pending.popleft().get()):
+                yield word_list
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _count_word_lists(word_lists):
+    """Count emails and tokens in this process, for word lists that may have been made in workers; returns them."""
+    instrument.count('emails_preprocessed', len(word_lists))
+    instrument.count('tokens_emitted', sum(len(wl) for wl in word_lists))
+    return word_lists
+
+
+def _make_word_list_chunk(emails, headers):
+    return [make_word_list(email, headers) for email in emails]
 
 
 def lower(email):
@@ -72,15 +395,16 @@ def normalize(email):
 
 
 def stem(words):
-    """Apply stemming to a list of words.
+    """Apply stemming to a list of words, through stem_cache.
 
     Args:
-        words (list[unicode]): the word list
+        words (iterable[unicode]): the words, e.g. a word list or tokenize() output
 
     Returns:
-        unicode: the stemmed word list
+        list[unicode]: the stemmed word list
     """
-    return [stemmer.stem(word) for word in words if word]
+    cached_stem = stem_cache.stem
+    return [cached_stem(word) for word in words if word]
 
 
 def clean(email):
@@ -0,0 +1,111 @@
+"""Classify emails from the command line, e.g. from an MTA or procmail hook.
+
+A fresh interpreter per email mostly pays for imports, so this module only imports the standard library. Given the
+socket or address of a running scoring service (see serve.py), it just sends the emails there; given a model bundle,
+it loads the model and its dependencies (numpy, scipy, nltk, ...) only then.
+
+Run with `python -m ml_spam.score (--socket PATH | --url HOST:PORT | --bundle DIR) [FILE ...]` from the directory
+one-up from the repo. Each email (a file, or stdin if none are given) gets a line "<file>\t<spam|ham>\t<score>".
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import json
+import socket
+import sys
+
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, path, timeout=10):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def score_remote(emails, conn):
+    """Classify emails with a running scoring service.
+
+    Args:
+        emails (iterable[bytes]): the raw emails
+        conn (HTTPConnection): connection to the service
+
+    Returns:
+        list[(int, float)]: prediction (1 = spam, 0 = ham) and score of each email
+    """
+    results = []
+    for email in emails:
+        conn.request('POST', '/score', email)
+        response = conn.getresponse()
+        body = json.loads(response.read().decode('utf-8'))
+        if response.status != 200:
+            raise RuntimeError('Scoring service error: {}'.format(body.get('error')))
+        results.append((body['spam'], body['score']))
+    return results
+
+
+def score_local(emails, bundle):
+    """Classify emails with a model bundle, see model.py.
+
+    Args:
+        emails (list[bytes]): the raw emails
+        bundle (str): the model bundle directory
+
+    Returns:
+        list[(int, float)]: prediction (1 = spam, 0 = ham) and score of each email; the score is None if the
+            classifier doesn't give one
+    """
+    from . import model  # the heavy imports
+    m = model.Model.load(bundle)
+    predictions, scores = m.classify(m.featurize(emails))
+    if scores is None:
+        scores = [None] * len(predictions)
+    return [(int(p), None if s is None else float(s)) for p, s in zip(predictions, scores)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket', help='Unix socket of a running scoring service')
+    where.add_argument('--url', help='host:port of a running scoring service')
+    where.add_argument('--bundle', help='model bundle directory, to score in this process')
+    parser.add_argument('files', nargs='*', help='emails to classify; stdin if none')
+    parser.add_argument('--exit-status', action='store_true', help='exit with status 1 if any email is spam')
+    args = parser.parse_args(argv)
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    names = args.files or ['-']
+    emails = []
+    for name in names:
+        if name == '-':
+            emails.append(stdin.read())
+        else:
+            with open(name, 'rb') as f:
+                emails.append(f.read())
+    if args.bundle:
+        results = score_local(emails, args.bundle)
+    else:
+        if args.socket:
+            conn = UnixHTTPConnection(args.socket)
+        else:
+            host, _, port = args.url.rpartition(':')
+            conn = HTTPConnection(host, int(port), timeout=10)
+        try:
+            results = score_remote(emails, conn)
+        finally:
+            conn.close()
+    for name, (spam, score) in zip(names, results):
+        print('{}\t{}\t{}'.format(name, 'spam' if spam else 'ham', '' if score is None else score))
+    return 1 if args.exit_status and any(spam for spam, _ in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
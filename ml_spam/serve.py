@@ -0,0 +1,291 @@
+"""Local HTTP service for scoring single emails with a saved model (see model.py).
+
+The model is loaded once. Requests are handled on their own threads and handed to a Batcher, which groups the ones
+that arrive together into a single featurize/classify call, so concurrent requests share the cost of the classifier.
+
+Endpoints:
+    POST /score: the body is a raw email, with headers; the response is JSON {"spam": 0 or 1, "score": float or null}
+    GET /stats: JSON latency percentiles (in ms) of each stage, and the batch sizes
+
+Run with `python -m ml_spam.serve <bundle>` from the directory one-up from the repo; see --help for the options. With
+--socket it listens on a Unix socket instead of a TCP port, e.g. for an MTA hook on the same machine.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from Queue import Empty, Queue
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from queue import Empty, Queue
+    from socketserver import ThreadingMixIn, UnixStreamServer
+
+import numpy as np
+
+from . import model, preprocess
+
+
+class LatencyStats(object):
+    """Thread-safe record of the most recent timings (or other samples) of each stage, for percentiles."""
+
+    def __init__(self, maxlen=10000):
+        """
+        Args:
+            maxlen (int): number of recent samples to keep per stage
+        """
+        self.maxlen = maxlen
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=maxlen))
+        self._lock = threading.Lock()
+
+    def add(self, stage, value):
+        """Record a sample.
+
+        Args:
+            stage (str): e.g. 'preprocess'
+            value (float): the sample, e.g. a time in seconds
+        """
+        with self._lock:
+            self._samples[stage].append(value)
+
+    def percentiles(self, ps=(50, 90, 99), scale=1.0):
+        """Get percentiles of the recent samples of each stage.
+
+        Args:
+            ps (iterable[float]): the percentiles
+            scale (float): multiply the samples by this, e.g. 1000 for seconds -> ms
+
+        Returns:
+            dict[str, dict[str, float]]: stage -> {'count': n, 'p50': ..., ...}
+        """
+        with self._lock:
+            samples = dict((stage, np.array(s)) for stage, s in self._samples.items())
+        stats = {}
+        for stage, s in samples.items():
+            stats[stage] = dict(('p{:g}'.format(p), v * scale) for p, v in zip(ps, np.percentile(s, ps)))
+            stats[stage]['count'] = len(s)
+        return stats
+
+
+class Batcher(object):
+    """Collects emails from many threads into batches for a model, on a background thread.
+
+    A batch is run as soon as it has max_batch emails, or max_wait seconds after its first email arrived, whichever
+    comes first.
+    """
+
+    def __init__(self, scoring_model, max_batch=32, max_wait=0.002, stats=None):
+        """
+        Args:
+            scoring_model (model.Model): the model
+            max_batch (int): maximum number of emails to classify at once
+            max_wait (float): maximum time to wait for more emails after the first one of a batch, in seconds
+            stats (LatencyStats): where to record the timings; a new one by default
+        """
+        self.model = scoring_model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats or LatencyStats()
+        self.batch_sizes = LatencyStats()
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run, name='batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def score(self, email):
+        """Classify an email, waiting for its batch to run. Can be called from any thread.
+
+        Args:
+            email (unicode): the email, with headers
+
+        Returns:
+            (int, float): prediction (1 = spam, 0 = ham) and score, None if the classifier doesn't give one
+        """
+        request = _Request(email)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        """Stop the background thread once the queued emails are done."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stats = self.stats
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+                if request is None:
+                    # finish this batch first
+                    self._queue.put(None)
+                    break
+                batch.append(request)
+            start = time.time()
+            for r in batch:
+                stats.add('queue', start - r.arrived)
+            self.batch_sizes.add('batch', len(batch))
+            try:
+                t = time.time()
+                word_lists = [preprocess.make_word_list(r.email, self.model.headers) for r in batch]
+                stats.add('preprocess', time.time() - t)
+                t = time.time()
+                x = self.model.featurize_word_lists(word_lists)
+                stats.add('featurize', time.time() - t)
+                t = time.time()
+                predictions, scores = self.model.classify(x)
+                stats.add('classify', time.time() - t)
+            except Exception as e:
+                logging.exception('Scoring a batch failed')
+                for r in batch:
+                    r.error = e
+                    r.done.set()
+                continue
+            end = time.time()
+            for i, r in enumerate(batch):
+                r.result = int(predictions[i]), None if scores is None else float(scores[i])
+                stats.add('total', end - r.arrived)
+                r.done.set()
+
+
+class _Request(object):
+    """An email waiting in a Batcher."""
+
+    def __init__(self, email):
+        self.email = email
+        self.arrived = time.time()
+        self.done = threading.Event()
+        self.result = self.error = None
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """Request handler for the endpoints in the module docstring; the server must have a `batcher`."""
+
+    # keep connections open, so clients don't pay for a connection per email
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path != '/score':
+            return self._send(404, {'error': 'not found'})
+        email = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            spam, score = self.server.batcher.score(email)
+        except Exception as e:
+            return self._send(500, {'error': str(e)})
+        self._send(200, {'spam': spam, 'score': score})
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._send(404, {'error': 'not found'})
+        self._send(200, self.server.stats())
+
+    def _send(self, code, obj):
+        body = json.dumps(obj, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no (host, port)
+        return str(self.client_address[0]) if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        logging.debug('%s %s', self.address_string(), format % args)
+
+
+class _ScoringServerMixin(ThreadingMixIn):
+    daemon_threads = True
+
+    def stats(self):
+        """Get the latency percentiles of each stage in ms, and the batch size percentiles."""
+        return {'latency_ms': self.batcher.stats.percentiles(scale=1000),
+                'batch_size': self.batcher.batch_sizes.percentiles().get('batch', {})}
+
+
+class ScoringServer(_ScoringServerMixin, HTTPServer):
+    """Threaded HTTP server on a TCP port."""
+
+    def __init__(self, address, batcher):
+        """
+        Args:
+            address ((str, int)): host and port
+            batcher (Batcher): scores the emails
+        """
+        self.batcher = batcher
+        HTTPServer.__init__(self, address, ScoringHandler)
+
+
+class UnixScoringServer(_ScoringServerMixin, UnixStreamServer):
+    """Threaded HTTP server on a Unix socket."""
+
+    def __init__(self, path, batcher):
+        """
+        Args:
+            path (str): the socket file; an old one is replaced
+            batcher (Batcher): scores the emails
+        """
+        self.batcher = batcher
+        if os.path.exists(path):
+            os.remove(path)
+        UnixStreamServer.__init__(self, path, ScoringHandler)
+
+
+def make_server(bundle, host='127.0.0.1', port=8000, socket_path=None, max_batch=32, max_wait=0.002):
+    """Load a model and make a server for it; call serve_forever() on the result to run it.
+
+    Args:
+        bundle (str): the model bundle directory, see model.Model.save
+        host (str): interface to listen on
+        port (int): TCP port to listen on, 0 for any free one
+        socket_path (str): listen on this Unix socket instead of a TCP port
+        max_batch (int): maximum number of emails to classify at once, see Batcher
+        max_wait (float): maximum time to hold an email for a batch, in seconds
+
+    Returns:
+        ScoringServer or UnixScoringServer: the server
+    """
+    batcher = Batcher(model.Model.load(bundle), max_batch=max_batch, max_wait=max_wait)
+    if socket_path:
+        return UnixScoringServer(socket_path, batcher)
+    return ScoringServer((host, port), batcher)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('bundle', help='model bundle directory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--socket', help='listen on this Unix socket instead of host:port')
+    parser.add_argument('--max-batch', type=int, default=32, help='most emails classified at once')
+    parser.add_argument('--max-wait', type=float, default=2.0, help='longest an email waits for a batch, in ms')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    server = make_server(args.bundle, args.host, args.port, args.socket, args.max_batch, args.max_wait / 1000)
+    logging.info('Serving on %s', args.socket or '{}:{}'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
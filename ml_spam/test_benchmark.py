@@ -0,0 +1,33 @@
+from __future__ import absolute_import
+
+from . import benchmark, load_data
+
+
+def test_synthetic_archives(tmpdir):
+    archives = benchmark.make_synthetic_archives(str(tmpdir), n_emails=40, vocab_size=500, seed=1)
+    assert [label for label, _ in archives] == [load_data.SPAM, load_data.HAM]
+    emails = [r.email for _, path in archives for r in load_data.iter_spamassassin_tbz(path)]
+    assert len(emails) == 40
+    assert all(b'\n\n' in e and e.startswith(b'From ') for e in emails)
+    again = benchmark.make_synthetic_archives(str(tmpdir.join('again')), n_emails=40, vocab_size=500, seed=1)
+    assert [r.email for _, path in again for r in load_data.iter_spamassassin_tbz(path)] == emails
+
+
+def test_bench_pipeline(tmpdir):
+    archives = benchmark.make_synthetic_archives(str(tmpdir), n_emails=60, vocab_size=500)
+    result = benchmark.bench_pipeline(archives, classifier='bernoulli-nb', threshold=2)
+    assert result['emails'] == 60
+    assert set(result['seconds']) == set(benchmark.pipeline_stages)
+    assert result['peak_rss_mb'] > 0
+    with_steps = benchmark.bench_pipeline(archives, classifier='bernoulli-nb', threshold=2, steps=True)
+    assert set(with_steps['seconds']) == set(benchmark.pipeline_stages + benchmark.step_stages)
+    assert with_steps['error_rate'] == result['error_rate']
+
+    result['vocab_size'] = 500
+    result['seconds'] = dict((stage, 1.0) for stage in result['seconds'])
+    baseline = {'emails': 60, 'vocab_size': 500, 'peak_rss_mb': result['peak_rss_mb'],
+                'seconds': dict((stage, 0.5) for stage in result['seconds'])}
+    baseline['seconds']['fit'] = 0.9
+    regressions = benchmark.compare_to_baseline([result], [baseline])
+    assert len(regressions) == len(benchmark.pipeline_stages) - 1 and not any(': fit ' in r for r in regressions)
+    assert benchmark.compare_to_baseline([result], [dict(baseline, emails=100)]) == []
@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from . import bitpack, features, model
+
+rng = np.random.RandomState(0)
+dense = (rng.rand(30, 21) < 0.3).astype(np.float64)
+dense[3] = 0
+
+
+def test_conversions():
+    x = bitpack.BitMatrix.from_dense(dense)
+    assert x.shape == (30, 21) and x.bits.shape == (30, 3) and x.nbytes == 90
+    assert (x.toarray() == dense).all()
+    assert (x.tocsr() != sparse.csr_matrix(dense)).nnz == 0
+    assert (bitpack.BitMatrix.from_csr(sparse.csr_matrix(dense)).bits == x.bits).all()
+    rows = [np.nonzero(row)[0].tolist() for row in dense]
+    assert (bitpack.BitMatrix.from_indices(rows, 21).bits == x.bits).all()
+    # repeated indices, a full byte and an empty matrix
+    assert bitpack.BitMatrix.from_indices([[0, 0, 9], list(range(8)) * 2], 10).bits.tolist() == [[128, 64], [255, 0]]
+    assert bitpack.BitMatrix.from_indices([], 10).bits.shape == (0, 2)
+    assert (bitpack.BitMatrix.from_packbits(np.packbits(dense != 0, axis=1), 21).bits == x.bits).all()
+    with pytest.raises(ValueError):
+        bitpack.BitMatrix.from_packbits(x.bits, 30)
+    assert (x.row_counts() == dense.sum(axis=1)).all()
+    assert (x[2:5].toarray() == dense[2:5]).all() and (x[7].toarray() == dense[7:8]).all()
+    assert (x[np.array([4, 1])].toarray() == dense[[4, 1]]).all()
+
+
+@pytest.mark.parametrize('blas_rows', [1, 1000])
+def test_kernels(monkeypatch, blas_rows):
+    monkeypatch.setattr(bitpack, 'block_bytes', 16)  # several blocks of rows
+    monkeypatch.setattr(bitpack, 'blas_rows', blas_rows)
+    x, y = bitpack.BitMatrix.from_dense(dense), bitpack.BitMatrix.from_dense(dense[:7])
+    assert (x.dot(y) == dense.dot(dense[:7].T)).all()
+    weights = rng.randn(21)
+    np.testing.assert_allclose(x.dot(weights), dense.dot(weights))
+    np.testing.assert_allclose(x.dot(np.vstack([weights, weights]).T), dense.dot(np.vstack([weights, weights]).T))
+    shared = dense.dot(dense.T)
+    sizes = dense.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - shared
+    expected = np.where(union == 0, 1, shared / np.maximum(union, 1))
+    np.testing.assert_allclose(x.jaccard(), expected)
+    assert x.jaccard()[3, 3] == 1 and (np.diag(x.jaccard()) == 1).all()
+    assert (x.hamming(y) == np.abs(dense[:, None, :] - dense[None, :7, :]).sum(axis=2)).all()
+    with pytest.raises(ValueError):
+        x.hamming(bitpack.BitMatrix.from_dense(dense[:, :8]))
+
+
+def test_featurize_packed_and_classify():
+    word_lists = [[u'free', u'money', u'free'], [u'meeting', u'now'], []]
+    feature_dict = {u'free': 0, u'money': 1, u'now': 2, u'meeting': 3}
+    x = features.featurize_packed(word_lists, feature_dict)
+    assert (x.toarray() == features.featurize_sparse(word_lists, feature_dict).toarray()).all()
+    assert (features.featurize_packed(word_lists, n_features=64).tocsr() !=
+            features.featurize_hashed(word_lists, 64)).nnz == 0
+    m = model.Model(model.LinearClassifier(np.array([1., 1., -1., -1.]), -0.5, np.array([0, 1])), feature_dict)
+    predictions, scores = m.classify(x)
+    assert predictions.tolist() == [1, 0, 0]
+    np.testing.assert_allclose(scores, [1.5, -2.5, -0.5])
@@ -0,0 +1,27 @@
+from __future__ import absolute_import
+import io
+
+from sklearn import linear_model
+
+from . import bulk, features, load_data, model, preprocess
+
+emails = [b'Subject: hi\n\nbuy cheap pills now, free money at http://spam.com\n',
+          b'Subject: re: meeting\n\nthe meeting is moved to monday, see the agenda\n',
+          b'Subject: win\n\nfree free free, win $1000 now\n',
+          b'Subject: minutes\n\nminutes of the meeting and the agenda for next week\n']
+
+
+def test_score_mailboxes(tmpdir):
+    x = features.featurize_hashed(preprocess.make_word_lists(emails), 64)
+    m = model.Model(linear_model.LogisticRegression(solver='lbfgs').fit(x, [1, 0, 1, 0]), n_features=64)
+    path = tmpdir.join('mbox')
+    path.write_binary(b''.join(b'From x@y.z Mon Jan  1 00:00:00 2018\n' + e + b'\n' for e in emails * 3))
+    for workers in (1, 2):
+        out = io.BytesIO()
+        counts = bulk.score_mailboxes(m, [str(path)], out, batch_size=5, workers=workers)
+        lines = out.getvalue().decode('utf-8').splitlines()
+        assert lines[0] == 'mailbox\tmessage\tspam\tscore'
+        assert counts == {'emails': 12, 'spam': int(m.predict(emails).sum()) * 3}
+        offsets = [r.member_name for r in load_data.iter_mbox(str(path))]
+        assert [line.split('\t')[1] for line in lines[1:]] == offsets
+        assert [int(line.split('\t')[2]) for line in lines[1:]] == m.predict(emails).tolist() * 3
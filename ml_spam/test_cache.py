@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+
+import glob
+import os
+
+import pytest
+
+from . import cache, preprocess
+from .test_load_data import make_archive
+
+
+def test_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, 'cache_dir', str(tmpdir.join('cache')))
+    emails = [b'header\n\nfree money $100 for you', b'header\n\nlots of longing for things', b'no body']
+    archives = [(1, str(tmpdir.join('spam.tar.bz2'))), (0, str(tmpdir.join('ham.tar.bz2')))]
+    make_archive(archives[0][1], emails)
+    make_archive(archives[1][1], emails[::-1])
+
+    spams, hams = cache.load(archives)
+    expected = [preprocess.make_word_list(e) for e in emails]
+    assert list(spams) == expected
+    assert list(hams) == expected[::-1]
+    assert len(spams) == 3 and spams[1] == expected[1] and spams[-1] == []
+
+    # a second load comes from the files, memory-mapped
+    entries = sorted(os.listdir(cache.cache_dir))
+    spams, hams = cache.load(archives)
+    assert list(spams) == expected
+    assert sorted(os.listdir(cache.cache_dir)) == entries
+
+    # changing the preprocessing replaces the entries
+    monkeypatch.setattr(preprocess, 'version', preprocess.version + 1)
+    spams, hams = cache.load(archives, workers=2)
+    assert list(hams) == expected[::-1]
+    assert len(glob.glob(os.path.join(cache.cache_dir, 'spam.tar.bz2.*'))) == 3
+    assert not set(entries) & set(os.listdir(cache.cache_dir))
+
+    # word lists with header tokens are kept beside the ones without
+    spams, hams = cache.load(archives, headers=True)
+    assert list(spams) == [preprocess.make_word_list(e, headers=True) for e in emails]
+    assert len(glob.glob(os.path.join(cache.cache_dir, 'spam.tar.bz2.*'))) == 6
+    assert list(cache.load(archives)[0]) == expected
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
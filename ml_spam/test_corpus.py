@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+
+from . import corpus, features, load_data
+
+word_lists = [[u'free', u'money', u'free', u'now'], [u'meeting', u'now'], [], [u'unknown', u'free']]
+feature_dict = {u'free': 0, u'money': 1, u'now': 2, u'meeting': 3}
+
+
+def test_corpus():
+    c = corpus.Corpus.from_word_lists(word_lists)
+    assert len(c) == 4
+    assert list(c) == word_lists
+    assert c[1] == word_lists[1] and c[-1] == word_lists[-1]
+    assert c.tokens.dtype == np.int32 and len(c.vocab) == 5
+    assert list(c.subset([3, 0, 2])) == [word_lists[3], word_lists[0], []]
+    joined = corpus.Corpus.concatenate([c.subset([0, 1]), corpus.Corpus.from_word_lists([[u'new', u'now']]), c])
+    assert list(joined) == word_lists[:2] + [[u'new', u'now']] + word_lists
+
+
+def test_corpus_features():
+    c = corpus.Corpus.from_word_lists(word_lists)
+    assert features.count_words(c) == features.count_words(word_lists)
+    assert c.count_words(deduplicate=False) == features.count_words(word_lists, deduplicate=False)
+    x = features.featurize_sparse(c, feature_dict)
+    assert (x.toarray() == features.featurize_sparse(word_lists, feature_dict).toarray()).all()
+    assert (c.featurize(feature_dict, sparse=False) == x.toarray()).all()
+    hashed = features.featurize_hashed(c, n_features=32)
+    assert (hashed.toarray() == features.featurize_hashed(word_lists, n_features=32).toarray()).all()
+    sets = load_data.make_sets(c, c.subset([0]))
+    assert all(isinstance(s, corpus.Corpus) for s in sets)
+    assert sum(len(s) for s in sets[::2]) == 4
+
+
+def test_save_load(tmpdir):
+    c = corpus.Corpus.from_word_lists(word_lists)
+    prefix = str(tmpdir.join('corpus'))
+    c.save(prefix)
+    loaded = corpus.Corpus.load(prefix)
+    assert isinstance(loaded.tokens, np.memmap)
+    assert list(loaded) == word_lists
+    for empty in ([], [[]]):
+        corpus.Corpus.from_word_lists(empty).save(prefix)
+        loaded = corpus.Corpus.load(prefix)
+        assert list(loaded) == empty and loaded.vocab == []
+    # only '\n' separates the words in the vocab file
+    odd = [[u'a\rb', u'c'], [u'd\r', u'\u2028e', u'c']]
+    corpus.Corpus.from_word_lists(odd).save(prefix)
+    assert list(corpus.Corpus.load(prefix)) == odd
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+import random
+
+import numpy as np
+
+from . import dedup
+
+random.seed(0)
+vocab = [u'word{}'.format(i) for i in range(1000)]
+originals = [[random.choice(vocab) for _ in range(100)] for _ in range(50)]
+# near-duplicates of the first 10, with a word changed
+copies = []
+for word_list in originals[:10]:
+    copy = list(word_list)
+    copy[random.randrange(100)] = u'changed'
+    copies.append(copy)
+
+
+def test_signatures(monkeypatch):
+    hasher = dedup.MinHasher(num_perm=64)
+    signatures = hasher.signatures(originals + copies + [[], [u'short']])
+    assert signatures.shape == (62, 64) and signatures.dtype == np.uint32
+    # about as many places agree as the shingle sets' Jaccard similarity, ~0.94 for one word changed
+    assert (signatures[:10] == signatures[50:60]).mean() > 0.8
+    assert (signatures[10:20] == signatures[20:30]).mean() < 0.1
+    assert (signatures[60] == 0xffffffff).all()
+    # the same, a few word lists at a time
+    monkeypatch.setattr(dedup, 'block_bytes', 64 * 8 * 150)
+    assert (dedup.MinHasher(num_perm=64).signatures(originals + copies + [[], [u'short']]) == signatures).all()
+    # and with a word cache that keeps starting over
+    monkeypatch.setattr(dedup, 'max_cached_words', 100)
+    hasher = dedup.MinHasher(num_perm=64)
+    assert (hasher.signatures(originals + copies + [[], [u'short']]) == signatures).all()
+    assert len(hasher._word_hashes) < 100 + 150
+
+
+def test_lsh_bands():
+    assert dedup.lsh_bands(128, 0.8) == (16, 8)
+    assert dedup.lsh_bands(128, 0.5) == (32, 4)
+
+
+def test_find_duplicates():
+    groups = dedup.find_duplicates(originals + copies, batch_size=7)
+    assert (groups == np.arange(50).tolist() + list(range(10))).all()
+    assert dedup.first_of_groups(groups).sum() == 50
+    # only within labels
+    labels = [0] * 50 + [1] * 5 + [0] * 5
+    groups = dedup.find_duplicates(originals + copies, labels=labels)
+    assert (groups == np.arange(55).tolist() + list(range(5, 10))).all()
+    deduplicator = dedup.Deduplicator()
+    deduplicator.add(originals[:5])
+    assert deduplicator.add(copies[:2]).tolist() == [0, 1] and len(deduplicator) == 7
+    assert deduplicator.similarity(0, 5) > 0.8
+
+
+def test_bucket_with_unrelated_first_member():
+    # B and C share bands 0, 30 and 31 with A, which is like neither of them, and differ in one place of each other band
+    deduplicator = dedup.Deduplicator(threshold=0.5)
+    assert (deduplicator.bands, deduplicator.rows) == (32, 4)
+    rng = np.random.RandomState(0)
+    a, b = rng.randint(1 << 31, size=(2, 128)).astype(np.uint32)
+    shared = np.r_[0:4, 120:128]
+    b[shared] = a[shared]
+    c = b.copy()
+    c[np.arange(1, 30) * 4] += 1
+    assert deduplicator.add_signatures(np.vstack([a, b, c])).tolist() == [0, 1, 1]
+    assert 0.77 <= deduplicator.similarity(1, 2) < 0.78 and deduplicator.similarity(0, 1) < 0.1
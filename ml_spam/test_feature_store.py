@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+import json
+import os
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from . import feature_store
+
+
+def make_sets(dense):
+    rng = np.random.RandomState(0)
+    sets = []
+    for m in [20, 7, 5]:
+        x = (rng.rand(m, 13) < 0.3).astype(np.float64)
+        sets.extend([x if dense else sparse.csr_matrix(x), rng.randint(0, 2, m)])
+    return tuple(sets)
+
+
+def test_sparse_round_trip(tmpdir):
+    path = str(tmpdir.join('store'))
+    sets = make_sets(dense=False)
+    feature_dict = {u'caf\xe9': 0, u'free': 1, u'a\rb': 2}
+    feature_store.save(path, sets, feature_dict)
+    assert feature_store.exists(path)
+    loaded = feature_store.load(path)
+    for x, saved_x in zip(loaded[0:6:2], sets[0::2]):
+        assert sparse.isspmatrix_csr(x)
+        assert not x.data.flags.writeable  # a view of the read-only memory map, not a copy
+        assert (x != saved_x).nnz == 0
+    for y, saved_y in zip(loaded[1:6:2], sets[1::2]):
+        assert (y == saved_y).all()
+    assert loaded[6] == feature_dict
+    feature_store.save(path, sets, {})
+    assert feature_store.load(path)[6] == {}
+
+
+def test_dense_round_trip(tmpdir):
+    path = str(tmpdir.join('store'))
+    sets = make_sets(dense=True)
+    feature_store.save(path, sets)
+    assert os.path.getsize(os.path.join(path, 'x_train.bits.npy')) < sets[0].nbytes // 8
+    loaded = feature_store.load(path, mmap=False)
+    for x, saved_x in zip(loaded[0:6:2], sets[0::2]):
+        assert x.dtype == saved_x.dtype
+        assert (x == saved_x).all()
+    assert loaded[6] is None
+    packed = feature_store.load(path, unpack=False)[0]
+    assert isinstance(packed.bits, np.memmap) and packed.bits.shape == (20, 2) and packed.shape == (20, 13)
+    assert (packed.toarray() == sets[0]).all()
+
+
+def test_format_version(tmpdir):
+    path = str(tmpdir.join('store'))
+    feature_store.save(path, make_sets(dense=False))
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    manifest['format_version'] = feature_store.format_version + 1
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        feature_store.load(path)
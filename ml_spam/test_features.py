@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+
+from . import features
+
+word_lists = [[u'free', u'money', u'free', u'now'], [u'meeting', u'now'], [], [u'unknown']]
+feature_dict = {u'free': 0, u'money': 1, u'now': 2, u'meeting': 3}
+
+
+def test_count_words():
+    counts = features.count_words(word_lists)
+    assert counts == {u'free': 1, u'money': 1, u'now': 2, u'meeting': 1, u'unknown': 1}
+    assert features.count_words(word_lists, deduplicate=False)[u'free'] == 2
+    partial = features.count_words(word_lists[:2])
+    assert features.merge_counts([partial, features.count_words(word_lists[2:])]) == counts
+    assert features.count_words(word_lists[2:], counts=partial) is partial and partial == counts
+    assert features.prune_counts(counts, 2) == {u'now': 2}
+    assert features.count_ids([0, 1, 0, 2, 3, 2], [0, 3, 5, 5, 6], 5).tolist() == [1, 1, 2, 1, 0]
+    assert features.count_ids([0, 1, 0, 2, 3, 2], [0, 3, 5, 5, 6], 5, deduplicate=False).tolist() == [2, 1, 2, 1, 0]
+
+
+def test_get_top_words():
+    counts = {u'a': 5, u'b': 3, u'c': 9, u'd': 1}
+    assert features.get_top_words(counts, threshold=1) == [u'c', u'a', u'b']
+    assert features.get_top_words(counts, threshold=1, maximum=2) == [u'c', u'a']
+    assert features.get_top_words(counts, threshold=5) == [u'c']
+
+
+def test_featurize_sparse():
+    x = features.featurize_sparse(word_lists, feature_dict)
+    assert x.shape == (4, 4)
+    assert x.nnz == 5
+    dense = np.array([features.featurize(wl, feature_dict) for wl in word_lists])
+    assert (x.toarray() == dense).all()
+    assert features.featurize_sparse(word_lists, feature_dict, dtype=np.uint8).dtype == np.uint8
+
+
+def test_make_arrays():
+    spams = [features.featurize(wl, feature_dict) for wl in word_lists[:1]]
+    hams = [features.featurize(wl, feature_dict) for wl in word_lists[1:]]
+    x, y = features.make_arrays(spams, hams)
+    x_sparse, y_sparse = features.make_arrays(features.featurize_sparse(word_lists[:1], feature_dict),
+                                              features.featurize_sparse(word_lists[1:], feature_dict))
+    assert (x_sparse.toarray() == x).all()
+    assert (y == [1, 0, 0, 0]).all() and (y_sparse == y).all()
+
+
+def test_featurize_hashed():
+    x = features.featurize_hashed(word_lists, n_features=64)
+    assert x.shape == (4, 64)
+    assert x[0].nnz == 3 and x[2].nnz == 0
+    assert x[0, features.hashed_indices([u'now'], 64)[0]] == x[1, features.hashed_indices([b'now'], 64)[0]] == 1
+    # stable across runs: crc32 of the utf-8 bytes
+    assert features.hashed_indices([u'free'], 2 ** 18) == [1294909896 % 2 ** 18]
+    bigrams = features.featurize_hashed(word_lists, n_features=2 ** 20, ngrams=2)
+    assert bigrams[0].nnz == 6 and bigrams[3].nnz == 1
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
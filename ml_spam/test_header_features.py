@@ -0,0 +1,31 @@
+from __future__ import absolute_import
+import email
+import re
+
+from . import header_features
+from .test_preprocess import sample_email
+
+
+def test_scan_headers():
+    message = email.message_from_string(sample_email.encode('utf-8'))
+    expected = [(name.lower(), re.sub(r'\s*\n\s*', ' ', value).strip()) for name, value in message.items()]
+    # the mbox "From " line isn't a header
+    assert [(name, value) for name, value in header_features.scan_headers(sample_email)
+            if not name.startswith('from mikeedo')] == expected
+    assert list(header_features.scan_headers(sample_email, {'received': False, 'to': True})) == [
+        (u'received', None), (u'received', None), (u'received', None), (u'to', u'<mikeedo@emailisfun.com>')]
+    assert list(header_features.scan_headers(u'Subject: hi\n  there\r\nTo: x\n\nSubject: body')) == [
+        (u'subject', u'hi there'), (u'to', u'x')]
+    assert list(header_features.scan_headers(u'')) == []
+
+
+def test_header_words():
+    assert header_features.header_words(sample_email) == [
+        u'h:received:3', u'h:from-domain:emailisfun.com', u'h:reply-to:differs']
+    headers = (u'From: "Bob" <Bob@Example.COM>\nReply-To: bob@example.com\nX-Mailer: Microsoft Outlook 6\n'
+               u'Content-Type: text/HTML;\n charset="us-ascii"\nPrecedence: bulk\n' + u'Received: x\n' * 10)
+    assert header_features.header_words(headers + u'\nthe body\nDate: not a header') == [
+        u'h:received:8', u'h:from-domain:example.com', u'h:mailer:microsoft', u'h:content-type:text/html',
+        u'h:precedence:bulk', u'h:no-to', u'h:no-date', u'h:no-message-id']
+    assert header_features.header_words(u'\n\nno headers') == [
+        u'h:received:0', u'h:no-to', u'h:no-date', u'h:no-message-id']
@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+import json
+import os
+import pstats
+
+from . import features, instrument, preprocess
+
+
+def busy(n=20000):
+    return sum(i * i for i in range(n))
+
+
+def test_spans_and_counters():
+    registry = instrument.Registry()
+    for _ in range(3):
+        with registry.span('stage one') as span:
+            busy()
+    assert span.elapsed > 0
+    registry.count('emails_loaded', 5)
+    registry.count('emails_loaded')
+    registry.gauge('answer', lambda: 42)
+    snapshot = json.loads(registry.to_json())
+    assert snapshot['timers']['stage one']['count'] == 3
+    assert snapshot['timers']['stage one']['min'] <= snapshot['timers']['stage one']['max']
+    assert snapshot['counters'] == {'emails_loaded': 6}
+    assert snapshot['gauges'] == {'answer': 42}
+
+    text = registry.to_prometheus()
+    assert 'ml_spam_stage_calls_total{stage="stage one"} 3' in text
+    assert 'ml_spam_emails_loaded_total 6' in text
+    assert '# TYPE ml_spam_answer gauge\nml_spam_answer 42' in text
+    registry.reset()
+    assert registry.snapshot()['counters'] == {}
+
+
+def test_pipeline_counters():
+    before = instrument.snapshot()['counters']
+    word_lists = preprocess.make_word_lists([b'From: a\n\nfree money now', b'From: b\n\nhello'])
+    features.featurize_sparse(word_lists, {u'free': 0, u'money': 1})
+    after = instrument.snapshot()
+    assert after['counters']['emails_preprocessed'] - before.get('emails_preprocessed', 0) == 2
+    assert after['counters']['tokens_emitted'] - before.get('tokens_emitted', 0) == 4
+    assert after['counters']['feature_rows'] - before.get('feature_rows', 0) == 2
+    assert 'stem_cache_hits' in after['gauges']
+
+
+def test_profile(tmpdir):
+    registry = instrument.Registry()
+    registry.profile(['profiled'], 'cprofile', str(tmpdir))
+    with registry.span('profiled'):
+        busy()
+    with registry.span('not profiled'):
+        busy()
+    assert os.listdir(str(tmpdir)) == ['profiled.prof']
+    assert pstats.Stats(str(tmpdir.join('profiled.prof'))).total_calls > 0
+
+    registry.profile(['*'], 'sampling', str(tmpdir.join('sampled')))
+    with registry.span('sampled/stage'):
+        busy(2000000)
+    folded = tmpdir.join('sampled', 'sampled_stage.folded').read()
+    assert 'busy' in folded
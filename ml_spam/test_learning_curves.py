@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+
+import numpy as np
+from sklearn import linear_model, naive_bayes
+
+from . import learning_curves, metrics
+
+
+def make_data(m=200, n=10, seed=0):
+    rng = np.random.RandomState(seed)
+    x = (rng.rand(m, n) > 0.5).astype(np.float64)
+    y = (x[:, 0] + x[:, 1] + (rng.rand(m) > 0.8) > 1).astype(np.float64)
+    return x, y
+
+
+def test_make_learning_curve():
+    x, y = make_data()
+    ms, f1_train, f1_cv = learning_curves.make_learning_curve(x[:150], y[:150], x[150:], y[150:],
+                                                              naive_bayes.BernoulliNB(), metrics.f1, n_points=5,
+                                                              seed=1)
+    assert ms.tolist() == [30, 60, 90, 120, 150]
+    assert f1_train.shape == f1_cv.shape == (5,)
+
+    # the same shuffles give the same curves, whether or not they run on a pool
+    curves = [learning_curves.make_learning_curve(x[:150], y[:150], x[150:], y[150:], naive_bayes.BernoulliNB(),
+                                                  metrics.f1, n_points=5, n_repeats=3, workers=workers, seed=1)
+              for workers in (1, 2)]
+    assert curves[0][1].shape == curves[0][2].shape == (3, 5)
+    for sequential, parallel in zip(curves[0], curves[1]):
+        np.testing.assert_array_equal(sequential, parallel)
+    np.testing.assert_array_equal(curves[0][1][0], f1_train)
+    np.testing.assert_array_equal(curves[0][2][0], f1_cv)
+
+
+def test_warm_start():
+    x, y = make_data()
+    classifier = linear_model.LogisticRegression(solver='lbfgs')
+    curves = [learning_curves.make_learning_curve(x[:150], y[:150], x[150:], y[150:], classifier, metrics.f1,
+                                                  n_points=4, n_repeats=2, workers=workers, seed=2, warm_start=True)
+              for workers in (1, 2)]
+    assert not classifier.warm_start
+    for sequential, parallel in zip(curves[0], curves[1]):
+        np.testing.assert_allclose(sequential, parallel)
@@ -1,5 +1,10 @@
 from __future__ import absolute_import
 
+import io
+import os
+import tarfile
+
+import numpy as np
 import pytest
 
 from . import load_data
@@ -24,5 +29,101 @@ def test_make_sets():
     for x in ham:
         assert x in ham_train or x in ham_cv or x in ham_test
 
+
+def test_split_indices():
+    labels = np.array([1] * 100 + [0] * 400)
+    train, cv, test = load_data.split_indices(labels, seed=1)
+    assert sorted(np.concatenate([train, cv, test]).tolist()) == list(range(500))
+    assert (len(train), len(cv), len(test)) == (300, 100, 100)
+    # stratified: the same fraction of spam in each set
+    assert labels[train].sum() == 60 and labels[cv].sum() == 20 and labels[test].sum() == 20
+    again = load_data.split_indices(labels, seed=1)
+    assert all((a == b).all() for a, b in zip((train, cv, test), again))
+    assert not (load_data.split_indices(labels, seed=2)[0] == train).all()
+    assert [len(s) for s in load_data.split_indices(10, train=0.5, cv=0.5)] == [5, 5, 0]
+    assert load_data.make_sets(range(10), range(20), seed=3) == load_data.make_sets(range(10), range(20), seed=3)
+    # each group (here pairs of samples) in one set
+    groups = np.arange(500) // 2 * 2
+    sets = load_data.split_indices(labels, seed=1, groups=groups)
+    assert sorted(np.concatenate(sets).tolist()) == list(range(500))
+    assert [len(s) for s in sets] == [300, 100, 100]
+    assert all((np.in1d(s, s ^ 1)).all() for s in sets)
+
+
+def make_archive(path, emails):
+    """Write emails into a .tar.bz2 laid out like the SpamAssassin ones."""
+    with tarfile.open(path, 'w:bz2') as f:
+        for i, email in enumerate(emails):
+            info = tarfile.TarInfo('spam/{:05d}.{}'.format(i, i))
+            info.size = len(email)
+            f.addfile(info, io.BytesIO(email))
+
+
+def test_iter_spamassassin_tbz(tmpdir):
+    path = str(tmpdir.join('20021010_spam.tar.bz2'))
+    emails = [b'header: %d\n\nbody %d' % (i, i) for i in range(5)]
+    make_archive(path, emails)
+    records = list(load_data.iter_spamassassin_tbz(path, load_data.SPAM))
+    assert [r.email for r in records] == emails
+    assert all(r.label == load_data.SPAM and r.source_archive == '20021010_spam.tar.bz2' for r in records)
+    assert records[0].member_name == 'spam/00000.0'
+    assert load_data.load_spamassassin_tbz(path, max_emails=2) == emails[:2]
+
+
+def test_parallel_decompression(tmpdir, monkeypatch):
+    monkeypatch.setattr(load_data, 'spam_path', str(tmpdir.mkdir('spam')))
+    monkeypatch.setattr(load_data, 'ham_path', str(tmpdir.mkdir('ham')))
+    for label, path in load_data.spamassassin_archives():
+        make_archive(path, [b'%s %d' % (path.encode(), i) for i in range(7)])
+    archives = load_data.spamassassin_archives()
+    batches = list(load_data.iter_archive_batches(archives, workers=3, batch_size=3))
+    assert all(0 < len(b) <= 3 and len(set(r.source_archive for r in b)) == 1 for b in batches)
+    records = [r for b in batches for r in b]
+    assert len(records) == 7 * len(archives)
+    for label, path in archives:
+        mine = [r for r in records if r.source_archive == os.path.basename(path)]
+        assert [r.email for r in mine] == [b'%s %d' % (path.encode(), i) for i in range(7)]
+        assert all(r.label == label for r in mine)
+    assert load_data.load_all_spamassassin(workers=4) == load_data.load_all_spamassassin()
+
+
+def _die(tasks, results, batch_size):
+    os._exit(3)
+
+
+def test_dead_decompression_worker(tmpdir, monkeypatch):
+    monkeypatch.setattr(load_data, '_decompress_archives', _die)
+    monkeypatch.setattr(load_data, 'worker_poll_seconds', 0.05)
+    path = str(tmpdir.join('20021010_spam.tar.bz2'))
+    make_archive(path, [b'body'])
+    with pytest.raises(RuntimeError, match='exit code 3'):
+        list(load_data.iter_archive_batches([(load_data.SPAM, path)], workers=1))
+
+
+mbox = (b'From alice@example.com Mon Jan  1 00:00:00 2018\n'
+        b'Subject: one\n\nhello\n>From the start\n\n'
+        b'From bob@example.com Tue Jan  2 00:00:00 2018\n'
+        b'Subject: two\n\nbye\n')
+
+
+def test_iter_mbox(tmpdir):
+    path = tmpdir.join('inbox')
+    path.write_binary(mbox)
+    records = list(load_data.iter_mbox(str(path), label=load_data.HAM))
+    assert [r.email for r in records] == [b'Subject: one\n\nhello\nFrom the start\n', b'Subject: two\n\nbye\n']
+    assert [r.member_name for r in records] == ['0', str(mbox.index(b'From bob'))]
+    assert all(r.label == load_data.HAM and r.source_archive == 'inbox' for r in records)
+    assert len(list(load_data.iter_mailbox(str(path), max_emails=1))) == 1
+
+
+def test_iter_maildir(tmpdir):
+    for sub, name, email in [('cur', '2.b:2,S', b'second'), ('cur', '1.a:2,S', b'first'), ('new', '3.c', b'third')]:
+        tmpdir.join('Maildir', sub).ensure(dir=True).join(name).write_binary(email)
+    tmpdir.join('Maildir', 'tmp').ensure(dir=True).join('4.d').write_binary(b'not delivered yet')
+    records = list(load_data.iter_mailbox(str(tmpdir.join('Maildir'))))
+    assert [r.email for r in records] == [b'first', b'second', b'third']
+    assert records[0].member_name == 'cur/1.a:2,S' and records[0].source_archive == 'Maildir'
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
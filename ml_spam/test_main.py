@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from . import load_data, main
+from .test_load_data import make_archive
+
+
+def test_classifier_backends():
+    rng = np.random.RandomState(0)
+    x = sparse.csr_matrix((rng.rand(120, 20) > 0.7).astype(np.float64))
+    y = ((x[:, 0] + x[:, 1]).toarray().ravel() > 0).astype(np.float64)
+    for name in main.classifiers:
+        clf, timings = main.train_and_evaluate(x[:80], y[:80], x[80:100], y[80:100], x[100:], y[100:], classifier=name)
+        assert (clf.predict(x[100:]) == y[100:]).mean() > 0.8
+        assert set(timings) == {'fit', 'predict cv', 'predict test'}
+    with pytest.raises(ValueError):
+        main.make_classifier('perceptron')
+
+
+@pytest.fixture
+def archives(tmpdir, monkeypatch):
+    """Small SpamAssassin-like archives of emails of a few random words, 5 + i of them in archive i, and then i % 4
+    copies of some of those."""
+    monkeypatch.setattr(load_data, 'spam_path', str(tmpdir.mkdir('spam')))
+    monkeypatch.setattr(load_data, 'ham_path', str(tmpdir.mkdir('ham')))
+    rng = np.random.RandomState(0)
+    words = [a + b for a in (b'red', b'blue', b'green', b'gold') for b in (b'fox', b'cat', b'owl', b'elk', b'bee')]
+    for i, (label, path) in enumerate(load_data.spamassassin_archives()):
+        emails = [b'Subject: hi\n\n' + b' '.join(rng.choice(words, 8)) for _ in range(5 + i)]
+        make_archive(path, emails + emails[1:1 + i % 4])
+    return load_data.spamassassin_archives()
+
+
+@pytest.mark.parametrize('duplicates', [None, 'collapse', 'group'])
+def test_prep_data_stream(archives, monkeypatch, duplicates):
+    expected = main.prep_data('hashing', check_and_download=False, use_cache=False, seed=1, duplicates=duplicates)
+    # parallel decompression gives the archives in any order, keeping the order within each
+    iter_all = load_data.iter_all_spamassassin
+    monkeypatch.setattr(load_data, 'iter_all_spamassassin', lambda workers=1: iter(
+        sorted(iter_all(workers), key=lambda r: r.source_archive, reverse=True)))
+    sets = main.prep_data('hashing', check_and_download=False, workers=3, stream=True, use_cache=False, seed=1,
+                          duplicates=duplicates)
+    for a, b in zip(expected, sets):
+        assert (a != b).nnz == 0 if sparse.issparse(a) else np.array_equal(a, b)
+    if duplicates == 'collapse':
+        assert sum(len(y) for y in sets[1::2]) == sum(5 + i for i in range(len(archives)))
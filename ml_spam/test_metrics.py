@@ -0,0 +1,31 @@
+from __future__ import absolute_import, division
+
+import numpy as np
+
+from . import metrics
+
+
+def test_confusion_matrix():
+    labels = np.array([1, 1, 1, 0, 0, 1, 0, 0, 1])
+    predictions = np.array([1., 0., 1., 0., 1., 1., 0., 0., 0.])
+    cm = metrics.confusion_matrix(labels, predictions)
+    assert cm.tolist() == [[3, 1], [2, 3]]
+    assert metrics.accuracy(labels, predictions) == 6 / 9
+    assert metrics.precision(labels, predictions) == 3 / 4
+    assert metrics.recall(labels, predictions) == 3 / 5
+    assert np.isclose(metrics.f1(labels, predictions), 2 * (3 / 4) * (3 / 5) / (3 / 4 + 3 / 5))
+
+
+def test_threshold_curve():
+    rng = np.random.RandomState(0)
+    labels = rng.rand(500) > 0.6
+    scores = np.round(labels + rng.randn(500), 1)  # rounded so there are ties
+    thresholds, precision, recall, f1 = metrics.threshold_curve(labels, scores)
+    assert (np.diff(thresholds) < 0).all()
+    assert set(thresholds) == set(scores)
+    for i in range(0, len(thresholds), 7):
+        predictions = scores >= thresholds[i]
+        assert np.isclose(precision[i], metrics.precision(labels, predictions))
+        assert np.isclose(recall[i], metrics.recall(labels, predictions))
+        assert np.isclose(f1[i], metrics.f1(labels, predictions))
+    assert recall[-1] == 1
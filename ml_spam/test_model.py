@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from sklearn import linear_model, naive_bayes
+
+from . import features, model, preprocess
+
+emails = [u'From: a@b.com\n\nbuy cheap pills now, free money at http://spam.com',
+          u'From: c@d.org\n\nthe meeting is moved to monday, see the agenda',
+          u'From: e@f.net\n\nfree free free, win $1000 now',
+          u'From: g@h.edu\n\nminutes of the meeting and the agenda for next week']
+labels = np.array([1, 0, 1, 0])
+
+
+def train(classifier, feature_dict=None, sparse=True):
+    word_lists = preprocess.make_word_lists(emails)
+    if feature_dict is None:
+        x = features.featurize_hashed(word_lists, 64)
+    else:
+        x = features.featurize_sparse(word_lists, feature_dict)
+    classifier.fit(x if sparse else x.toarray(), labels)
+    return model.Model(classifier, feature_dict, n_features=64, sparse=sparse)
+
+
+def test_linear_bundle(tmpdir):
+    word_lists = preprocess.make_word_lists(emails)
+    feature_dict = features.make_feature_dict(sorted(features.count_words(word_lists)))
+    m = train(linear_model.LogisticRegression(solver='lbfgs'), feature_dict)
+    path = str(tmpdir.join('bundle'))
+    m.save(path)
+    assert os.path.exists(os.path.join(path, 'coef.npy')) and not os.path.exists(os.path.join(path, 'classifier.pkl'))
+    loaded = model.Model.load(path)
+    assert isinstance(loaded.classifier, model.LinearClassifier)
+    assert loaded.feature_dict == feature_dict
+    assert (loaded.predict(emails) == m.predict(emails)).all()
+    np.testing.assert_allclose(loaded.score(emails), m.score(emails))
+
+
+def test_pickled_bundle(tmpdir):
+    m = train(naive_bayes.BernoulliNB(), sparse=False)
+    path = str(tmpdir.join('bundle'))
+    m.save(path)
+    assert os.path.exists(os.path.join(path, 'classifier.pkl'))
+    loaded = model.Model.load(path, mmap=False)
+    assert not isinstance(loaded.classifier, model.LinearClassifier)
+    assert loaded.feature_dict is None and loaded.n_features == 64 and not loaded.sparse
+    assert (loaded.predict(emails) == m.predict(emails)).all()
+
+    # saving another kind of classifier over it leaves none of its files behind
+    train(linear_model.LogisticRegression(solver='lbfgs')).save(path)
+    assert sorted(os.listdir(path)) == ['classes.npy', 'coef.npy', 'intercept.npy', 'manifest.json']
+
+
+def test_headers_bundle(tmpdir):
+    word_lists = preprocess.make_word_lists(emails, headers=True)
+    feature_dict = features.make_feature_dict(sorted(features.count_words(word_lists)))
+    classifier = linear_model.LogisticRegression(solver='lbfgs').fit(
+        features.featurize_sparse(word_lists, feature_dict), labels)
+    m = model.Model(classifier, feature_dict, headers=True)
+    assert m.fingerprint == preprocess.fingerprint(headers=True)
+    assert m.featurize(emails)[:, feature_dict[u'h:from-domain:b.com']].toarray().ravel().tolist() == [1, 0, 0, 0]
+    path = str(tmpdir.join('bundle'))
+    m.save(path)
+    loaded = model.Model.load(path)
+    assert loaded.headers
+    np.testing.assert_allclose(loaded.score(emails), m.score(emails))
+
+
+def test_version_checks(tmpdir):
+    path = str(tmpdir.join('bundle'))
+    train(linear_model.LogisticRegression(solver='lbfgs')).save(path)
+    manifest_path = os.path.join(path, 'manifest.json')
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['preprocess_fingerprint'] = 'f' * 40
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        model.Model.load(path)
+    assert model.Model.load(path, check_fingerprint=False).fingerprint == 'f' * 40
+    manifest['format_version'] = model.format_version + 1
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        model.Model.load(path, check_fingerprint=False)
+
+
+def test_load_without_nltk(tmpdir):
+    path = str(tmpdir.join('bundle'))
+    train(linear_model.LogisticRegression(solver='lbfgs')).save(path)
+    # in a fresh interpreter, as this one has imported nltk to stem
+    code = 'import sys; from ml_spam import model; model.Model.load({!r}); print("nltk" in sys.modules)'.format(path)
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.check_output([sys.executable, '-c', code], cwd=repo).decode('utf-8').strip() == 'False'
+
+
+def test_odd_feature_words(tmpdir):
+    # only '\n' separates the words in features.txt, so the indices still line up with the weights
+    feature_dict = {u'free': 0, u'a\rb': 1, u'\u2028': 2, u'meeting': 3}
+    m = train(linear_model.LogisticRegression(solver='lbfgs'), feature_dict)
+    path = str(tmpdir.join('bundle'))
+    m.save(path)
+    loaded = model.Model.load(path)
+    assert loaded.feature_dict == feature_dict
+    np.testing.assert_allclose(loaded.score(emails), m.score(emails))
@@ -0,0 +1,47 @@
+from __future__ import absolute_import
+import os
+
+import numpy as np
+import pytest
+
+from . import load_data, model, online
+
+spams = [b'Subject: hi\n\nbuy cheap pills now, free money', b'Subject: win\n\nfree free free, win $1000 now']
+hams = [b'Subject: re: meeting\n\nthe meeting is moved to monday', b'Subject: minutes\n\nthe agenda for next week']
+
+
+def records(n):
+    spam = (load_data.EmailRecord(load_data.SPAM, 'spam', str(i), spams[i % 2]) for i in range(n))
+    ham = (load_data.EmailRecord(load_data.HAM, 'ham', str(i), hams[i % 2]) for i in range(n))
+    return online.interleave(spam, ham)
+
+
+def test_interleave():
+    assert list(online.interleave('abc', 'd', 'ef')) == list('adebfc')
+
+
+def test_online_trainer(tmpdir):
+    path = str(tmpdir.join('checkpoint'))
+    trainer = online.OnlineTrainer(path, checkpoint_every=40, n_features=256)
+    assert trainer.train(records(30), batch_size=10) == 60
+    assert trainer.n_seen == 60
+    assert os.path.exists(os.path.join(path, 'manifest.json'))
+    # the checkpoint was after 40 emails
+    assert online.OnlineTrainer.resume(path).n_seen == 40
+
+    trainer.checkpoint()
+    m = model.Model.load(path)
+    assert m.predict(spams + hams).tolist() == [1, 1, 0, 0]
+    np.testing.assert_allclose(m.score(spams + hams), trainer.model().score(spams + hams))
+
+    resumed = online.OnlineTrainer.resume(path)
+    assert resumed.n_seen == 60 and resumed.n_features == 256
+    resumed.train(records(5), batch_size=10, workers=2)
+    assert resumed.n_seen == 70
+
+
+def test_no_checkpoint_path():
+    trainer = online.OnlineTrainer(n_features=256)
+    trainer.train(records(30), batch_size=10)
+    with pytest.raises(ValueError):
+        trainer.checkpoint()
@@ -92,6 +92,96 @@ def test_full():
                    u'too',]
 
 
+def test_tokenize():
+    def sequential(email):
+        return [w for w in preprocess.to_list(preprocess.clean(preprocess.normalize(preprocess.lower(
+            preprocess.strip_header(email))))) if w]
+    assert list(preprocess.tokenize(sample_email)) == sequential(sample_email)
+    assert list(preprocess.tokenize(u'no header')) == []
+    for body in [u'some <html stuff> $cash money $$</stuff>',
+                 u'this has some n123umbers in23 23 it',
+                 u'mail me:someone@example.com or see <a href=3Dhttp://example.com/x>here</a>',
+                 u'foo<br>bar@baz.com, then https://example.com/<b>bold</b> and more_words_here']:
+        email = u'header: stuff\n\n' + body
+        assert list(preprocess.tokenize(email)) == sequential(email)
+    for body in messy_bodies:
+        email = u'Subject: x\n\n' + body
+        assert list(preprocess.tokenize(email)) == sequential(email)
+    # malformed markup is where the two differ, see tokenize
+    assert list(preprocess.tokenize(u'h\n\n<a href=<b>>x')) == [u'a', u'href', u'x']
+    assert sequential(u'h\n\n<a href=<b>>x') == [u'x']
+
+
+# HTML spam, a mailing list reply and a MIME part, with the kind of markup, addresses and URLs found in the corpus
+messy_bodies = [
+    u'''<html><head><title>Special Offer!</title></head>
+<body bgcolor=3D"#FFFFFF"><table width=3D"100%" border=3D0><tr><td>
+<font face=3D"Arial" size=3D2><b>Dear Friend,</b><br><br>
+Make $5,000 a week from home!!! Click <a href=3D"http://www.cash4u.biz/?id=3D123">here</a>
+or write to <a href=3D"mailto:offers@cash4u.biz">offers@cash4u.biz</a>.&nbsp;&nbsp;
+<img src=3D"http://www.cash4u.biz/img/logo.gif" width=3D1 height=3D1></td></tr></table>
+To be removed: <a href="http://remove.cash4u.biz/remove.php?e=you@example.com">unsubscribe</a>
+</font></body></html>''',
+    u'''On Tue, 27 Aug 2002, John Doe <jdoe@example.org> wrote:
+> Has anyone tried the 2.4.19 kernel with the new patch?
+> See http://lists.example.org/pipermail/devel/2002-August/001234.html
+Yes -- it works for me (gcc 2.95.3). Cost me $0, as usual ;-)
+--
+_______________________________________________
+Devel mailing list  devel@lists.example.org
+https://lists.example.org/mailman/listinfo/devel''',
+    u'''<p>Price: <b>$19.95</b> (was $49.95)</p><ul><li>100% FREE</li><li>No obligation</li></ul>
+<div style="display:none">random words here</div><!-- comment -->
+Contact: sales@buy-now.com, support@buy-now.com<br/>
+<span>Call 1-800-555-0199 now!</span> <a href='https://secure.buy-now.com/order?x=1&y=2'>ORDER</a>''',
+    u'''=20
+This is a multi-part message in MIME format.
+------=_NextPart_000_0005_01C24E7C.5A1B2C30
+Content-Type: text/plain; charset="iso-8859-1"
+Content-Transfer-Encoding: quoted-printable
+
+Hello,=20
+visit www.example.com or email <info@example.com> for details. Thanks!
+<http://www.example.com/a/b?c=d>
+''',
+]
+
+
+def test_stem_cache(tmpdir):
+    cache = preprocess.StemCache(preprocess.stemmer, maxsize=2)
+    assert cache.stem(u'longing') == u'long'
+    assert cache.stem(u'longing') == u'long'
+    assert cache.stats() == {'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 1, 'evictions': 0}
+    cache.stem(u'things')
+    cache.stem(u'longing')  # now 'things' is the least recently used
+    cache.stem(u'sentence')
+    assert u'things' not in cache
+    assert u'longing' in cache and u'sentence' in cache
+    assert cache.evictions == 1
+
+    filename = str(tmpdir.join('stems.pickle'))
+    cache.save(filename)
+    warm = preprocess.StemCache(preprocess.stemmer, maxsize=1)
+    warm.load(filename)
+    assert len(warm) == 1 and u'sentence' in warm
+    assert warm.stem(u'sentence') == u'sentenc'
+    assert warm.stats()['hits'] == 1
+
+
+def test_make_word_lists():
+    emails = [sample_email, u'header\n\nsome words $100', u'no body', u'h\n\nhttp://example.com lots of longing']
+    expected = [preprocess.make_word_list(e) for e in emails]
+    assert preprocess.make_word_lists(emails) == expected
+    assert preprocess.make_word_lists(emails, workers=2, chunksize=1) == expected
+    assert preprocess.make_word_lists(iter(emails), workers=3) == expected
+    assert list(preprocess.iter_word_lists(iter(emails))) == expected
+    assert list(preprocess.iter_word_lists(iter(emails * 5), workers=2, chunksize=3)) == expected * 5
+    with_headers = [preprocess.make_word_list(e, headers=True) for e in emails]
+    assert with_headers[0] == expected[0] + [u'h:received:3', u'h:from-domain:emailisfun.com', u'h:reply-to:differs']
+    assert preprocess.make_word_lists(emails, workers=2, chunksize=1, headers=True) == with_headers
+    assert list(preprocess.iter_word_lists(iter(emails), workers=2, chunksize=1, headers=True)) == with_headers
+    assert preprocess.fingerprint(headers=True) != preprocess.fingerprint()
+
 
 # sample spam email from SpamAssassin public corpus
 sample_email = u'''From mikeedo@emailisfun.com  Wed Jun 27 04:56:45 2001
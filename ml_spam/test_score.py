@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+import os
+import subprocess
+import sys
+import threading
+
+from sklearn import linear_model
+
+from . import features, model, preprocess, score, serve
+
+emails = [b'Subject: hi\n\nbuy cheap pills now, free money at http://spam.com',
+          b'Subject: re: meeting\n\nthe meeting is moved to monday, see the agenda',
+          b'Subject: win\n\nfree free free, win $1000 now',
+          b'Subject: minutes\n\nminutes of the meeting and the agenda for next week']
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds; importing the slim entry point should take a few tens of ms
+import_budget = 0.5
+
+
+def imports(module):
+    """Import a module in a fresh interpreter; get the time it took and the heavy modules it pulled in."""
+    code = ('import sys, time; t = time.time(); import {}; t = time.time() - t; '
+            'print(t); print(" ".join(m for m in ("numpy", "scipy", "sklearn", "nltk", "matplotlib") '
+            'if m in sys.modules))').format(module)
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=repo).decode('utf-8').split('\n')
+    return float(out[0]), out[1].split()
+
+
+def test_import_budget():
+    seconds, heavy = imports('ml_spam.score')
+    assert heavy == []
+    assert seconds < import_budget
+    assert 'nltk' not in imports('ml_spam.preprocess')[1]
+    assert 'matplotlib' not in imports('ml_spam.main')[1]
+
+
+def make_model():
+    x = features.featurize_hashed(preprocess.make_word_lists(emails), 64)
+    return model.Model(linear_model.LogisticRegression(solver='lbfgs').fit(x, [1, 0, 1, 0]), n_features=64)
+
+
+def test_score(tmpdir):
+    m = make_model()
+    expected = [(int(p), s) for p, s in zip(m.predict(emails), m.score(emails))]
+    bundle = str(tmpdir.join('bundle'))
+    m.save(bundle)
+    local = score.score_local(emails, bundle)
+    assert [p for p, _ in local] == [p for p, _ in expected]
+
+    server = serve.UnixScoringServer(str(tmpdir.join('socket')), serve.Batcher(m))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conn = score.UnixHTTPConnection(str(tmpdir.join('socket')))
+        remote = score.score_remote(emails, conn)
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.batcher.close()
+        thread.join()
+    assert [p for p, _ in remote] == [p for p, _ in expected]
+    for (_, a), (_, b) in zip(remote, expected):
+        assert abs(a - b) < 1e-9
+
+    paths = []
+    for i, email in enumerate(emails):
+        paths.append(str(tmpdir.join('email{}'.format(i))))
+        with open(paths[-1], 'wb') as f:
+            f.write(email)
+    assert score.main(['--bundle', bundle] + paths) == 0
+    assert score.main(['--bundle', bundle, '--exit-status'] + paths) == 1
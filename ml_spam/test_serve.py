@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+import json
+import threading
+
+import numpy as np
+from sklearn import linear_model
+
+from . import features, model, preprocess, serve
+
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+emails = [b'From: a@b.com\n\nbuy cheap pills now, free money at http://spam.com',
+          b'From: c@d.org\n\nthe meeting is moved to monday, see the agenda',
+          b'From: e@f.net\n\nfree free free, win $1000 now',
+          b'From: g@h.edu\n\nminutes of the meeting and the agenda for next week']
+
+
+def make_model():
+    x = features.featurize_hashed(preprocess.make_word_lists(emails), 64)
+    return model.Model(linear_model.LogisticRegression(solver='lbfgs').fit(x, [1, 0, 1, 0]), n_features=64)
+
+
+def test_batcher():
+    m = make_model()
+    expected = m.predict(emails).tolist()
+    batcher = serve.Batcher(m, max_batch=3, max_wait=0.05)
+    results = [None] * 12
+
+    def score(i):
+        results[i] = batcher.score(emails[i % 4])
+
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+    assert [spam for spam, _ in results] == expected * 3
+    np.testing.assert_allclose([score for _, score in results], np.tile(m.score(emails), 3))
+    sizes = batcher.batch_sizes.percentiles(ps=(100,))['batch']
+    assert sizes['p100'] <= 3 and sizes['count'] >= 4
+    assert set(batcher.stats.percentiles()) == {'queue', 'preprocess', 'featurize', 'classify', 'total'}
+
+
+def test_server():
+    m = make_model()
+    server = serve.ScoringServer(('127.0.0.1', 0), serve.Batcher(m))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conn = HTTPConnection(*server.server_address)
+        for email, spam in zip(emails, m.predict(emails)):
+            conn.request('POST', '/score', email)
+            response = conn.getresponse()
+            assert response.status == 200
+            assert json.loads(response.read().decode('utf-8'))['spam'] == spam
+        conn.request('GET', '/stats')
+        stats = json.loads(conn.getresponse().read().decode('utf-8'))
+        assert stats['latency_ms']['total']['count'] == 4
+        conn.request('GET', '/nothing')
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 404
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.batcher.close()
+        thread.join()